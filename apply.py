@@ -1,11 +1,27 @@
 import os
+import errno
+import queue
+import filecmp
+import asyncio
+import threading
 from pathlib import Path
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from options import Options
 from determine import Determine
 from nzbget_utils import logdet, loginf, logwar, logerr
+from similarity import SimilarityIndex
+from subtitles import SubtitleLanguageDetector
+from transfer import TransferEngine
+from placement import Placement
+from scheduler import IOScheduler
+from plan import Move, MovePlan
+from journal import MoveJournal
+from timing import timed, timings
+from metrics import MetricsFile
+from memory import MemoryBudget
+from knowledge import KnowledgeCache
+from library import LibraryIndex
 import traceback
-import difflib
 import sys
 
 sys.path.insert(0, str(Path(__file__).resolve().parent / "lib"))
@@ -15,10 +31,23 @@ import guessit
 class Apply:
     PREVIEW_PREFIX = "[PREVIEW] "
 
+    # Suffix of the JSON file with the timings of a job, next to its journal
+    TIMINGS_SUFFIX = ".deobfuscationsort.timings.json"
+
+    # Number of planned releases which wait to be moved in streaming mode
+    STREAM_QUEUE = 2
+
+    # Whether the cleanup can remove entries relative to directory file descriptors
+    _CLEANUP_DIR_FD = (
+        os.scandir in os.supports_fd
+        and {os.open, os.unlink, os.rmdir} <= os.supports_dir_fd
+    )
+
     def __init__(self, options: Options = None):
         self.options = options if options else Options()
         self.nzb_properties = self.options.nzb_properties
         self.processing_parameters = self.options.processing_parameters
+        self.compiled = self.options.compiled
 
         if not self.options.preview:
             Apply.PREVIEW_PREFIX = ""
@@ -33,48 +62,180 @@ class Apply:
         self.moved_src_files = []
         # List of moved files (destination path)
         self.moved_dst_files = []
+        # The moves of the lists above which have not been forgotten, for hashed
+        # lookups: source path -> destination path, and the destination paths. The
+        # lists keep the order of FINALDIR, and the entries of forgotten moves are
+        # skipped when they are read
+        self.moved_sources = {}
+        self.moved_destinations = set()
+
+        # Names of the entries of destination directories, listed once per job, and
+        # the names of the planned destinations in these directories
+        self.directory_names = {}
+
+        # Directories which are known to exist, either listed while planning or
+        # created by this process, so that they are not created again for every file
+        self.existing_dirs = set()
+
+        # Determine instance of the current job
+        self.determine = None
+
+        # Similarity index over the names of the job's video files
+        self.video_index = None
+
+        # Satellite files assigned to each video file
+        self.satellites = {}
+
+        # Satellite extensions that are subtitles and may carry a language suffix:
+        # all but NFO files, which are matched by their contents
+        self.subtitle_extensions = frozenset(
+            self.processing_parameters.satellite_extensions
+        ) - {"nfo"}
+
+        # Subtitle language detector, created when the first subtitle is guessed
+        self.subtitle_detector = None
+
+        # Copies files that cannot be renamed, e.g. to another file system
+        self.transfer = TransferEngine(sync=self.options.transfer_sync)
+
+        # Places the files at their destination (move, hardlink, reflink or symlink)
+        self.placement = Placement(self.options.placement, self.transfer)
+
+        # Write-ahead journal of the moves of the job
+        self.journal = None
+
+        # Words of the NFO files read ahead of `deep_scan_nfo` in asyncio mode
+        self.nfo_words = {}
+
+        # Memory used by the job, checked against the "MemoryLimit" option
+        self.memory = MemoryBudget(self.options.memory_limit)
+
+        # Titles and folders learned from earlier sorts, and what the sorts of the
+        # job learned, recorded once their video files have been moved
+        self.knowledge = None
+        if self.options.knowledge_file:
+            self.knowledge = KnowledgeCache(
+                self.options.knowledge_file, read_only=self.options.preview
+            )
+        self.sort_records = {}
+
+        # Existing folders of the library, to which the destinations snap
+        self.library = None
+        if self.options.library_index_file:
+            self.library = LibraryIndex(
+                (
+                    self.processing_parameters.movies_dir,
+                    self.processing_parameters.series_dir,
+                    self.processing_parameters.dated_dir,
+                    self.processing_parameters.othertv_dir,
+                ),
+                self.options.library_index_file,
+            )
+
+        # The metrics are taken from the timings of the job
+        if self.options.timings != "no" or self.options.metrics_file:
+            timings.enable()
+
+    def _error(self, e: Exception):
+        """Records that the job failed because of `e`, counted by its type."""
+        self.errors = True
+        timings.add(f"errors.{type(e).__name__}")
+
+    def _directory_names(self, directory: Path) -> set:
+        """Returns the names which are taken in `directory`: its entries and the
+        destinations of the moves planned into it. The directory is listed with a
+        single `scandir` and cached for the job.
+        """
+        names = self.directory_names.get(directory)
+        if names is None:
+            names = self._add_directory_listing(
+                directory, Apply._list_directory(directory)
+            )
+        return names
+
+    @staticmethod
+    def _list_directory(directory: Path):
+        """Returns the set of the names of the entries of `directory`, or None if it
+        does not exist."""
+        try:
+            with os.scandir(directory) as entries:
+                return {entry.name for entry in entries}
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _add_directory_listing(self, directory: Path, names) -> set:
+        """Caches the listing of `directory` returned by `_list_directory`."""
+        if names is None:
+            names = set()
+        else:
+            self.existing_dirs.add(directory)
+        self.directory_names[directory] = names
+        return names
+
+    def _is_taken(self, dst_file: Path) -> bool:
+        """Checks if `dst_file` exists or is the destination of a planned move.
+        Names missing from the listing are checked with `exists()` before they are
+        declared free, so that a file whose name only differs in case is found on a
+        case-insensitive file system."""
+        # In streaming mode, the directory is listed again for every release, and
+        # the moves planned for earlier releases may not have been executed yet
+        return (
+            dst_file.name in self._directory_names(dst_file.parent)
+            or dst_file in self.moved_destinations
+            or dst_file.exists()
+        )
 
     def unique_name(self, dst_file: Path) -> Path:
         """Adds unique numeric suffix to destination file name to avoid overwriting
         such as "filename.(2).ext", "filename.(3).ext", etc.
         If an existing file was created by the script it is renamed to "filename.(1).ext".
         """
-        parent = dst_file.parent
-        stem = dst_file.stem
+        stem = f"{dst_file.stem}{self.determine.dupe_separator}"
         suffix = dst_file.suffix
         suffix_num = 2
-        while True:
-            unique_path = (
-                parent / f"{stem}{self.determine.dupe_separator}({suffix_num}){suffix}"
-            )
-            if not unique_path.exists() and unique_path not in self.moved_dst_files:
-                break
+        while self._is_taken(dst_file.parent / f"{stem}({suffix_num}){suffix}"):
             suffix_num += 1
-        return unique_path
+        return dst_file.parent / f"{stem}({suffix_num}){suffix}"
+
+    def _make_directory(self, directory: Path):
+        """Creates `directory` and its parents unless they are known to exist."""
+        if directory in self.existing_dirs:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        self.existing_dirs.add(directory)
+        self.existing_dirs.update(directory.parents)
+
+    def _make_directories(self, moves):
+        """Creates the destination directories of `moves` up front, once each."""
+        for directory in dict.fromkeys(move.dst.parent for move in moves):
+            try:
+                self._make_directory(directory)
+            except OSError as e:
+                # Reported by the move into the directory
+                logdet(f'_make_directories: cannot create "{directory}": {e}')
 
     def _move_file_impl(self, src_file: Path, dst_file: Path):
-        try:
-            if not self.options.preview:
-                # Create the path to the destination file
-                dst_file.parent.mkdir(parents=True, exist_ok=True)
-                src_file.rename(dst_file)
-            logdet(
-                f'{Apply.PREVIEW_PREFIX}_move_file_impl:  "{src_file}".rename("{dst_file}") OK'
-            )
-        except OSError as ex:
-            logdet(f"_move_file_impl: rename failed;use shutil.copyfile ({ex})")
-            if not self.options.preview:
-                shutil.copyfile(src_file, dst_file)
-            logdet(
-                f'{Apply.PREVIEW_PREFIX}_move_file_impl: shutil.copyfile("{src_file}", "{dst_file}") OK'
-            )
-            if not self.options.preview:
-                src_file.unlink()
-            logdet(f'{Apply.PREVIEW_PREFIX}_move_file_impl: "{src_file}".unlink() OK')
+        # Create the path to the destination file
+        self._make_directory(dst_file.parent)
+        size = src_file.stat().st_size if timings.enabled else 0
+        method = self.placement.place(src_file, dst_file)
+        timings.add(f"placed_files.{method}")
+        timings.add(f"placed_bytes.{method}", size)
+        logdet(f'_move_file_impl: {method}("{src_file}", "{dst_file}") OK')
+
+    def plan_move(self, src_file, dest_file, reason: str, video: Path = None) -> Move:
+        """Decides where the file is moved to without touching the file system.
+        The destination is reserved in `moved_destinations`, so that the unique names
+        of all files of a job are decided in the order in which they are planned.
 
-    def move_file(self, src_file, dest_file):
-        """Moves the file to its sorted location.
-        It creates directories to `dest_file` and moves the file from `src_file` there.
+        Args:
+            src_file (Path): The file to move.
+            dest_file (Path): The destination constructed from the format.
+            reason (str): Why the file is moved to `dest_file`.
+            video (Path, optional): For satellites, the video file they belong to.
+
+        Returns:
+            Move: The planned move.
         """
         # Ensure the arguments are Path objects
         if not isinstance(src_file, Path):
@@ -84,166 +245,423 @@ class Apply:
 
         assert src_file.is_file()
 
-        if dest_file.exists() or dest_file in self.moved_dst_files:
-            assert dest_file.is_file()
-            if self.options.overwrite and dest_file not in self.moved_dst_files:
+        overwrite = False
+        unique = False
+        if self._is_taken(dest_file):
+            assert dest_file in self.moved_destinations or dest_file.is_file()
+            if self.options.overwrite and dest_file not in self.moved_destinations:
                 # Overwrite existing file
                 loginf(
-                    f'move_file: overwrite={self.options.overwrite} and "{dest_file}" not in {self.moved_dst_files}'
+                    f'move_file: overwrite={self.options.overwrite} and "{dest_file}" was not moved by this job'
                 )
-                if not self.options.preview:
-                    dest_file.unlink()
-                loginf(f'{Apply.PREVIEW_PREFIX}move_file: "{dest_file}".unlink() OK')
-                self._move_file_impl(src_file, dest_file)
+                overwrite = True
             else:
                 # Cannot overwrite existing file because either overwrite is disabled or
                 # the destination file was created by the script.
                 # Rename to a unique filename instead
                 dest_file = self.unique_name(dest_file)
+                unique = True
                 loginf(
-                    f'move_file: overwrite={self.options.overwrite}: recursively call move_file("{src_file}", "{dest_file}")'
+                    f'move_file: overwrite={self.options.overwrite}: use unique name "{dest_file}" for "{src_file}"'
                 )
-                self.move_file(src_file, dest_file)
-        else:
-            # Destination file does not exist and is not in the list of moved files
-            self._move_file_impl(src_file, dest_file)
-            loginf(f'move_file: _move_file_impl("{src_file}", "{dest_file}") OK')
-        self.moved_src_files.append(src_file)
-        self.moved_dst_files.append(dest_file)
-        logdet(f"move_file: file at dest_file is {Apply._file_size_human(dest_file)}")
-        logdet(f"move_file: returning {dest_file}")
-        return dest_file
-
-    def move_satellites(self, src_file: Path, dest_file: Path):
-        """Moves satellite files such as subtitles that are associated with the base video
-        and stored in the video's directory (or subdirectories) to the correct destination.
+        move = Move(src_file, dest_file, reason, overwrite, unique, video)
+        self._record_move(move)
+        self._directory_names(dest_file.parent).add(dest_file.name)
+        return move
+
+    def _record_move(self, move: Move):
+        """Adds `move` to the lists of moved files. A file renamed to a unique name
+        is added twice, so its directory is listed twice in FINALDIR."""
+        for _ in range(2 if move.unique else 1):
+            self.moved_src_files.append(move.src)
+            self.moved_dst_files.append(move.dst)
+        self.moved_sources[move.src] = move.dst
+        self.moved_destinations.add(move.dst)
+
+    @timed("move_file")
+    def execute_move(self, move: Move):
+        """Moves the file to the destination decided by `plan_move`."""
+        if move.overwrite:
+            move.dst.unlink()
+            loginf(f'move_file: "{move.dst}".unlink() OK')
+        self._move_file_impl(move.src, move.dst)
+        loginf(f'move_file: _move_file_impl("{move.src}", "{move.dst}") OK')
+        logdet(f"move_file: file at dest_file is {Apply._file_size_human(move.dst)}")
+
+    def _move_job(self, moves, inline_renames: bool = True):
+        """Returns the (device, function) job that executes the planned `moves` of a
+        video file and its satellites. Moves within one file system are renames and,
+        with `inline_renames`, run in order in the calling thread (device None).
+        """
+
+        def move():
+            for planned in moves:
+                self.execute_move(planned)
+                if self.journal is not None:
+                    self.journal.record(planned)
+
+        device = IOScheduler.device(moves[0].dst.parent)
+        if inline_renames and device == IOScheduler.device(moves[0].src):
+            device = None
+        return device, move
+
+    def _is_completed(self, move: Move, completed) -> bool:
+        """Checks if an interrupted run of the job has already executed `move`.
+
+        A move which is not recorded in the journal only counts as executed if its
+        source file is gone, or if its destination is the source file (a hardlink)
+        or has the same contents (a copy whose source file was not removed yet).
+
+        Args:
+            move (Move): The planned move.
+            completed (set): Source files of the moves recorded in the journal.
+
+        Raises:
+            FileExistsError: If another file has appeared at the destination since
+                the move was planned, which the move would replace.
+        """
+        if move.src in completed:
+            return True
+        if not move.dst.exists():
+            return False
+        if not move.src.exists():
+            # Moved, but interrupted before the move was recorded
+            return True
+        if move.src.samefile(move.dst):
+            # Hardlinked, but interrupted before the move was recorded
+            return True
+        if filecmp.cmp(move.src, move.dst, shallow=False):
+            # Placed, but interrupted before the move was recorded or, when moving
+            # to another file system, before the source file was removed
+            if not self.placement.keeps_source:
+                move.src.unlink()
+            return True
+        if not move.overwrite:
+            raise FileExistsError(
+                errno.EEXIST,
+                "Destination appeared since the move was planned",
+                str(move.dst),
+            )
+        return False
+
+    def _forget_move(self, src_file: Path):
+        """Forgets a planned move that did not happen. Its entries are left in the
+        lists of moved files, and skipped by `_moved_dst_files`."""
+        dst_file = self.moved_sources.pop(src_file, None)
+        if dst_file is not None:
+            self.moved_destinations.discard(dst_file)
+
+    def _moved_dst_files(self) -> list:
+        """Returns the destinations of the moved files without the forgotten ones,
+        in the order of `moved_dst_files`."""
+        return [
+            dst_file
+            for dst_file in self.moved_dst_files
+            if dst_file in self.moved_destinations
+        ]
+
+    def _guess_satellite(self, sat_file: Path):
+        """Guesses the language suffix and episode of a satellite file.
+
+        Returns:
+            tuple: (stem, subpart, guess) where `stem` is the file stem without
+                language suffix, `subpart` the language suffix to keep (e.g. ".en"
+                or ".en.forced") and `guess` the guessed subtitle language, season
+                and episode (None for non-subtitles).
         """
-        loginf(f'move_satellites("{src_file}", "{dest_file}")')
+        file_stem = sat_file.stem
+        if sat_file.suffix.lower()[1:] not in self.subtitle_extensions:
+            return file_stem, "", None
+
+        # Try the fast path for common names such as "Show.S01E01.en.srt" first
+        if self.subtitle_detector is None:
+            self.subtitle_detector = SubtitleLanguageDetector()
+        detected = self.subtitle_detector.detect(sat_file.name)
+        if detected is not None:
+            file_stem, subpart, guess = detected
+        else:
+            file_stem, subpart, guess = self._guessit_satellite(sat_file)
+
+        if "subtitle_language" in guess:
+            loginf(
+                "Satellite: %s is a subtitle [%s]"
+                % (sat_file.name, guess["subtitle_language"])
+            )
+        else:
+            loginf("Satellite: %s is a subtitle" % sat_file.name)
+        return file_stem, subpart, guess
+
+    def _guessit_satellite(self, sat_file: Path):
+        """Guesses the language suffix of a subtitle file name using GuessIt."""
+        file_stem = sat_file.stem
+        subpart = ""
+        guess = guessit.guessit(sat_file.name)
+        if guess and "subtitle_language" in guess:
+            # Remove the last dot and subsequent characters from the file stem.
+            idx = file_stem.rfind(".")
+            if idx != -1:
+                file_stem = file_stem[:idx]
+            # Use alpha2 subtitle language (e.g. en, es) from GuessIt.
+            subpart = "." + SubtitleLanguageDetector.language_code(
+                guess["subtitle_language"]
+            )
+        return file_stem, subpart, guess
+
+    def _match_satellite_episode(self, guess, candidates):
+        """Returns the only candidate video with the satellite's season and episode."""
+        if not guess or guess.get("episode") is None:
+            return None
+        matches = []
+        for video_file in candidates:
+            video_guess = self.determine.guesses.get(video_file, {})
+            if video_guess.get("episode") != guess.get("episode"):
+                continue
+            if guess.get("season") is not None and video_guess.get(
+                "season"
+            ) != guess.get("season"):
+                continue
+            matches.append(video_file)
+        return matches[0] if len(matches) == 1 else None
+
+    def assign_satellites(self, satellite_files, video_files):
+        """Assigns every satellite file of the job to (at most) one video file.
 
-        # Define the source and destination directories.
-        src_dir = src_file.parent
-        dest_dir = dest_file.parent
+        Each satellite is guessed exactly once and may only be assigned to a video
+        stored in the satellite's directory or in one of its parent directories.
+        It is assigned to the first video that matches, in order:
 
-        # Assert that both directories exist to ensure we're working with valid directories.
-        assert src_dir.is_dir()
-        assert dest_dir.is_dir()
+        1. a video with the same name (ignoring the subtitle language suffix);
+        2. for NFOs, the video described by the NFO's contents (deep scan);
+        3. the only video with the same season and episode;
+        4. the clear best match of the job's `SimilarityIndex`.
 
-        # The base for satellite files: the video filename without its extension.
-        base = src_file.with_suffix("").name
+        Returns:
+            dict: Maps video files to lists of `(sat_file, subpart, reason)` tuples
+                where `subpart` is the language suffix (e.g. ".en") to keep and
+                `reason` the rule that assigned the satellite ("same name", "nfo",
+                "episode" or "similarity").
+        """
+        videos_by_stem = {}
+        for video_file in video_files:
+            videos_by_stem.setdefault(video_file.stem.lower(), []).append(video_file)
 
-        # Iterate recursively over all files under the source video's directory.
-        for sat_file in src_dir.rglob("*"):
-            if not sat_file.is_file():
+        satellites = {}
+        for sat_file in satellite_files:
+            candidates = [
+                video_file
+                for video_file in video_files
+                if sat_file.is_relative_to(video_file.parent)
+            ]
+            if not candidates:
                 continue
 
-            filename = sat_file.name
-            file_stem = sat_file.stem
-            fext = sat_file.suffix
-            fextlo = fext.lower()
-
-            if fextlo in self.processing_parameters.satellite_extensions:
-                subpart = ""
-                if fextlo[1:] in self.processing_parameters.satellite_extensions:
-                    guess = guessit.guessit(filename)
-                    if guess and "subtitle_language" in guess:
-                        # Remove the last dot and subsequent characters from the file stem.
-                        idx = file_stem.rfind(".")
-                        if idx != -1:
-                            file_stem = file_stem[:idx]
-                        # Use alpha2 subtitle language (e.g. en, es) from GuessIt.
-                        subpart = "." + guess["subtitle_language"].alpha2
-
-                    if subpart:
-                        loginf(
-                            "Satellite: %s is a subtitle [%s]"
-                            % (filename, guess["subtitle_language"])
-                        )
-                    else:
-                        loginf("Satellite: %s is a subtitle" % filename)
+            file_stem, subpart, guess = self._guess_satellite(sat_file)
+
+            reason = "same name"
+            video_file = next(
+                (
+                    video_file
+                    for video_file in videos_by_stem.get(file_stem.lower(), ())
+                    if video_file in candidates
+                ),
+                None,
+            )
+            if (
+                video_file is None
+                and sat_file.suffix.lower() == ".nfo"
+                and self.processing_parameters.deep_scan
+            ):
+                reason = "nfo"
+                video_file = self.deep_scan_nfo(sat_file)
+            if video_file is None:
+                reason = "episode"
+                video_file = self._match_satellite_episode(guess, candidates)
+            if video_file is None:
+                reason = "similarity"
+                video_file, ratio = self.video_index.best_match(
+                    file_stem, self.processing_parameters.deep_scan_ratio
+                )
+                if video_file is not None:
+                    loginf(
+                        "Satellite: %s matches video %s (ratio=%.2f)"
+                        % (sat_file.name, video_file.name, ratio)
+                    )
+
+            if video_file in candidates:
+                satellites.setdefault(video_file, []).append(
+                    (sat_file, subpart, reason)
+                )
+
+        loginf(
+            f"assign_satellites: assigned {sum(len(x) for x in satellites.values())} of {len(satellite_files)} satellite files to {len(satellites)} video files"
+        )
+        return satellites
+
+    @timed("move_satellites")
+    def plan_satellites(self, video_move: Move):
+        """Plans the moves of the satellite files such as subtitles that
+        `assign_satellites` associated with the base video to the correct destination.
 
-                elif (file_stem.lower() != base.lower()) and fextlo == ".nfo":
-                    if self.options.deep_scan:
-                        guess = self.deep_scan_nfo(str(sat_file))
-                        if guess is not None:
-                            file_stem = base
+        Returns:
+            list: The planned `Move` of every satellite of the video.
+        """
+        loginf(f'move_satellites("{video_move.src}", "{video_move.dst}")')
 
-                if file_stem.lower() == base.lower():
-                    # Build the new satellite file name using the destination video's stem.
-                    new_sat = dest_dir / f"{dest_file.stem}{subpart}{fext}"
-                    loginf("Satellite: %s" % new_sat.name)
-                    self.move_file(sat_file, new_sat)
+        dest_dir = video_move.dst.parent
+        moves = []
+        for sat_file, subpart, reason in self.satellites.get(video_move.src, ()):
+            # Build the new satellite file name using the destination video's stem.
+            new_sat = dest_dir / f"{video_move.dst.stem}{subpart}{sat_file.suffix}"
+            loginf("Satellite: %s" % new_sat.name)
+            moves.append(self.plan_move(sat_file, new_sat, reason, video_move.src))
+        return moves
 
+    @timed("deep_scan_nfo")
     def deep_scan_nfo(self, filename, ratio=None):
+        """Scans the words of an NFO file for release names and returns the video file
+        of the job that the NFO most likely describes, or None if no word matches.
+
+        Every word is looked up in the job's `SimilarityIndex`, so each word is scored
+        against all videos at once instead of being compared with every candidate.
+        """
         if ratio is None:
-            ratio = self.options.deep_scan_ratio
+            ratio = self.processing_parameters.deep_scan_ratio
         loginf("Deep scanning satellite: %s (ratio=%.2f)" % (filename, ratio))
-        best_guess = None
+        if self.video_index is None:
+            return None
+        best_video = None
         best_ratio = 0.00
         try:
-            nfo = open(filename)
-            # Convert file content into iterable words
-            for word in "".join([item for item in nfo.readlines()]).split():
-                try:
-                    guess = guessit.guessit(word + ".nfo")
-                    # Series = TV, Title = Movie
-                    if any(item in guess for item in ("title")):
-                        # Compare word against NZB name
-                        diff = difflib.SequenceMatcher(
-                            None, word, self.options.nzb_name
-                        )
-                        # Evaluate ratio against threshold and previous matches
-                        loginf("Tested: %s (ratio=%.2f)" % (word, diff.ratio()))
-                        if diff.ratio() >= ratio and diff.ratio() > best_ratio:
-                            loginf(
-                                "Possible match found: %s (ratio=%.2f)"
-                                % (word, diff.ratio())
-                            )
-                            best_guess = guess
-                            best_ratio = diff.ratio()
-                except UnicodeDecodeError:
-                    # Ignore non-unicode words (common in nfo "artwork")
-                    pass
-            nfo.close()
+            words = self.nfo_words.pop(filename, None)
+            if words is None:
+                words = Apply._read_nfo_words(filename)
+            elif isinstance(words, Exception):
+                raise words
         except IOError as e:
             logerr("%s" % str(e))
-        return best_guess
+            return None
+        for word in words:
+            video_file, word_ratio = self.video_index.best_match(word, ratio)
+            if video_file is not None and word_ratio > best_ratio:
+                loginf("Possible match found: %s (ratio=%.2f)" % (word, word_ratio))
+                best_video = video_file
+                best_ratio = word_ratio
+        return best_video
+
+    @staticmethod
+    def _read_nfo_words(filename):
+        """Returns the distinct words of an NFO file, in the order of the file."""
+        # Ignore non-unicode characters (common in nfo "artwork")
+        with open(filename, encoding="utf-8", errors="ignore") as nfo:
+            return dict.fromkeys(nfo.read().split())
+
+    @staticmethod
+    def _prefetch_nfo_words(filename):
+        """Reads an NFO file ahead of `deep_scan_nfo`. Errors are returned instead
+        of raised, so that they are reported when the NFO is scanned."""
+        try:
+            return Apply._read_nfo_words(filename)
+        except IOError as e:
+            return e
 
+    def _scan_for_cleanup(self, directory: Path, dir_fd, removals, dir_fds):
+        """Scans `directory` bottom-up and collects the entries to remove.
+
+        Directories are opened relative to their parent (`dir_fd`) where supported,
+        so the entries can be removed without resolving their paths again. The sizes
+        are taken from the cached `stat` data of the directory entries.
+
+        Args:
+            directory (Path): The directory to scan.
+            dir_fd (int): File descriptor of `directory`, or None.
+            removals (list): Receives (dir_fd, name, path, is_dir) tuples for every
+                entry to remove, children before their directory.
+            dir_fds (list): Receives the file descriptors opened by the scan.
+
+        Returns:
+            bool: True if `directory` contains moved files and must be kept, or None
+                if a large file remains and nothing must be removed.
+        """
+        keep = False
+        with os.scandir(directory if dir_fd is None else dir_fd) as entries:
+            entries = list(entries)
+        for entry in entries:
+            path = directory / entry.name
+            if entry.is_dir(follow_symlinks=False):
+                sub_fd = None
+                if dir_fd is not None:
+                    sub_fd = os.open(
+                        entry.name,
+                        os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW,
+                        dir_fd=dir_fd,
+                    )
+                    dir_fds.append(sub_fd)
+                sub_keep = self._scan_for_cleanup(path, sub_fd, removals, dir_fds)
+                if sub_keep is None:
+                    return None
+                if sub_keep:
+                    keep = True
+                else:
+                    removals.append((dir_fd, entry.name, path, True))
+                continue
+            if path in self.moved_destinations:
+                keep = True
+                continue
+            if self.options.preview and path in self.moved_sources:
+                continue
+            if entry.is_file() and entry.stat().st_size >= self.options.min_size:
+                return None
+            removals.append((dir_fd, entry.name, path, False))
+        return keep
+
+    @timed("cleanup_download_dir")
     def cleanup_download_dir(self):
         """Remove the download directory if it (or any subfolder) does not contain
         "important" files (important = size >= min_size).
+
+        The directory is scanned once, bottom-up, before anything is removed; the
+        moved files are looked up in the executed move plan.
         """
         download_dir = Path(self.nzb_properties.download_dir)
         loginf(f'cleanup_download_dir("{download_dir}")')
 
-        # Check if there are any big files remaining
-        keep_download_dir = False
-        for path in download_dir.rglob("*"):
-            if path.is_file():
-                if path in self.moved_dst_files:
-                    keep_download_dir = True
-                    continue
-                if path.stat().st_size >= self.options.min_size and (
-                    not self.options.preview or (path not in self.moved_src_files)
-                ):
-                    logwar(
-                        "Skipping clean up due to large files remaining in the directory"
-                    )
-                    return
+        if self.placement.keeps_source:
+            loginf(
+                f"Skipping clean up as the files were placed with {self.placement.mode} and are kept in the download directory"
+            )
+            return
 
-        # Now delete all files with nice logging.
-        for path in list(download_dir.rglob("*")):
-            if path.is_file():
-                if path in self.moved_dst_files:
-                    continue
-                if not self.options.preview or (path not in self.moved_src_files):
-                    if not self.options.preview:
-                        path.unlink()
+        removals = []
+        dir_fds = []
+        try:
+            if Apply._CLEANUP_DIR_FD:
+                dir_fds.append(os.open(download_dir, os.O_RDONLY | os.O_DIRECTORY))
+            keep_download_dir = self._scan_for_cleanup(
+                download_dir, dir_fds[0] if dir_fds else None, removals, dir_fds
+            )
+            if keep_download_dir is None:
+                logwar(
+                    "Skipping clean up due to large files remaining in the directory"
+                )
+                return
+
+            # Delete all files with nice logging, and the emptied directories
+            for dir_fd, name, path, is_dir in removals:
+                if not self.options.preview:
+                    if is_dir:
+                        os.rmdir(name if dir_fd is not None else path, dir_fd=dir_fd)
+                    else:
+                        os.unlink(name if dir_fd is not None else path, dir_fd=dir_fd)
+                if not is_dir:
                     loginf(f'Deleted: "{path}"')
+        finally:
+            for dir_fd in dir_fds:
+                os.close(dir_fd)
 
         # Delete the download directory if no moved destination files exist.
         if not keep_download_dir:
             if not self.options.preview:
-                shutil.rmtree(download_dir)
+                download_dir.rmdir()
             loginf(f'Deleted: "{download_dir}"')
 
     @staticmethod
@@ -268,23 +686,43 @@ class Apply:
             file_path_str = str(file_path.relative_to(relative_to))
         return f'"{file_path_str}" [{Apply._file_size_human(file_path)}]'
 
-    def _describe_directory_tree(self, root_dirs: Path, prefix: str = "") -> None:
-        """Logs the directory tree starting from `root_dir` with a message prefix.
+    @staticmethod
+    def _walk_sorted(directory: Path):
+        """Yields the entries below `directory` depth-first, in the order of
+        `sorted(directory.rglob("*"))`, holding only one directory listing per level
+        in memory."""
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(
+                    (entry.name, entry.is_dir(follow_symlinks=False))
+                    for entry in entries
+                )
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for name, is_dir in entries:
+            path = directory / name
+            yield path
+            if is_dir:
+                yield from Apply._walk_sorted(path)
+
+    def _log_directory_tree(self, root_dirs: Path, prefix: str = ""):
+        """Logs the directory tree starting from `root_dirs` with a message prefix.
+        Every file is logged as soon as it has been found, so that the description
+        of a huge tree is never held in memory.
 
         Arguments:
-            root_dir (Path): The root directory whose tree will be logged.
-            relative_to (Path): The directory to which the root_dir is relative.
+            root_dirs (Path): The root directory, or a list of root directories,
+                whose trees will be logged.
             prefix (str): A string prefix to include in the log message.
         """
 
         if not root_dirs:
-            return f'{prefix} "{root_dirs}":\n <empty>'
+            logdet(f'{prefix} "{root_dirs}":\n <empty>')
+            return
 
         if not isinstance(root_dirs, list):
             root_dirs = [root_dirs]
 
-        tree_output_list = []
-
         common_relative_to = root_dirs[0]
         while len(common_relative_to.parts) > 1:
             if all(
@@ -293,96 +731,514 @@ class Apply:
                 break
             common_relative_to = common_relative_to.parent
 
-        for root_dir in root_dirs:
-            tree_output = "\n".join(
-                [
-                    Apply._describe_file(f, common_relative_to)
-                    for f in root_dir.rglob("*")
-                ]
-            )
-            tree_output_list.append(tree_output)
-
         root_dirs_str = (
             ", ".join(str(root_dir) for root_dir in root_dirs)
             if len(root_dirs) > 1
             else str(root_dirs[0])
         )
-        tree_output = "\n".join(tree_output_list)
-        return f'{prefix} "{root_dirs_str}":\n {tree_output}'
+        logdet(f'{prefix} "{root_dirs_str}":')
+        indent = " "
+        for root_dir in root_dirs:
+            for f in Apply._walk_sorted(root_dir):
+                logdet(indent + Apply._describe_file(f, common_relative_to))
+                indent = ""
 
-    def run(self):
-        # Process all the files in download_dir and its subdirectories
+    def _scan_files(self, root, downloaded_files, video_files, satellite_files):
+        """Adds the video and satellite files among `downloaded_files` in directory
+        `root` to `video_files` and `satellite_files`."""
+        for downloaded_file in downloaded_files:
+            try:
+                downloaded_file_path = Path(root) / downloaded_file
+                downloaded_file_ext = downloaded_file_path.suffix.lower().lstrip(".")
+
+                # Check extension
+                if (
+                    downloaded_file_ext in self.compiled.satellite_extensions
+                    and downloaded_file_ext not in self.compiled.video_extensions
+                ):
+                    satellite_files.append(downloaded_file_path)
+                    continue
+
+                if downloaded_file_ext not in self.compiled.video_extensions:
+                    logdet(
+                        f'Skipping "{str(downloaded_file)}" as its suffix={downloaded_file_path.suffix} is not in {self.processing_parameters.video_extensions}'
+                    )
+                    continue
+
+                # Check minimum file size
+                downloaded_file_size = downloaded_file_path.stat().st_size
+                if downloaded_file_size < self.options.min_size:
+                    loginf(
+                        f'Skipping "{str(downloaded_file)}" as its size={downloaded_file_size} < {self.options.min_size}'
+                    )
+                    continue
+
+                # This is our video file, we should process it
+                video_files.append(downloaded_file_path)
+
+            except Exception as e:
+                self._error(e)
+                logerr("Failed: %s" % downloaded_file)
+                logerr("Exception: %s" % e)
+                traceback.print_exc()
+
+    def _scan_download_dir(self):
+        """Gathers the video and satellite files in the download directory.
+
+        Returns:
+            tuple: (video_files, satellite_files) lists.
+        """
         download_dir = self.nzb_properties.download_dir
-        loginf(f'Processing files in "{download_dir}"')
-        assert download_dir.is_dir()
+        video_files = []
+        satellite_files = []
 
-        # Dump initial contents of the download directory
-        logdet(
-            self._describe_directory_tree(
-                download_dir,
-                "# Initial download directory:",
+        for root, dirs, downloaded_files in os.walk(download_dir):
+            self._scan_files(root, downloaded_files, video_files, satellite_files)
+
+        return video_files, satellite_files
+
+    def _scan_releases(self):
+        """Gathers the video and satellite files in the download directory one
+        release at a time, for the streaming mode. A release is a directory with
+        video files together with its subdirectories. As satellites are only
+        assigned to videos in their own directory or above, every satellite which
+        can be assigned is in the release of its video.
+
+        Yields:
+            tuple: (video_files, satellite_files) lists of a release.
+        """
+        download_dir = self.nzb_properties.download_dir
+        for root, dirs, downloaded_files in os.walk(download_dir):
+            video_files = []
+            satellite_files = []
+            self._scan_files(root, downloaded_files, video_files, satellite_files)
+            if not video_files:
+                continue
+            # Scan the subdirectories in the order of `_scan_download_dir`
+            for sub_dir in dirs:
+                for sub_root, _, sub_files in os.walk(Path(root) / sub_dir):
+                    self._scan_files(sub_root, sub_files, video_files, satellite_files)
+            dirs.clear()
+            yield video_files, satellite_files
+
+    def _start_job(self, video_files, partial: bool = False):
+        """Prepares the guessing and matching of the job's video files, or of the
+        video files of one release in streaming mode (`partial`)."""
+        self.directory_names = {}
+        self.satellites = {}
+        self.determine = Determine(
+            video_files, self.options, partial, self.knowledge, self.library
+        )
+        self.video_index = SimilarityIndex(
+            {video_file: video_file.stem for video_file in video_files}
+        )
+
+    def _construct_destination(self, video_file_path: Path):
+        """Returns the destination of a video file, or None if it stays in place."""
+        try:
+            dest = self.determine.construct_path(video_file_path)
+            if dest:
+                record = self.determine.records.get(video_file_path)
+                if record is not None:
+                    self.sort_records[video_file_path] = record
+                return Path(dest)
+        except Exception as e:
+            self._error(e)
+            logerr(f'Exception when renaming video file "{video_file_path}": {e}')
+            logerr(traceback.format_exc())
+        return None
+
+    def _plan_moves(self, dest_files, satellite_files) -> MovePlan:
+        """Plans the moves of the video files to `dest_files` and of their
+        satellites.
+        """
+        # Assign all satellite files to the video files in a single pass
+        if satellite_files:
+            self.satellites = self.assign_satellites(
+                satellite_files, list(dest_files.keys())
             )
+
+        # Plan the moves of all video files and their satellites up front, so that
+        # unique names are decided in the same order as if the files were moved
+        # one at a time
+        moves = []
+        for video_file_path, dest_file in dest_files.items():
+            try:
+                guess = self.determine.guesses.get(video_file_path, {})
+                video_move = self.plan_move(
+                    video_file_path, dest_file, guess.get("type", "video")
+                )
+                moves.append(video_move)
+                moves += self.plan_satellites(video_move)
+
+            except Exception as e:
+                self._error(e)
+                logerr(f'Exception when renaming video file "{video_file_path}": {e}')
+                logerr(traceback.format_exc())
+
+        return MovePlan(tuple(moves))
+
+    def plan(self) -> MovePlan:
+        """Plans the moves of all video files in the download directory and their
+        satellites without changing the file system.
+
+        Returns:
+            MovePlan: The moves in the order in which they were planned.
+        """
+        return self._plan_files(*self._scan_download_dir())
+
+    def _plan_files(self, video_files, satellite_files, partial: bool = False):
+        """Plans the moves of `video_files` and `satellite_files` (see `plan`)."""
+        self._start_job(video_files, partial)
+
+        # Determine the destinations of all video files up front
+        dest_files = {}
+        for video_file_path in video_files:
+            dest = self._construct_destination(video_file_path)
+            if dest:
+                dest_files[video_file_path] = dest
+
+        return self._plan_moves(dest_files, satellite_files)
+
+    async def plan_async(self, executor: ThreadPoolExecutor) -> MovePlan:
+        """Plans the moves like `plan`, for the asyncio execution mode: while the
+        video files are guessed, the NFO files are read and the destination
+        directories are listed on `executor`. The results are only used once all
+        video files have been guessed, so the log output is the same as `plan`'s.
+
+        Returns:
+            MovePlan: The moves in the order in which they were planned.
+        """
+        loop = asyncio.get_running_loop()
+        video_files, satellite_files = await loop.run_in_executor(
+            executor, self._scan_download_dir
         )
+        self._start_job(video_files)
 
-        # Gather all video files in the download directory
-        video_files = []
+        nfo_reads = {}
+        if self.processing_parameters.deep_scan:
+            nfo_reads = {
+                sat_file: loop.run_in_executor(
+                    executor, Apply._prefetch_nfo_words, sat_file
+                )
+                for sat_file in satellite_files
+                if sat_file.suffix.lower() == ".nfo"
+            }
 
-        for root, dirs, downloaded_files in os.walk(download_dir):
-            for downloaded_file in downloaded_files:
+        dest_files = {}
+        listings = {}
+        for video_file_path in video_files:
+            dest = self._construct_destination(video_file_path)
+            if dest:
+                dest_files[video_file_path] = dest
+                if dest.parent not in listings:
+                    listings[dest.parent] = loop.run_in_executor(
+                        executor, Apply._list_directory, dest.parent
+                    )
+
+        for directory, listing in listings.items():
+            self._add_directory_listing(directory, await listing)
+        self.nfo_words = {
+            sat_file: await words for sat_file, words in nfo_reads.items()
+        }
+
+        return self._plan_moves(dest_files, satellite_files)
+
+    def _pending_groups(self, plan: MovePlan, completed):
+        """Prepares the execution of `plan` and returns its groups of moves which
+        remain to be executed (see `execute`)."""
+        self.moved_src_files = []
+        self.moved_dst_files = []
+        self.moved_sources = {}
+        self.moved_destinations = set()
+        for move in plan.moves:
+            self._record_move(move)
+
+        groups = plan.groups()
+        if completed is not None:
+            pending = []
+            for moves in groups:
                 try:
-                    downloaded_file_path = Path(root) / downloaded_file
-
-                    # Check extension
-                    if (
-                        downloaded_file_path.suffix.lower().lstrip(".")
-                        not in self.processing_parameters.video_extensions
-                    ):
-                        logdet(
-                            f'Skipping "{str(downloaded_file)}" as its suffix={downloaded_file_path.suffix} is not in {self.processing_parameters.video_extensions}'
-                        )
-                        continue
-
-                    # Check minimum file size
-                    downloaded_file_size = downloaded_file_path.stat().st_size
-                    if downloaded_file_size < self.options.min_size:
-                        loginf(
-                            f'Skipping "{str(downloaded_file)}" as its size={downloaded_file_size} < {self.options.min_size}'
-                        )
-                        continue
-
-                    # This is our video file, we should process it
-                    video_files.append(downloaded_file_path)
-
-                except Exception as e:
-                    self.errors = True
-                    logerr("Failed: %s" % downloaded_file)
-                    logerr("Exception: %s" % e)
-                    traceback.print_exc()
+                    moves = [
+                        move
+                        for move in moves
+                        if not self._is_completed(move, completed)
+                    ]
+                except OSError as e:
+                    self._error(e)
+                    logerr(f'Cannot resume moving "{moves[0].src}": {e}')
+                    for move in moves:
+                        self._forget_move(move.src)
+                    continue
+                for move in moves:
+                    self.transfer.remove_stale(move.dst)
+                if moves:
+                    pending.append(tuple(moves))
+            groups = pending
+
+        self._make_directories(move for moves in groups for move in moves)
+        return groups
+
+    def _finish_execute(self, groups, results) -> bool:
+        """Reports the groups of moves which failed and returns True if none did."""
+        failed = False
+        for moves, e in zip(groups, results):
+            if e is None:
+                continue
+            failed = True
+            self._error(e)
+            logerr(f'Exception when renaming video file "{moves[0].src}": {e}')
+            logerr("".join(traceback.format_exception(e)))
+            # Files which were not moved must neither be reported nor kept on cleanup
+            for move in moves:
+                if move.src.exists():
+                    self._forget_move(move.src)
+        self.files_moved = len(self.moved_destinations) > 0
+        if self.knowledge is not None:
+            self.knowledge.record(
+                [
+                    self.sort_records.pop(moves[0].src)
+                    for moves, e in zip(groups, results)
+                    if e is None and moves[0].src in self.sort_records
+                ]
+            )
+        return not failed
 
-        determine = Determine(video_files, self.options)
+    def execute(self, plan: MovePlan, completed=None) -> bool:
+        """Executes the moves of `plan`. Every video file is moved together with its
+        satellites; moves to another device run concurrently.
 
-        move_satellites = len(self.processing_parameters.satellite_extensions) > 0
+        Args:
+            plan (MovePlan): The moves to execute.
+            completed (set, optional): When resuming an interrupted run, the source
+                files of the moves recorded in its journal. Moves which the
+                interrupted run has executed are skipped.
 
-        for video_file_path in video_files:
-            try:
-                dest = determine.construct_path(video_file_path)
+        Returns:
+            bool: True if all moves have been executed.
+        """
+        groups = self._pending_groups(plan, completed)
+        scheduler = IOScheduler(
+            self.options.transfer_workers, self.options.transfer_device_workers
+        )
+        results = scheduler.run([self._move_job(moves) for moves in groups])
+        return self._finish_execute(groups, results)
+
+    async def execute_async(
+        self, plan: MovePlan, executor: ThreadPoolExecutor, completed=None
+    ) -> bool:
+        """Executes the moves of `plan` like `execute`, as asyncio tasks running on
+        `executor`. The log output of the moves is printed in the order of the plan.
+
+        Returns:
+            bool: True if all moves have been executed.
+        """
+        loop = asyncio.get_running_loop()
+        groups = await loop.run_in_executor(
+            executor, self._pending_groups, plan, completed
+        )
+        # The log output does not depend on the order in which the jobs finish, so
+        # renames on a share run concurrently, too
+        jobs = await loop.run_in_executor(
+            executor, lambda: [self._move_job(moves, False) for moves in groups]
+        )
+        scheduler = IOScheduler(
+            self.options.transfer_workers, self.options.transfer_device_workers
+        )
+        results = await scheduler.run_async(jobs, executor)
+        return self._finish_execute(groups, results)
 
-                if dest:
-                    dest_file = Path(dest)
-                    # Move video file
-                    self.move_file(video_file_path, dest_file)
-                    self.files_moved = True
+    @timed("stream")
+    def stream(self) -> bool:
+        """Plans and moves the files of the download directory one release at a
+        time, for the streaming mode: the releases are scanned lazily, and while the
+        moves of a release are executed by a mover thread, the next release is
+        guessed and planned. At most `STREAM_QUEUE` planned releases wait for the
+        mover, and the guesses of a release are released once it has been planned,
+        so the memory used does not grow with the size of the download directory.
 
-                    if self.files_moved and move_satellites:
-                        # Move satellite files
-                        self.move_satellites(video_file_path, dest_file)
+        The plan of every release is added to the journal before it is moved. No
+        further releases are planned once the memory limit is exceeded.
+
+        Returns:
+            bool: True if all moves have been executed.
+        """
+        plans = queue.Queue(Apply.STREAM_QUEUE)
+        results = []
+        mover = threading.Thread(target=self._move_releases, args=(plans, results))
+        mover.start()
+        try:
+            releases = self._scan_releases()
+            release = next(releases, None)
+            # Look ahead one release: the NZB name only applies to a single release
+            following = next(releases, None)
+            partial = following is not None
+            while release is not None:
+                plan = self._plan_files(*release, partial)
+                if len(plan):
+                    self.journal.extend(plan)
+                    plans.put(plan)
+                if following is not None and self.memory.exceeded():
+                    self.errors = True
+                    logerr(
+                        f"Memory limit exceeded, remaining releases are not processed ({self.memory.report()})"
+                    )
+                    break
+                release, following = following, next(releases, None)
+        finally:
+            plans.put(None)
+            mover.join()
+            # Release the guesses of the last release
+            self.determine = None
+            self.video_index = None
+            self.satellites = {}
+        return all(results)
 
+    def _move_releases(self, plans: queue.Queue, results: list):
+        """Executes the plans put into `plans` until it yields None, and appends
+        whether all moves of each plan have been executed to `results`."""
+        scheduler = IOScheduler(
+            self.options.transfer_workers, self.options.transfer_device_workers
+        )
+        while True:
+            plan = plans.get()
+            if plan is None:
+                return
+            try:
+                groups = plan.groups()
+                self._make_directories(plan.moves)
+                outcomes = scheduler.run([self._move_job(moves) for moves in groups])
+                results.append(self._finish_execute(groups, outcomes))
             except Exception as e:
-                self.errors = True
-                logerr(f'Exception when renaming video file "{video_file_path}": {e}')
+                # Keep taking plans, so that the planning never waits for the mover
+                self._error(e)
+                logerr(
+                    f'Exception when moving the release of "{plan.moves[0].src}": {e}'
+                )
                 logerr(traceback.format_exc())
+                results.append(False)
+
+    @timed("plan")
+    def _plan(self) -> MovePlan:
+        """Plans the moves with the configured execution mode."""
+        if self.options.execution != "asyncio":
+            return self.plan()
+
+        async def plan():
+            with ThreadPoolExecutor(self.options.transfer_workers) as executor:
+                return await self.plan_async(executor)
 
-        final_dest_dirs = [dst_file.parent for dst_file in self.moved_dst_files]
+        return asyncio.run(plan())
+
+    @timed("execute")
+    def _execute(self, plan: MovePlan, completed=None) -> bool:
+        """Executes the moves with the configured execution mode."""
+        if self.options.execution != "asyncio":
+            return self.execute(plan, completed)
+
+        async def execute():
+            with ThreadPoolExecutor(self.options.transfer_workers) as executor:
+                return await self.execute_async(plan, executor, completed)
+
+        return asyncio.run(execute())
+
+    def preview(self, plan: MovePlan):
+        """Logs the moves of `plan` instead of executing them."""
+        for move in plan.moves:
+            action = self.placement.mode
+            if move.overwrite:
+                action += " (overwrite)"
+            loginf(
+                f'{Apply.PREVIEW_PREFIX}{action}: "{move.src}" -> "{move.dst}" ({move.reason})'
+            )
+        logdet(f"{Apply.PREVIEW_PREFIX}move plan:\n{plan.to_json()}")
+        self.files_moved = len(plan) > 0
+
+    def report_timings(self, elapsed: float):
+        """Logs the timings of the job, which took `elapsed` seconds in total, and
+        writes them to a JSON file next to the download directory if configured.
+        """
+        if self.options.timings == "no":
+            return
+        timings.record("main", elapsed)
+        loginf(timings.summary())
+        if self.options.timings == "json":
+            download_dir = self.nzb_properties.download_dir
+            path = download_dir.parent / f".{download_dir.name}{Apply.TIMINGS_SUFFIX}"
+            try:
+                timings.write(path)
+                loginf(f'timings: written to "{path}"')
+            except OSError as e:
+                logwar(f'Cannot write timings to "{path}": {e}')
+
+    def report_metrics(self, elapsed: float):
+        """Adds the job, which took `elapsed` seconds in total, to the metrics file
+        if configured.
+        """
+        if not self.options.metrics_file:
+            return
+        if self.errors:
+            status = "error"
+        elif self.files_moved:
+            status = "success"
+        else:
+            status = "none"
+        metrics = MetricsFile(self.options.metrics_file)
+        try:
+            metrics.add_job(status, elapsed, timings.to_dict())
+            logdet(f'metrics: added job to "{metrics.path}"')
+        except OSError as e:
+            logwar(f'Cannot write metrics to "{metrics.path}": {e}')
+
+    def save_library_index(self):
+        """Writes the listings of the library directories to the library index file
+        if configured."""
+        if self.library is None:
+            return
+        try:
+            self.library.save()
+        except OSError as e:
+            logwar(f'Cannot write library index to "{self.library.path}": {e}')
+
+    @timed("run")
+    def run(self):
+        # Process all the files in download_dir and its subdirectories
+        download_dir = self.nzb_properties.download_dir
+        loginf(f'Processing files in "{download_dir}"')
+        assert download_dir.is_dir()
+
+        # Dump initial contents of the download directory
+        self._log_directory_tree(
+            download_dir,
+            "# Initial download directory:",
+        )
+
+        if self.options.preview:
+            self.preview(self._plan())
+        else:
+            self.journal = MoveJournal.for_download_dir(download_dir)
+            plan, completed = self.journal.load()
+            if plan is not None:
+                loginf(
+                    f'Resuming interrupted job from "{self.journal.path}": {len(completed)} of {len(plan)} moves completed'
+                )
+                self.journal.resume()
+            elif self.options.execution != "streaming":
+                completed = None
+                plan = self._plan()
+                if len(plan):
+                    self.journal.begin(plan)
+            done = plan is None or self._execute(plan, completed)
+            if done and self.options.execution == "streaming":
+                # The files left after resuming an interrupted job are streamed
+                done = self.stream()
+            if done:
+                self.journal.remove()
+            else:
+                self.journal.close()
+            self.save_library_index()
+
+        final_dest_dirs = [dst_file.parent for dst_file in self._moved_dst_files()]
 
         if len(final_dest_dirs):
             # Ensure that this is output without a prefix like `INFO` or `WARNING`
@@ -397,17 +1253,17 @@ class Apply:
         if self.options.cleanup and self.files_moved and not self.errors:
             self.cleanup_download_dir()
 
-        logdet(
-            self._describe_directory_tree(
-                download_dir,
-                "# Resulting download directory",
-            )
+        self._log_directory_tree(
+            download_dir,
+            "# Resulting download directory",
         )
 
-        logdet(
-            self._describe_directory_tree(
-                final_dest_dirs, "# Unique destination directory"
-            )
+        # Every directory is described once, however many files were moved into it
+        self._log_directory_tree(
+            list(dict.fromkeys(final_dest_dirs)), "# Unique destination directory"
         )
 
+        if self.memory.limit or self.options.execution == "streaming":
+            loginf(self.memory.report())
+
         return self
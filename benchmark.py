@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+#
+# Benchmarks for DeobfuscationSort post-processing script for NZBGet.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with the program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import difflib
+import getopt
+import tempfile
+import contextlib
+import io
+import random
+import string
+from pathlib import Path
+
+from deobfuscation import Deobfuscator
+from library import LibraryIndex
+from obfuscation import ObfuscationScorer
+from similarity import SimilarityIndex
+from subtitles import SubtitleLanguageDetector
+from transfer import TransferEngine
+from vfs import LatencyModel, SimulatedFS
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "lib"))
+import guessit
+from guessit.options import load_config
+from guessit.reutils import build_or_pattern
+from guessit.rules.properties import website
+
+benchmarks = []
+repeat = 3
+# Directories to copy between in the transfer benchmark, e.g. tmpfs or a loopback mount
+transfer_dirs = []
+# Size of the file copied in the transfer benchmark in MiB
+transfer_size = 256
+# Latency of every file system call in the simulated NAS in milliseconds
+nas_latency = 5.0
+# Bandwidth of the simulated NAS in MB/s, 0 for unlimited
+nas_bandwidth = 100.0
+
+options, _ = getopt.getopt(
+    sys.argv[1:],
+    "b:r:d:s:l:w:",
+    ["bench=", "repeat=", "dir=", "size=", "latency=", "bandwidth="],
+)
+for opt, arg in options:
+    if opt in ("-b", "--bench"):
+        benchmarks.append(arg)
+    elif opt in ("-r", "--repeat"):
+        repeat = int(arg)
+    elif opt in ("-d", "--dir"):
+        transfer_dirs.append(Path(arg))
+    elif opt in ("-s", "--size"):
+        transfer_size = int(arg)
+    elif opt in ("-l", "--latency"):
+        nas_latency = float(arg)
+    elif opt in ("-w", "--bandwidth"):
+        nas_bandwidth = float(arg)
+
+
+def best_time(func, *args):
+    """Returns the best wall time of `repeat` calls of `func(*args)` in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, elapsed, baseline=None):
+    line = f"{name:<40} {elapsed * 1000.0:10.2f} ms"
+    if baseline:
+        line += f"  ({baseline / elapsed:.1f}x)"
+    print(line)
+
+
+def generate_pack(episodes):
+    """Returns the video names and subtitle names of a generated season pack."""
+    videos = [
+        f"Show.Name.S01E{episode:02d}.1080p.WEB-DL.DD5.1.H.264-GRP"
+        for episode in range(1, episodes + 1)
+    ]
+    subtitles = [f"{video}.en" for video in videos] + [
+        f"Show Name S01E{episode:02d} eng" for episode in range(1, episodes + 1)
+    ]
+    return videos, subtitles
+
+
+def bench_similarity():
+    """Assignment of subtitles to videos: SimilarityIndex vs. pairwise difflib."""
+
+    def pairwise(videos, subtitles):
+        for subtitle in subtitles:
+            max(
+                videos,
+                key=lambda video: difflib.SequenceMatcher(
+                    None, subtitle, video
+                ).ratio(),
+            )
+
+    def indexed(videos, subtitles):
+        index = SimilarityIndex({video: video for video in videos})
+        index.assign({subtitle: subtitle for subtitle in subtitles})
+
+    for episodes in (10, 50, 200):
+        videos, subtitles = generate_pack(episodes)
+        baseline = best_time(pairwise, videos, subtitles)
+        report(f"similarity: difflib pairwise ({episodes} eps)", baseline)
+        report(
+            f"similarity: SimilarityIndex ({episodes} eps)",
+            best_time(indexed, videos, subtitles),
+            baseline,
+        )
+
+
+def bench_subtitles():
+    """Subtitle language detection: SubtitleLanguageDetector vs. guessit."""
+    names = [
+        f"Show.Name.S01E{episode:02d}.1080p.WEB-DL.DD5.1.H.264-GRP.{suffix}.srt"
+        for episode in range(1, 21)
+        for suffix in ("en", "eng", "English", "eng.forced", "sdh")
+    ]
+    detector = SubtitleLanguageDetector()
+
+    def guessed(names):
+        for name in names:
+            guessit.guessit(name)
+
+    def detected(names):
+        for name in names:
+            detector.detect(name)
+
+    baseline = best_time(guessed, names)
+    report(f"subtitles: guessit ({len(names)} names)", baseline)
+    report(
+        f"subtitles: detector ({len(names)} names)",
+        best_time(detected, names),
+        baseline,
+    )
+    report("subtitles: detector construction", best_time(SubtitleLanguageDetector))
+
+
+def load_corpus():
+    """Returns the input file names of the test corpus in testdata.json."""
+    testdata = json.load(
+        open(Path(__file__).resolve().parent / "testdata.json", encoding="UTF-8")
+    )
+    return [testobj["INPUTFILE"] for testobj in testdata if "INPUTFILE" in testobj]
+
+
+def bench_guessit():
+    """GuessIt throughput on the test corpus with the options used by Determine."""
+    names = load_corpus()
+    options = {"allowed_languages": [], "allowed_countries": []}
+
+    start = time.perf_counter()
+    guessit.guessit(names[0], options)
+    report("guessit: configure and first guess", time.perf_counter() - start)
+
+    def guessed(names):
+        for name in names:
+            guessit.guessit(name, options)
+
+    elapsed = best_time(guessed, names)
+    report(f"guessit: corpus ({len(names)} names)", elapsed)
+    print(f"{'guessit: guesses per second':<40} {len(names) / elapsed:10.1f}")
+
+
+def bench_deobfuscation():
+    """NZB name deobfuscation: Deobfuscator vs. the regular expressions it replaces,
+    on the test corpus and on names which make the regular expressions backtrack."""
+    words = ["RP", "1", "NZBGeek", "Obfuscated", "Scrambled", "sample", "Pre"]
+    extensions = ["mkv", "mp4", "avi", "ts", "m2ts", "wmv"]
+    deobfuscator = Deobfuscator(words, extensions)
+    words_re, suffix_re = Deobfuscator.reference_patterns(words, extensions)
+    names = [part for name in load_corpus() for part in Path(name).parts]
+
+    def regex(names):
+        for name in names:
+            words_re.sub(r"\1", suffix_re.sub(r"\1", name))
+
+    def engine(names):
+        for name in names:
+            deobfuscator.strip_words(deobfuscator.strip_suffix(name))
+
+    baseline = best_time(regex, names)
+    report(f"deobfuscation: regex ({len(names)} names)", baseline)
+    report(
+        f"deobfuscation: engine ({len(names)} names)",
+        best_time(engine, names),
+        baseline,
+    )
+    for length in (500, 1000, 2000, 4000):
+        names = ["a" + "-a" * (length // 2), "a" + ".mkvx" * (length // 5)]
+        baseline = best_time(regex, names)
+        report(f"deobfuscation: regex ({length}-char worst)", baseline)
+        report(
+            f"deobfuscation: engine ({length}-char worst)",
+            best_time(engine, names),
+            baseline,
+        )
+
+
+def generate_obfuscated_names(count, rng):
+    """Returns `count` obfuscated names: hashes, random tokens and UUIDs, some of
+    them with separators, e.g. "f4d7841f.part01" or "xpost_xzHdwosQyaDLuU"."""
+
+    def token(alphabet, low, high):
+        return "".join(rng.choices(alphabet, k=rng.randint(low, high)))
+
+    hex_digits = "0123456789abcdef"
+    base62 = string.ascii_letters + string.digits
+    generators = (
+        lambda: token(hex_digits, 16, 64),
+        lambda: token(base62, 10, 40),
+        lambda: "-".join(token(hex_digits, n, n) for n in (8, 4, 4, 4, 12)),
+        lambda: token(hex_digits, 8, 32)
+        + rng.choice((".1", "_1", " (1)", ".part01", "_part2")),
+        lambda: rng.choice(("xpost_", "abc.", "obf_")) + token(base62, 12, 30),
+        lambda: token(base62, 12, 24) + "." + token(base62, 8, 16),
+        lambda: token(hex_digits, 32, 32) + "." + token(hex_digits, 8, 8),
+        lambda: "_".join(token(base62, 10, 16) for _ in range(rng.randint(2, 4))),
+    )
+    return [rng.choice(generators)() for _ in range(count)]
+
+
+def generate_scene_names(count, rng):
+    """Returns `count` release names like "The.Office.S01E02.1080p.WEB-DL-GRP"."""
+    titles = ["The Office", "Band of Brothers", "Doctor Who", "Shōgun", "Tenet"]
+    titles += ["Real Time with Bill Maher", "2001 A Space Odyssey", "Dune Part Two"]
+    groups = ["SPARKS", "LEGi0N", "FraMeSToR", "KRaLiMaRKo", "c0ke", "CONSPIR4CY"]
+    groups += ["pawel2006", "playWEB", "CMRG", "NTb", "Z0iDS3N", "W4NK3R"]
+    terms = ["1080p", "2160p", "720p", "BluRay", "WEB-DL", "WEBRip", "HDTV", "x264"]
+    terms += ["x265", "H.264", "HEVC", "DDP5.1", "DTS-HD.MA.7.1", "TrueHD", "Atmos"]
+    terms += ["HDR10", "10bit", "REMUX", "AMZN", "UHD", "AAC2.0", "WEBRip1080p"]
+    names = []
+    for _ in range(count):
+        words = rng.choice(titles).split()
+        if rng.random() < 0.5:
+            words.append(f"S{rng.randint(1, 12):02d}E{rng.randint(1, 24):02d}")
+        else:
+            words.append(str(rng.randint(1950, 2024)))
+        words += rng.sample(terms, rng.randint(1, 6))
+        name = rng.choice((".", " ", "_")).join(words) + "-" + rng.choice(groups)
+        if rng.random() < 0.2:
+            name += rng.choice(("-Obfuscated", "-xpost", "-AsRequested"))
+        names.append(name.lower() if rng.random() < 0.1 else name)
+    return names
+
+
+def bench_obfuscation():
+    """Obfuscated path parts: ObfuscationScorer vs. the regex it replaced, on 10k
+    generated hash and scene names and on long names without separators."""
+    relevant_re = re.compile(
+        r"[-a-z0-9]*[ ._]+([-a-z0-9]*[ ._][-a-z0-9]*)*", re.IGNORECASE
+    )
+    rng = random.Random(0)
+    obfuscated = generate_obfuscated_names(5000, rng)
+    scene = generate_scene_names(5000, rng)
+
+    def regex(names):
+        return [not relevant_re.search(name) for name in names]
+
+    def scored(names):
+        scorer = ObfuscationScorer()
+        return [scorer.is_obfuscated(name) for name in names]
+
+    for label, decide in (("regex", regex), ("scorer", scored)):
+        wrong_obfuscated = decide(obfuscated).count(False)
+        wrong_scene = decide(scene).count(True)
+        print(
+            f"{'obfuscation: ' + label + ' misclassified':<40} "
+            f"{wrong_obfuscated:5} of {len(obfuscated)} obfuscated, "
+            f"{wrong_scene} of {len(scene)} scene names"
+        )
+    names = obfuscated + scene
+    baseline = best_time(regex, names)
+    report(f"obfuscation: regex ({len(names)} names)", baseline)
+    report(
+        f"obfuscation: scorer ({len(names)} names)",
+        best_time(scored, names),
+        baseline,
+    )
+    for length in (1000, 4000):
+        names = ["0123456789abcdef" * (length // 16)]
+        baseline = best_time(regex, names)
+        report(f"obfuscation: regex ({length}-char hash)", baseline)
+        report(
+            f"obfuscation: scorer ({length}-char hash)",
+            best_time(scored, names),
+            baseline,
+        )
+
+
+def bench_website():
+    """Website rule: domain extension alternation vs. candidate scan and set lookup."""
+    names = load_corpus()
+    config = load_config({"no_user_config": True})["advanced_config"]["website"]
+    template = (
+        r"(?:[^a-z0-9]|^)((?:(?:www)\.)+(?:[a-z-0-9-]+\.)+(?:{tlds}))(?:[^a-z0-9]|$)"
+    )
+
+    start = time.perf_counter()
+    website.website(config)
+    report("website: rule construction (cold)", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tlds = build_or_pattern(sorted(website.registered_tlds()))
+    regex = re.compile(template.replace("{tlds}", tlds), re.IGNORECASE)
+    report("website: alternation compile", time.perf_counter() - start)
+    find_websites = website.tld_pattern(template)
+
+    def alternation(names):
+        for name in names:
+            list(regex.finditer(name))
+
+    def scanned(names):
+        for name in names:
+            find_websites(name)
+
+    baseline = best_time(alternation, names)
+    report(f"website: alternation ({len(names)} names)", baseline)
+    report(
+        f"website: tld scan ({len(names)} names)",
+        best_time(scanned, names),
+        baseline,
+    )
+
+
+def bench_transfer():
+    """Cross-directory copy: TransferEngine vs. shutil.copyfile.
+
+    Copies between every pair of the `--dir` directories (by default the temp
+    directory and /dev/shm); pass e.g. a loopback-mounted file system to compare
+    other file systems.
+    """
+    dirs = transfer_dirs or [Path(tempfile.gettempdir())]
+    if not transfer_dirs and Path("/dev/shm").is_dir():
+        dirs.append(Path("/dev/shm"))
+
+    for src_dir in dirs:
+        src_file = src_dir / f"bench-transfer-{transfer_size}.bin"
+        with open(src_file, "wb") as src:
+            for _ in range(transfer_size):
+                src.write(os.urandom(1 << 20))
+        try:
+            for dst_dir in dirs:
+                dst_file = dst_dir / "bench-transfer-copy.bin"
+                pair = f"{src_dir} -> {dst_dir}"
+
+                def copied(copy):
+                    copy(src_file, dst_file)
+                    dst_file.unlink()
+
+                baseline = best_time(copied, shutil.copyfile)
+                report(f"transfer: shutil.copyfile ({pair})", baseline)
+                for method in TransferEngine.METHODS:
+                    engine = TransferEngine(methods=(method,))
+                    try:
+                        with contextlib.redirect_stdout(None):
+                            elapsed = best_time(copied, engine.copy)
+                    except OSError as ex:
+                        print(f"transfer: {method} ({pair}) not supported ({ex})")
+                        continue
+                    report(f"transfer: {method} ({pair})", elapsed, baseline)
+        finally:
+            src_file.unlink()
+
+
+def bench_nas():
+    """Sorting a season pack into a library on a NAS share: threads vs. asyncio.
+
+    The download directory is local (/dev/shm if available) and the library is on a
+    `SimulatedFS` where every call takes `--latency` milliseconds and data moves at
+    `--bandwidth` MB/s. Reports the calls per operation of one job and how the wall
+    time scales with the latency.
+    """
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from apply import Apply
+
+    manifest = json.load(open(Path(__file__).resolve().parent / "manifest.json"))
+    for option in manifest["options"]:
+        os.environ[f"NZBPO_{option['name'].upper()}"] = str(option["value"])
+
+    episodes = 24
+    videos, _ = generate_pack(episodes)
+    local = "/dev/shm" if Path("/dev/shm").is_dir() else None
+    with tempfile.TemporaryDirectory(dir=local) as downloads:
+        with tempfile.TemporaryDirectory() as nas:
+            download_dir = Path(downloads) / "Show.Name.S01.1080p.WEB-DL-GRP"
+            for name in ("MOVIESDIR", "SERIESDIR", "DATEDDIR", "OTHERTVDIR"):
+                os.environ[f"NZBPO_{name}"] = str(Path(nas) / name.lower())
+            os.environ.update(
+                NZBPO_MINSIZE="0",
+                NZBPP_DIRECTORY=str(download_dir),
+                NZBPP_NZBNAME=download_dir.name,
+                NZBPP_CATEGORY="tv",
+            )
+
+            def sort(execution, fs):
+                shutil.rmtree(Path(nas), ignore_errors=True)
+                shutil.rmtree(download_dir, ignore_errors=True)
+                download_dir.mkdir(parents=True)
+                for idx, video in enumerate(videos):
+                    # Obfuscated names, so that the NFOs are deep scanned
+                    (download_dir / f"{idx:04x}a.mkv").write_bytes(b"0" * (1 << 20))
+                    (download_dir / f"{idx:04x}b.nfo").write_text(f"{video}\n" * 50)
+                os.environ["NZBPO_EXECUTION"] = execution
+                fs.reset()
+                with fs, contextlib.redirect_stdout(io.StringIO()):
+                    Apply().run()
+
+            bandwidth = nas_bandwidth * 1e6 if nas_bandwidth else None
+            fs = SimulatedFS(nas, LatencyModel(0.0, bandwidth))
+            sort("threads", fs)
+            print(f"nas: {fs.syscalls()} calls per job on the share:")
+            for operation, calls in fs.calls.most_common():
+                size = fs.bytes[operation]
+                line = f"  {operation:<20} {calls:6}"
+                print(line + (f" {size >> 20:6} MiB" if size else ""))
+
+            for latency in (0.0, nas_latency / 2, nas_latency):
+                fs = SimulatedFS(nas, LatencyModel(latency / 1000.0, bandwidth))
+                label = f"{episodes} episodes, {latency:g} ms latency"
+                baseline = best_time(sort, "threads", fs)
+                report(f"nas: threads ({label})", baseline)
+                elapsed = best_time(sort, "asyncio", fs)
+                report(f"nas: asyncio ({label})", elapsed, baseline)
+
+
+def bench_library():
+    """Finding the existing folder of a show in a library of 5000 shows with 3
+    seasons each: walking the library vs. LibraryIndex without and with listings
+    kept from an earlier job."""
+    shows = 5000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        series_dir = Path(tmp_dir) / "series"
+        for show in range(shows):
+            for season in (1, 2, 3):
+                (series_dir / f"Show {show} (2019)" / f"Season {season:02d}").mkdir(
+                    parents=True
+                )
+        # The listings are trusted once the directories are older than `RACY_NS`
+        past = time.time() - 3600
+        for directory in [series_dir, *series_dir.iterdir()]:
+            os.utime(directory, (past, past))
+        index_file = Path(tmp_dir) / "library.json"
+        relative = Path("Show 4321/Season 2/Show 4321 - S02E01.mkv")
+
+        def walk():
+            folders = {}
+            for root, dirs, _ in os.walk(series_dir):
+                for name in dirs:
+                    folders[(root, LibraryIndex.key(name)[0])] = name
+            return folders
+
+        def index(path):
+            library = LibraryIndex([series_dir], path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                library.canonical(series_dir, relative)
+            library.save()
+
+        index(index_file)
+        baseline = best_time(walk)
+        report(f"library: walk ({shows} shows)", baseline)
+        report(f"library: index ({shows} shows)", best_time(index, None), baseline)
+        report(
+            f"library: cached index ({shows} shows)",
+            best_time(index, index_file),
+            baseline,
+        )
+
+
+all_benchmarks = {
+    "deobfuscation": bench_deobfuscation,
+    "guessit": bench_guessit,
+    "library": bench_library,
+    "nas": bench_nas,
+    "obfuscation": bench_obfuscation,
+    "similarity": bench_similarity,
+    "subtitles": bench_subtitles,
+    "transfer": bench_transfer,
+    "website": bench_website,
+}
+
+for name, bench in all_benchmarks.items():
+    if benchmarks == [] or name in benchmarks:
+        bench()
@@ -0,0 +1,216 @@
+import re
+
+
+class WordTrie:
+    """
+    Trie of words spelled backwards, to find the words of a name which end at a
+    given position while scanning the name from right to left. The words are
+    matched regardless of case, as `re.IGNORECASE` matches them.
+    """
+
+    # Lower case characters which `re.IGNORECASE` matches with another lower case
+    # character, e.g. "ſ" with "s", mapped to the lowest of them
+    EQUIVALENCES = {
+        "\u0131": "i",
+        "\u017f": "s",
+        "\u03b9": "\u0345",
+        "\u03bc": "\u00b5",
+        "\u03c3": "\u03c2",
+        "\u03d0": "\u03b2",
+        "\u03d1": "\u03b8",
+        "\u03d5": "\u03c6",
+        "\u03d6": "\u03c0",
+        "\u03f0": "\u03ba",
+        "\u03f1": "\u03c1",
+        "\u03f5": "\u03b5",
+        "\u1c80": "\u0432",
+        "\u1c81": "\u0434",
+        "\u1c82": "\u043e",
+        "\u1c83": "\u0441",
+        "\u1c84": "\u0442",
+        "\u1c85": "\u0442",
+        "\u1c86": "\u044a",
+        "\u1c87": "\u0463",
+        "\u1e9b": "\u1e61",
+        "\u1fbe": "\u0345",
+        "\u1fd3": "\u0390",
+        "\u1fe3": "\u03b0",
+        "\ua64b": "\u1c88",
+        "\ufb06": "\ufb05",
+    }
+
+    # Marks the end of a word in a node
+    END = ""
+
+    def __init__(self, words):
+        """
+        Args:
+            words (list[str]): The words, matched literally.
+        """
+        self.root = {}
+        for word in words:
+            node = self.root
+            for char in reversed(WordTrie.fold(word)):
+                node = node.setdefault(char, {})
+            node[WordTrie.END] = True
+
+    @staticmethod
+    def fold(text: str) -> str:
+        """Returns `text` with every character replaced by the character which
+        `re.IGNORECASE` compares, keeping its length."""
+        if text.isascii():
+            return text.lower()
+        folded = []
+        for char in text:
+            # The simple lower case mapping, e.g. "i" for "İ"
+            lower = char.lower()[0]
+            folded.append(WordTrie.EQUIVALENCES.get(lower, lower))
+        return "".join(folded)
+
+    def starts(self, folded: str, end: int):
+        """Yields the start of every word of `folded` (see `fold`) which ends at
+        `end`, from right to left."""
+        node = self.root
+        if WordTrie.END in node:
+            yield end
+        pos = end - 1
+        while pos >= 0:
+            node = node.get(folded[pos])
+            if node is None:
+                return
+            if WordTrie.END in node:
+                yield pos
+            pos -= 1
+
+
+class Deobfuscator:
+    """
+    Strips the obfuscation which indexers and posters add to release names, in time
+    linear in the length of the name:
+
+    - `strip_suffix` cuts a name at the first video file extension or "#<number>"
+      suffix, e.g. "Movie.2024.1080p-GRP.mkv.abc" --> "Movie.2024.1080p-GRP";
+    - `strip_words` removes the words of "DeobfuscateWords" which follow the
+      release group, e.g. "Movie.2024.1080p-GRP-Obfuscated" --> "Movie.2024.1080p-GRP".
+
+    The results are the ones of the regular expressions returned by
+    `reference_patterns`, which the engine replaces: their lazy prefixes and nested
+    quantifiers backtrack polynomially on long names with many separators. The
+    engine instead scans the name once from right to left, keeping for every
+    position whether the rest of the name can be stripped, and looks the words up in
+    a `WordTrie`. Names are expected to be single lines.
+    """
+
+    # Characters of a release group, regardless of case
+    RELEASE_GROUP_CHARS = frozenset(".0123456789abcdefghijklmnopqrstuvwxyz")
+    # Characters which may follow a deobfuscation word, regardless of case
+    WORD_SUFFIX_CHARS = frozenset("0123456789abcdefghijklmnopqrstuvwxyz")
+
+    def __init__(self, words, extensions):
+        """
+        Args:
+            words (list[str]): The words of "DeobfuscateWords", None or [""] to not
+                strip any words.
+            extensions (list[str]): The video file extensions, without dots.
+        """
+        self.has_words = bool(words) and bool(words[0])
+        self.words = WordTrie(words if self.has_words else [])
+        self.extensions = WordTrie(extensions)
+
+    @staticmethod
+    def is_word_char(char: str) -> bool:
+        """Checks if `char` is matched by "\\w"."""
+        return char.isalnum() or char == "_"
+
+    def strip_suffix(self, name: str) -> str:
+        """Returns `name` up to the first ".<video extension>" or ".#<number>" which
+        ends at a word boundary, or `name` if there is none."""
+        folded = WordTrie.fold(name)
+        length = len(name)
+        word = [Deobfuscator.is_word_char(char) for char in name] + [False]
+        # suffix[pos]: a video extension or "#<number>" starts at pos
+        suffix = [False] * (length + 1)
+        for end in range(length, 0, -1):
+            if word[end - 1] != word[end]:
+                for start in self.extensions.starts(folded, end):
+                    suffix[start] = True
+        digits_end = length
+        for pos in range(length - 1, 0, -1):
+            if "0" <= name[pos] <= "9":
+                if name[pos - 1] == "#" and not word[digits_end]:
+                    suffix[pos - 1] = True
+            else:
+                digits_end = pos
+        for pos in range(1, length - 1):
+            if name[pos] == "." and suffix[pos + 1]:
+                return name[:pos]
+        return name
+
+    def strip_words(self, name: str) -> str:
+        """Returns `name` up to the release group, without the deobfuscation words
+        (and the separators and characters around them) which follow it, or `name`
+        if it has no release group."""
+        if not self.has_words:
+            return name
+        folded = WordTrie.fold(name)
+        length = len(name)
+        # rest[pos]: name[pos:] only consists of deobfuscation words, each preceded
+        # by separators and followed by letters or digits and separators
+        rest = [False] * (length + 2)
+        # unit[pos]: name[pos:] starts with separators, then such a word
+        unit = [False] * (length + 2)
+        # word[pos]: a deobfuscation word starts at pos, then such a rest
+        word = [False] * (length + 2)
+        # group_end[pos]: the last end of a release group starting at pos which
+        # is followed by such a rest, None if there is none
+        group_end = [None] * (length + 2)
+        rest[length] = True
+        # after_word: name[pos:] can follow a word, after_separators: name[pos:] can
+        # follow the letters or digits after a word
+        after_word = after_separators = True
+        for pos in range(length, -1, -1):
+            if pos < length:
+                char = folded[pos]
+                separator = not Deobfuscator.is_word_char(name[pos])
+                unit[pos] = separator and (word[pos + 1] or unit[pos + 1])
+                rest[pos] = unit[pos]
+                after_separators = rest[pos] or (separator and after_separators)
+                after_word = after_separators or (
+                    char in Deobfuscator.WORD_SUFFIX_CHARS and after_word
+                )
+                if char in Deobfuscator.RELEASE_GROUP_CHARS:
+                    group_end[pos] = group_end[pos + 1]
+                    if group_end[pos] is None and rest[pos + 1]:
+                        group_end[pos] = pos + 1
+            if after_word:
+                for start in self.words.starts(folded, pos):
+                    word[start] = True
+        for pos in range(1, length):
+            if name[pos] == "-" and group_end[pos + 1] is not None:
+                return name[: group_end[pos + 1]]
+        return name
+
+    @staticmethod
+    def reference_patterns(words, extensions):
+        """Returns the regular expressions which define the results of
+        `strip_words` and `strip_suffix`, to check the engine against them.
+
+        Returns:
+            tuple: The pattern of `strip_words` (None without words) and the one of
+                `strip_suffix`, both substituted with r"\\1".
+        """
+        words_re = None
+        if words and words[0]:
+            words_re = re.compile(
+                r"(.+?-[.0-9a-z]+)(?:\W+(?:{})[a-z0-9]*\W*)*$".format(
+                    "|".join(re.escape(word) for word in words)
+                ),
+                flags=re.IGNORECASE,
+            )
+        suffix_re = re.compile(
+            r"^(.+?)(?:\.(?:{}|\#[0-9]+)\b)+.*$".format(
+                "|".join(re.escape(extension) for extension in extensions)
+            ),
+            flags=re.IGNORECASE,
+        )
+        return words_re, suffix_re
@@ -1,8 +1,13 @@
 import os
 import re
+import threading
 from pathlib import Path
 from nzbget_utils import logerr, logwar, loginf, logdet
 from options import Options
+from obfuscation import ObfuscationScorer
+from knowledge import KnowledgeCache, KnownTitle, SortRecord
+from library import LibraryIndex
+from timing import timed, timings
 
 import sys
 
@@ -14,9 +19,15 @@ import guessit
 class Determine:
     _BOUNDARY_STRIP_CHARS = ("_", ".", "-")
 
-    _RELEVANT_PATH_PART_RE = re.compile(
-        r"[-a-z0-9]*[ ._]+([-a-z0-9]*[ ._][-a-z0-9]*)*", re.IGNORECASE
-    )
+    # Decides which path parts are obfuscated, shared by all jobs of the process
+    _OBFUSCATION_SCORER = ObfuscationScorer()
+
+    # Raw GuessIt results per input name, shared by the Determine instances of the
+    # process (e.g. one per release in streaming mode), least recently used first
+    _GUESSIT_CACHE = {}
+    _GUESSIT_CACHE_LOCK = threading.Lock()
+    # Most GuessIt results kept in `_GUESSIT_CACHE`
+    GUESSIT_CACHE_SIZE = 256
 
     _REPLACE_AFTER = {
         "()": "",
@@ -30,17 +41,65 @@ class Determine:
     _RE_UPPERCASE = re.compile(r"{{([^{]*)}}")
     _RE_LOWERCASE = re.compile(r"{([^{]*)}")
 
-    def __init__(self, videofiles: list[Path], options: Options):
+    # A directory name which is likely to be properly cased
+    _CASE_CHECK_RE = re.compile(
+        r"^[A-Z0-9]+.+\b\d{3,4}p\b.*-[-A-Za-z0-9]+[A-Z]+[-A-Za-z0-9]*$"
+    )
+    # The title of a directory name, up to the resolution
+    _TITLE_MATCH_RE = re.compile(r"(.+?)\b\d{3,4}p\b", flags=re.IGNORECASE)
+    # Quality identifiers and release terms in a directory name -> their casing
+    _CASE_TERMS = [
+        (re.compile(pattern, flags=re.IGNORECASE), replacement)
+        for pattern, replacement in (
+            (r"(\d{3,4})p", r"\1p"),
+            (r"x(\d{3,4})", r"x\1"),
+            (r"(\d{2,2}Bit)", r"\1Bit"),
+            (r"BluRay", "BluRay"),
+            (r"Web(.?)DL", r"Web\1DL"),
+            (r"Web(.?)Rip", r"Web\1Rip"),
+            (r"AAC", "AAC"),
+            (r"Dolby", "Dolby"),
+            (r"Atmos", "Atmos"),
+            (r"TrueHD", "TrueHD"),
+            (r"DD([57]).?1", "DD\1.1"),
+            (r"DTS.?X", r"DTS-X"),
+            (r"DTS.?HD", r"DTS-HD"),
+            (r"DTS.?ES", r"DTS-ES"),
+            (r"DTS.?HD.?MA", r"DTS-HD.?MA"),
+        )
+    ]
+
+    def __init__(
+        self,
+        videofiles: list[Path],
+        options: Options,
+        partial: bool = False,
+        knowledge: KnowledgeCache = None,
+        library: LibraryIndex = None,
+    ):
+        """
+        Args:
+            videofiles (list[Path]): The video files to guess.
+            options (Options): The options of the job.
+            partial (bool): True if `videofiles` are only some of the video files of
+                the job, e.g. one release in streaming mode.
+            knowledge (KnowledgeCache, optional): The titles and folders learned
+                from earlier sorts.
+            library (LibraryIndex, optional): The existing folders of the
+                library, to which the destinations snap.
+        """
         self.videofiles = videofiles
         self.options = options
         self.nzb_properties = self.options.nzb_properties
         self.processing_parameters = self.options.processing_parameters
         # Determine whether we can use the NZB name for the destination path
         self.use_nzb_name = (
-            self.processing_parameters.prefer_nzb_name and len(videofiles) == 1
+            self.processing_parameters.prefer_nzb_name
+            and len(videofiles) == 1
+            and not partial
         )
         if self.processing_parameters.prefer_nzb_name:
-            if len(videofiles) == 1:
+            if self.use_nzb_name:
                 loginf(
                     f"Processing single video file {videofiles[0]}, using NZB directory to determine destination path"
                 )
@@ -58,34 +117,33 @@ class Determine:
         # Class name: `ScriptState`
         self.dupe_separator = " "
 
-        self.deobfuscate_re = None
-        # Construct deobfuscation regex from words if provided
-        if len(self.processing_parameters.deobfuscate_words) and len(
-            self.processing_parameters.deobfuscate_words[0]
-        ):
-            self.deobfuscate_re = re.compile(
-                r"(.+?-[.0-9a-z]+)(?:\W+(?:{})[a-z0-9]*\W*)*$".format(
-                    "|".join(
-                        [
-                            re.escape(word)
-                            for word in self.processing_parameters.deobfuscate_words
-                        ]
-                    )
-                ),
-                flags=re.IGNORECASE,
+        # Final GuessIt results of the video files processed by `construct_path`
+        self.guesses = {}
+
+        # Extensions, words and regular expressions compiled from the options
+        self.compiled = self.options.compiled
+        self.deobfuscator = self.compiled.deobfuscator
+
+        # Titles and folders learned from earlier sorts, and the deobfuscated NZB
+        # dirnames learned from an earlier sort of this NZB
+        self.knowledge = knowledge
+        self.known_dirnames = None
+        if knowledge is not None:
+            self.known_dirnames = knowledge.lookup_release(
+                self.nzb_properties.nzb_name, self.compiled.fingerprint
             )
-        # Construct the regex for cases where the NZB directory name contains
-        # the video file extension and trailing obfuscation
-        video_file_suffix_re = "|".join(self.processing_parameters.video_extensions)
-        self.nzb_dir_rstrip_re = re.compile(
-            rf"^(.+?)(?:\.(?:{video_file_suffix_re}|\#[0-9]+)\b)+.*$",  # Strip anything following a video file suffix or a numeric suffix
-            flags=re.IGNORECASE,
-        )
+        # Existing folders of the library
+        self.library = library
+        # Deobfuscated NZB dirnames of the job: "plain" and "cased" (with a name)
+        self.dirnames = {}
+        # What the sorts of the video files learned, see `KnowledgeCache.record`
+        self.records = {}
 
         loginf(
             f"Determine: use_nzb_name={self.use_nzb_name} force_tv={self.force_tv} ({self.nzb_properties.category} {self.force_tv and 'in' or 'not in'} {self.processing_parameters.tv_categories})"
         )
 
+    @timed("path_subst")
     def path_subst(path, mapping):
         """Replace the sort string elements by real values.
         Non-elements are copied literally.
@@ -144,20 +202,26 @@ class Determine:
         Returns:
             dirname (str): The deobfuscated and properly cased directory name.
         """
+        # The NZB dirname may be known from an earlier sort of the NZB
+        is_nzb_dirname = dirname == self.nzb_properties.download_dir.name
+        kind = "cased" if name else "plain"
+        if is_nzb_dirname and self.known_dirnames and kind in self.known_dirnames:
+            logdet(f'Known {kind} NZB dirname: "{self.known_dirnames[kind]}"')
+            return self.known_dirnames[kind]
+
         dirname_clean = dirname.strip()
         dirname = dirname_clean
 
-        dirname_rigthstripped = re.sub(self.nzb_dir_rstrip_re, r"\1", dirname_clean)
+        # Strip anything following a video file suffix or a numeric suffix
+        dirname_rigthstripped = self.deobfuscator.strip_suffix(dirname_clean)
         dirname = dirname_rigthstripped
         logdet(
             f'Right-stripped NZB dirname: "{dirname_clean}" --> "{dirname_rigthstripped}"'
         )
 
-        # Apply deobfuscation regex if provided
-        if self.deobfuscate_re:
-            dirname_deobfuscated = re.sub(
-                self.deobfuscate_re, r"\1", dirname_rigthstripped
-            )
+        # Strip the deobfuscation words if provided
+        if self.deobfuscator.has_words:
+            dirname_deobfuscated = self.deobfuscator.strip_words(dirname_rigthstripped)
             dirname = dirname_deobfuscated
             logdet(
                 f'De-obfuscated NZB dirname: "{dirname_rigthstripped}" --> "{dirname_deobfuscated}"'
@@ -172,59 +236,25 @@ class Determine:
 
         if name:
             # Determine if file name is likely to be properly cased
-            case_check_re = (
-                r"^[A-Z0-9]+.+\b\d{3,4}p\b.*-[-A-Za-z0-9]+[A-Z]+[-A-Za-z0-9]*$"
-            )
-            if re.match(case_check_re, dirname):
+            if Determine._CASE_CHECK_RE.match(dirname):
                 loginf(f"Not fixing a properly cased dirname: '{dirname}'")
             else:
                 title, _, _ = self.get_titles(name, True)
                 dirname_title = []
 
-                release_groups_list = [
-                    re.escape(token)
-                    for token in self.processing_parameters.release_groups
-                ]
-                release_groups_re = "|".join(release_groups_list)
-
-                def re_unescape(escaped_re):
-                    return re.sub(r"\\(.)", r"\1", escaped_re)
-
                 def scene_group_case(match):
-                    for extra_group in release_groups_list:
-                        loginf(
-                            f"Comparing extra group '{extra_group}' with match '{match.group(1)}'"
-                        )
-                        if re.match(
-                            f"{extra_group}$", match.group(1), flags=re.IGNORECASE
-                        ):
-                            return "-" + re_unescape(extra_group)
-                    return "-" + re.sub(r"I", "i", match.group(1).upper())
-
-                terms = [
-                    (r"(\d{3,4})p", r"\1p"),
-                    (r"x(\d{3,4})", r"x\1"),
-                    (r"(\d{2,2}Bit)", r"\1Bit"),
-                    (r"BluRay", "BluRay"),
-                    (r"Web(.?)DL", r"Web\1DL"),
-                    (r"Web(.?)Rip", r"Web\1Rip"),
-                    (r"AAC", "AAC"),
-                    (r"Dolby", "Dolby"),
-                    (r"Atmos", "Atmos"),
-                    (r"TrueHD", "TrueHD"),
-                    (r"DD([57]).?1", "DD\1.1"),
-                    (r"DTS.?X", r"DTS-X"),
-                    (r"DTS.?HD", r"DTS-HD"),
-                    (r"DTS.?ES", r"DTS-ES"),
-                    (r"DTS.?HD.?MA", r"DTS-HD.?MA"),
-                    (
-                        r"-(([A-Za-z0-9]+)|{})$".format(release_groups_re),
-                        scene_group_case,
-                    ),
+                    group = match.group(1)
+                    extra_group = self.compiled.release_groups.get(group.lower())
+                    if extra_group is not None:
+                        loginf(f"Matched extra group '{extra_group}' with '{group}'")
+                        return "-" + extra_group
+                    return "-" + re.sub(r"I", "i", group.upper())
+
+                terms = Determine._CASE_TERMS + [
+                    (self.compiled.release_group_re, scene_group_case)
                 ]
 
-                title_match_re = r"(.+?)\b\d{3,4}p\b"
-                title_match = re.search(title_match_re, dirname, flags=re.IGNORECASE)
+                title_match = Determine._TITLE_MATCH_RE.search(dirname)
                 if title_match:
                     title_len = min(len(title_match.group(1)), len(title))
                     loginf(
@@ -241,13 +271,17 @@ class Determine:
 
                     dirname = "".join(dirname_title) + dirname[title_len:]
                 else:
-                    logwar(f'dirname "{dirname}" does not match {title_match_re}"')
+                    logwar(
+                        f'dirname "{dirname}" does not match {Determine._TITLE_MATCH_RE.pattern}"'
+                    )
 
-                for term in terms:
-                    dirname = re.sub(term[0], term[1], dirname, flags=re.IGNORECASE)
+                for pattern, replacement in terms:
+                    dirname = pattern.sub(replacement, dirname)
 
                 loginf(f'Case-fixed dirname: "{dirname}"')
 
+        if is_nzb_dirname:
+            self.dirnames[kind] = dirname
         return dirname
 
     def get_deobfuscated_dirname_mapping(self, dirname, name=None):
@@ -300,15 +334,10 @@ class Determine:
         # Fix Python's title() bug with apostrophes
         title = title.replace("'S", "'s")
 
-        # Make sure some words such as 'and' or 'of' stay lowercased
-        for x in self.processing_parameters.lower_words:
-            xtitled = x.title()
-            title = Determine.replace_word(title, xtitled, x)
-
-        # Make sure some words such as 'III' or 'IV' stay uppercased
-        for x in self.processing_parameters.upper_words:
-            xtitled = x.title()
-            title = Determine.replace_word(title, xtitled, x)
+        # Make sure some words such as 'and' or 'of' stay lowercased and words such
+        # as 'III' or 'IV' stay uppercased
+        for word, pattern, pattern_ignorecase in self.compiled.title_words:
+            title = Determine.replace_word(title, pattern, word, pattern_ignorecase)
 
         # Make sure the first letter of the title is always uppercase
         if title:
@@ -345,31 +374,33 @@ class Determine:
         return title, dots, underscores
 
     @staticmethod
-    def replace_word(text, word_old, word_new):
+    def replace_word(text, word_old, word_new, word_old_ignorecase=None):
         """
         Replace a word in text while maintaining word boundaries.
         This ensures we only replace whole words, not parts of words.
 
         Args:
             text (str): The text to process
-            word_old (str): The word to find
+            word_old (str or re.Pattern): The word to find, or a compiled pattern
+                matching it as a whole word
             word_new (str): The word to replace it with
+            word_old_ignorecase (re.Pattern, optional): The compiled pattern matching
+                the word regardless of case, if `word_old` is a pattern
 
         Returns:
             str: The text with the word replaced
         """
-
-        def replace_word_case_sensitive(text, word_old, word_new):
+        if isinstance(word_old, str):
             pattern = r"\b" + re.escape(word_old) + r"\b"
-            return re.sub(pattern, word_new, text)
+            word_old = re.compile(pattern)
+            word_old_ignorecase = re.compile(pattern, flags=re.IGNORECASE)
 
         # Try case-sensitive replacement first
-        result = replace_word_case_sensitive(text, word_old, word_new)
+        result = word_old.sub(word_new, text)
 
         # If no replacement was made, try case-insensitive
         if result == text:
-            pattern = r"\b" + re.escape(word_old) + r"\b"
-            result = re.sub(pattern, word_new, text, flags=re.IGNORECASE)
+            result = word_old_ignorecase.sub(word_new, text)
 
         return result
 
@@ -792,7 +823,7 @@ class Determine:
         relevant_path = Path()
         # Process directory name parts
         for directory_part in path_parts_list[:-1]:
-            if re.search(Determine._RELEVANT_PATH_PART_RE, directory_part):
+            if not Determine._OBFUSCATION_SCORER.is_obfuscated(directory_part):
                 relevant_path = relevant_path / directory_part
             else:
                 loginf(
@@ -800,7 +831,7 @@ class Determine:
                 )
 
         # Process file name part
-        if re.search(Determine._RELEVANT_PATH_PART_RE, candidate_path.stem):
+        if not Determine._OBFUSCATION_SCORER.is_obfuscated(candidate_path.stem):
             relevant_path = relevant_path / candidate_path.name
         else:
             if relevant_path.parts:
@@ -919,6 +950,35 @@ class Determine:
         logdet(f"is_movie: {is_movie}")
         return is_movie
 
+    @staticmethod
+    def _cached_guessit(guessfilename: str) -> dict:
+        """Returns the raw GuessIt result of `guessfilename`, from `_GUESSIT_CACHE`
+        if the process has guessed it before. The result must not be changed."""
+        cache = Determine._GUESSIT_CACHE
+        with Determine._GUESSIT_CACHE_LOCK:
+            cached = cache.pop(guessfilename, None)
+            if cached is not None:
+                cache[guessfilename] = cached
+        if cached is not None:
+            timings.add("guessit_cache.hit")
+            logdet("GuessIt result is cached")
+            return cached
+
+        timings.add("guessit_cache.miss")
+        # A plain dict does not keep the matches of GuessIt alive, which take about
+        # 20 kB per file
+        cached = dict(
+            guessit.api.guessit(
+                guessfilename, {"allowed_languages": [], "allowed_countries": []}
+            )
+        )
+        with Determine._GUESSIT_CACHE_LOCK:
+            cache[guessfilename] = cached
+            while len(cache) > Determine.GUESSIT_CACHE_SIZE:
+                del cache[next(iter(cache))]
+        return cached
+
+    @timed("guess_info")
     def guess_info(self, videofile_path: Path):
         """Guess information about the video using GuessIt.
 
@@ -935,7 +995,7 @@ class Determine:
             # If the videofile_path has a videofile suffix, append it
             if (
                 videofile_path.suffix.lower().lstrip(".")
-                in self.processing_parameters.video_extensions
+                in self.compiled.video_extensions
             ):
                 guessfilename = guessfilename + videofile_path.suffix
             logdet(
@@ -956,10 +1016,9 @@ class Determine:
 
         logdet(f'Calling GuessIt with "{guessfilename}"')
 
-        # Use guessit directly as Python 3 handles Unicode by default
-        guess = guessit.api.guessit(
-            guessfilename, {"allowed_languages": [], "allowed_countries": []}
-        )
+        # Use guessit directly as Python 3 handles Unicode by default. The keys of
+        # the guess are adjusted below, so the cached result is copied
+        guess = dict(Determine._cached_guessit(guessfilename))
 
         logdet(f"GuessIt result:\n{Determine.format_matches_dict(guess)}")
 
@@ -1126,6 +1185,86 @@ class Determine:
         loginf(f'clean_videofile_path: clean_videofile_path: "{clean_videofile_path}"')
         return clean_videofile_path
 
+    def lookup_known_title(self, guess) -> KnownTitle:
+        """Replaces the title of `guess` with the one learned from an earlier sort
+        of the same title, if any (see `KnowledgeCache.lookup_title`).
+
+        Returns:
+            KnownTitle: The learned title and folder, or None.
+        """
+        if self.knowledge is None or not guess.get("title"):
+            return None
+        known = self.knowledge.lookup_title(
+            guess["vtype"], str(guess["title"]), guess.get("year")
+        )
+        if known is not None and known.title != guess["title"]:
+            loginf(f'Using known title "{known.title}" instead of "{guess["title"]}"')
+            guess["title"] = known.title
+        return known
+
+    def apply_known_folder(self, guess, known, relative: Path) -> Path:
+        """Replaces the folder of the title in the destination `relative` to
+        `dest_dir` with the folder learned for the title, e.g. "Show Name (2019)"
+        for "Show Name (2020)".
+
+        Args:
+            guess (dict): The final GuessIt results of the video file.
+            known (KnownTitle): The title learned from an earlier sort, or None.
+            relative (Path): The destination relative to `dest_dir`.
+
+        Returns:
+            Path: The destination relative to `dest_dir`.
+        """
+        if known is None or not known.folder or Path(known.dest_dir) != self.dest_dir:
+            return relative
+        parts = list(relative.parts)
+        index = KnowledgeCache.title_folder(parts[:-1], str(guess["title"]))
+        if index is not None and parts[index] != known.folder:
+            loginf(f'Using known folder "{known.folder}" instead of "{parts[index]}"')
+            parts[index] = known.folder
+        return Path(*parts)
+
+    def remember_sort(
+        self, videofile_path: Path, guess, guessed_title, known, relative: Path
+    ):
+        """Remembers what the sort of a video file learned for
+        `KnowledgeCache.record`.
+
+        Args:
+            videofile_path (Path): The video file.
+            guess (dict): The final GuessIt results of the video file.
+            guessed_title (str): The title which GuessIt guessed.
+            known (KnownTitle): The title learned from an earlier sort, or None.
+            relative (Path): The destination relative to `dest_dir`.
+        """
+        if self.knowledge is None or not guess.get("title"):
+            return
+        title = str(guess["title"])
+        if known is None or Path(known.dest_dir) != self.dest_dir:
+            parts = relative.parts[:-1]
+            index = KnowledgeCache.title_folder(parts, title)
+            _, year = KnowledgeCache.split_year(
+                KnowledgeCache.normalize(title), guess.get("year")
+            )
+            folder = parts[index] if index is not None else ""
+            known = KnownTitle(guess["vtype"], title, year, str(self.dest_dir), folder)
+        dnzb = {
+            "proper_name": self.nzb_properties.dnzb_proper_name,
+            "episode_name": self.nzb_properties.dnzb_episode_name,
+            "movie_year": self.nzb_properties.dnzb_movie_year,
+            "more_info": self.nzb_properties.dnzb_more_info,
+        }
+        self.records[videofile_path] = SortRecord(
+            self.nzb_properties.nzb_name,
+            {header: value for header, value in dnzb.items() if value},
+            dict(self.dirnames),
+            self.compiled.fingerprint,
+            guess,
+            str(guessed_title or title),
+            known,
+        )
+
+    @timed("construct_path")
     def construct_path(self, videofile_path: Path) -> Path:
         """Parses the filename and generates a new name for renaming.
 
@@ -1136,6 +1275,9 @@ class Determine:
 
         # Parse the filename using GuessIt.
         guess = self.guess_info(clean_videofile_path)
+        self.guesses[videofile_path] = guess
+        guessed_title = guess.get("title")
+        known = self.lookup_known_title(guess)
         mapping = []
         self.add_common_mapping(clean_videofile_path, guess, mapping)
 
@@ -1186,7 +1328,16 @@ class Determine:
             path_str = path_str.replace("%up", "..")
 
         # Build the new path by joining destination directory with the relative path parts.
-        videofile_dest_relative = Path(path_str)
+        videofile_dest_relative = self.apply_known_folder(guess, known, Path(path_str))
+
+        # Snap the folders to the existing folders of the library
+        if self.library is not None:
+            videofile_dest_relative = self.library.canonical(
+                self.dest_dir, videofile_dest_relative
+            )
+        self.remember_sort(
+            videofile_path, guess, guessed_title, known, videofile_dest_relative
+        )
 
         videofile_dest = self.dest_dir.joinpath(
             *videofile_dest_relative.parts
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+from pathlib import Path
+from plan import MovePlan
+from nzbget_utils import logwar
+
+
+class MoveJournal:
+    """
+    Write-ahead journal of the moves of a job, stored next to the download directory
+    (e.g. `.My.Show.S01.deobfuscationsort.journal` beside `My.Show.S01/`).
+
+    The journal is an append-only file of JSON lines: the move plan first, then one
+    entry per completed move. In streaming mode, the plan of every release is added
+    before its moves. Every entry is written with a single `write` and fsync'd
+    before the script continues, so after a crash or a kill the journal holds the
+    plan and every move that has been completed. A truncated last line
+    (a crash in the middle of a write) is ignored.
+
+    When the script is started again for the same download directory, the plan is
+    read back instead of being computed again, so nothing is guessed twice and the
+    unique names decided by the first run are kept. The journal is removed once all
+    moves of the job have been executed without errors.
+    """
+
+    SUFFIX = ".deobfuscationsort.journal"
+
+    # Without it, Windows translates the line endings of the entries
+    _O_BINARY = getattr(os, "O_BINARY", 0)
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+
+    @staticmethod
+    def for_download_dir(download_dir: Path) -> "MoveJournal":
+        """Returns the journal of the job in `download_dir`."""
+        name = f".{download_dir.name}{MoveJournal.SUFFIX}"
+        return MoveJournal(download_dir.parent / name)
+
+    def load(self):
+        """Reads the journal of an interrupted run.
+
+        Returns:
+            tuple: (plan, completed) where `plan` is the `MovePlan` of the interrupted
+                run and `completed` the set of source files moved by it, or
+                (None, set()) if there is no journal.
+        """
+        try:
+            with open(self.path, encoding="utf-8") as journal:
+                lines = journal.read().split("\n")
+        except FileNotFoundError:
+            return None, set()
+
+        plan = None
+        completed = set()
+        for line in lines:
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logwar(f'Ignoring damaged entry of journal "{self.path}"')
+                continue
+            if "plan" in entry:
+                # In streaming mode, the plan of every release is a separate entry
+                moves = MovePlan.from_dict(entry["plan"]).moves
+                plan = MovePlan(moves if plan is None else plan.moves + moves)
+            elif "done" in entry:
+                completed.add(Path(entry["done"]))
+        return plan, completed
+
+    def begin(self, plan: MovePlan):
+        """Starts a new journal with `plan`, replacing an existing one."""
+        self.close()
+        self.fd = os.open(
+            self.path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | MoveJournal._O_BINARY,
+            0o644,
+        )
+        self._append({"plan": plan.to_dict()})
+        MoveJournal._sync_directory(self.path.parent)
+
+    def extend(self, plan: MovePlan):
+        """Adds the `plan` of the next release of a streamed job, starting a new
+        journal with the first one."""
+        if self.fd is None:
+            self.begin(plan)
+        else:
+            self._append({"plan": plan.to_dict()})
+
+    def resume(self):
+        """Continues the existing journal."""
+        self.close()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | MoveJournal._O_BINARY)
+        size = os.fstat(self.fd).st_size
+        if size:
+            os.lseek(self.fd, -1, os.SEEK_END)
+        if size and os.read(self.fd, 1) != b"\n":
+            # Terminate the truncated last entry of the interrupted run
+            os.write(self.fd, b"\n")
+
+    def record(self, move):
+        """Records that `move` has been completed."""
+        self._append({"done": str(move.src), "dst": str(move.dst)})
+
+    def remove(self):
+        """Removes the journal after the job has been completed."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _append(self, entry: dict):
+        data = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self.lock:
+            # A single write per entry: a crash cannot interleave two entries
+            os.write(self.fd, data)
+            os.fsync(self.fd)
+
+    @staticmethod
+    def _sync_directory(directory: Path):
+        """Makes the creation of the journal durable. Windows can neither open nor
+        sync directories, and makes new files durable with their data."""
+        if os.name == "nt":
+            return
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,458 @@
+import re
+import json
+import time
+import sqlite3
+import difflib
+import contextlib
+from pathlib import Path
+from dataclasses import dataclass
+from nzbget_utils import logdet, logwar
+
+
+@dataclass(frozen=True)
+class KnownTitle:
+    """
+    A title learned from a successful sort.
+
+    Attributes:
+        vtype (str): The video type, e.g. "series" or "movie".
+        title (str): The title which the first sort used, e.g. "Show Name".
+        year (int): The year of the title, 0 if unknown.
+        dest_dir (str): The destination directory of the video type.
+        folder (str): The folder of the title in `dest_dir`, e.g.
+            "Show Name (2019)", or "" if the format has no such folder.
+    """
+
+    vtype: str
+    title: str
+    year: int
+    dest_dir: str
+    folder: str
+
+
+@dataclass(frozen=True)
+class SortRecord:
+    """
+    What a sort of a video file learned, added to the cache once the video file has
+    been moved.
+
+    Attributes:
+        nzb_name (str): The name of the NZB of the job.
+        dnzb (dict): The DNZB headers of the job which are set.
+        dirnames (dict): The deobfuscated NZB dirnames, see `Determine.dirnames`.
+        fingerprint (str): The fingerprint of the options which deobfuscated them.
+        guess (dict): The final GuessIt result of the video file.
+        guessed_title (str): The title which GuessIt guessed, before the lookup.
+        known (KnownTitle): The title and the folder the video file was sorted to.
+    """
+
+    nzb_name: str
+    dnzb: dict
+    dirnames: dict
+    fingerprint: str
+    guess: dict
+    guessed_title: str
+    known: KnownTitle
+
+
+class KnowledgeCache:
+    """
+    Persistent index of the titles and destination folders of successful sorts, so
+    that later jobs of the same show or movie resolve to the same title, casing and
+    folder: episode 7 of a show lands in the folder created for episode 1, even if
+    its name is cased differently or lacks the year.
+
+    The index is a SQLite database of two tables:
+
+    - "releases": per NZB name, its DNZB headers, deobfuscated dirnames, GuessIt
+      result and destination folder, so that a job which is post-processed again
+      reuses its dirnames;
+    - "titles": per video type and normalized title (see `normalize`) and year, the
+      title and folder of the first sort. The titles guessed for later jobs are
+      added as aliases of the same folder.
+
+    Titles are looked up by their normalized key without a trailing year, then
+    fuzzily among the keys which share the first word and differ from it by a single
+    typo in a word (see `lookup_title`).
+    Entries which have not been used for `max_age` seconds are evicted, then the
+    least recently used ones beyond `max_entries`.
+
+    Every operation opens its own connection, so the cache can be used from the
+    mover thread in streaming mode and by concurrent jobs. Errors of the database
+    are logged and disable the cache for the rest of the job.
+    """
+
+    SCHEMA_VERSION = 1
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS releases (
+            nzb_name TEXT PRIMARY KEY,
+            dnzb TEXT NOT NULL,
+            dirnames TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            guess TEXT NOT NULL,
+            vtype TEXT NOT NULL,
+            title TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            used REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS titles (
+            vtype TEXT NOT NULL,
+            key TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            dest_dir TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            used REAL NOT NULL,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (vtype, key, year)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS releases_used ON releases (used)",
+        "CREATE INDEX IF NOT EXISTS titles_used ON titles (used)",
+    )
+
+    # Most entries kept per table
+    MAX_ENTRIES = 10000
+    # Seconds after which unused entries are evicted (one year)
+    MAX_AGE = 365 * 24 * 3600
+    # Seconds to wait for the lock of another job
+    TIMEOUT = 30
+    # Least `difflib` ratio of a fuzzy match, and most candidates compared
+    FUZZY_RATIO = 0.9
+    FUZZY_CANDIDATES = 200
+    # Least length of a word with a typo in a fuzzy match
+    TYPO_LENGTH = 4
+
+    _DROPPED_RE = re.compile(r"['.]")
+    _SEPARATORS_RE = re.compile(r"[\W_]+")
+    _YEAR_SUFFIX_RE = re.compile(r"^(.+) ((?:19|20)\d\d)$")
+
+    def __init__(
+        self,
+        path: Path,
+        max_entries=MAX_ENTRIES,
+        max_age=MAX_AGE,
+        read_only: bool = False,
+    ):
+        """
+        Args:
+            path (Path): The database file, created if necessary.
+            max_entries (int): Most entries kept per table.
+            max_age (float): Seconds after which unused entries are evicted.
+            read_only (bool): True to only look titles up, e.g. in preview mode:
+                the file is neither created nor changed, and the entries are not
+                marked as used.
+        """
+        self.path = Path(path)
+        self.read_only = read_only
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.disabled = False
+        self.created = False
+
+    @staticmethod
+    def normalize(title: str) -> str:
+        """Returns the key of `title`: lower case words of letters and digits
+        separated by single spaces, e.g. "Marvel's Agents.of_S.H.I.E.L.D." -->
+        "marvels agents of shield"."""
+        key = KnowledgeCache._DROPPED_RE.sub("", title.lower())
+        return " ".join(KnowledgeCache._SEPARATORS_RE.sub(" ", key).split())
+
+    @staticmethod
+    def split_year(key: str, year=None):
+        """Splits a trailing year off `key`.
+
+        Args:
+            key (str): A normalized title, e.g. "show name 2019".
+            year (int, optional): The year guessed with the title, if any.
+
+        Returns:
+            tuple: The key without the year and the year, 0 if unknown, e.g.
+                ("show name", 2019).
+        """
+        match = KnowledgeCache._YEAR_SUFFIX_RE.match(key)
+        if match:
+            return match.group(1), int(match.group(2))
+        try:
+            return key, int(year or 0)
+        except (TypeError, ValueError):
+            return key, 0
+
+    @staticmethod
+    def title_folder(relative_dirs, title: str):
+        """Returns the index of the folder of `title` among `relative_dirs`, the
+        first one whose key starts with the key of `title`, or None."""
+        key = KnowledgeCache.normalize(title)
+        if not key:
+            return None
+        for index, part in enumerate(relative_dirs):
+            part_key = KnowledgeCache.normalize(part)
+            if part_key == key or part_key.startswith(key + " "):
+                return index
+        return None
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Yields a connection in a transaction, committed on success."""
+        if self.read_only:
+            connection = sqlite3.connect(
+                f"{self.path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=KnowledgeCache.TIMEOUT,
+            )
+        else:
+            connection = sqlite3.connect(self.path, timeout=KnowledgeCache.TIMEOUT)
+        try:
+            with connection:
+                if not self.created:
+                    self._create(connection)
+                yield connection
+        finally:
+            connection.close()
+
+    def _create(self, connection):
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, KnowledgeCache.SCHEMA_VERSION):
+            raise sqlite3.DatabaseError(f"unsupported schema version {version}")
+        if self.read_only:
+            if version != KnowledgeCache.SCHEMA_VERSION:
+                raise sqlite3.DatabaseError("no tables to read")
+            self.created = True
+            return
+        for statement in KnowledgeCache.SCHEMA:
+            connection.execute(statement)
+        connection.execute(f"PRAGMA user_version = {KnowledgeCache.SCHEMA_VERSION}")
+        self.created = True
+
+    def _run(self, operation, default=None):
+        """Returns `operation(connection)`, or `default` if the cache is disabled
+        or the database fails."""
+        if self.disabled or (self.read_only and not self.path.exists()):
+            return default
+        try:
+            if not self.read_only:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.connect() as connection:
+                return operation(connection)
+        except (sqlite3.Error, OSError) as e:
+            logwar(f'Cannot use knowledge file "{self.path}", disabling it: {e}')
+            self.disabled = True
+            return default
+
+    def lookup_release(self, nzb_name: str, fingerprint: str) -> dict:
+        """Returns the deobfuscated dirnames learned for `nzb_name` with options of
+        `fingerprint`, or None."""
+
+        def lookup(connection):
+            row = connection.execute(
+                "SELECT dirnames FROM releases WHERE nzb_name = ? AND fingerprint = ?",
+                (nzb_name, fingerprint),
+            ).fetchone()
+            if row is None:
+                return None
+            if not self.read_only:
+                connection.execute(
+                    "UPDATE releases SET used = ? WHERE nzb_name = ?",
+                    (time.time(), nzb_name),
+                )
+            return json.loads(row[0])
+
+        return self._run(lookup)
+
+    def lookup_title(self, vtype: str, title: str, year=None) -> KnownTitle:
+        """Looks up the title learned for `title`, trying in turn:
+
+        1. its key without a trailing year, e.g. "show name" for "Show Name 2019";
+        2. the most similar key which starts with the same word and has the same
+           words but one with a typo (see `is_typo`), if its `difflib` ratio
+           reaches `FUZZY_RATIO`. Numbers never differ, so that e.g. "Toy Story 4"
+           does not match "Toy Story 3".
+
+        Both only match titles with the same year or without a year, so that e.g.
+        the remake of a movie gets its own folder.
+
+        Args:
+            vtype (str): The video type of the title.
+            title (str): The title guessed for a video file.
+            year (int, optional): The year guessed with the title.
+
+        Returns:
+            KnownTitle: The title, or None if none is known.
+        """
+        key, year = KnowledgeCache.split_year(KnowledgeCache.normalize(title), year)
+        if not key:
+            return None
+
+        def lookup(connection):
+            columns = "key, year, title, dest_dir, folder"
+            compatible = "(year = ? OR year = 0 OR ? = 0)"
+            row = connection.execute(
+                f"SELECT {columns} FROM titles WHERE vtype = ? AND key = ? AND "
+                f"{compatible} ORDER BY year = ? DESC, hits DESC LIMIT 1",
+                (vtype, key, year, year, year),
+            ).fetchone()
+            how = "exact"
+            if row is None:
+                first_word = key.split(" ", 1)[0]
+                candidates = connection.execute(
+                    f"SELECT {columns} FROM titles WHERE vtype = ? AND key >= ? AND "
+                    f"key < ? AND {compatible} ORDER BY used DESC LIMIT ?",
+                    (
+                        vtype,
+                        first_word,
+                        first_word + "\uffff",
+                        year,
+                        year,
+                        KnowledgeCache.FUZZY_CANDIDATES,
+                    ),
+                ).fetchall()
+                ratio, row = KnowledgeCache.best_match(key, candidates)
+                if row is None:
+                    return None
+                how = f"fuzzy ({ratio:.2f})"
+            if not self.read_only:
+                connection.execute(
+                    "UPDATE titles SET used = ?, hits = hits + 1 WHERE vtype = ? AND "
+                    "key = ? AND year = ?",
+                    (time.time(), vtype, row[0], row[1]),
+                )
+            logdet(f'knowledge: {how} match of "{title}" with "{row[2]}"')
+            _, known_year, known_title, dest_dir, folder = row
+            return KnownTitle(vtype, known_title, known_year, dest_dir, folder)
+
+        return self._run(lookup)
+
+    @staticmethod
+    def is_typo(word: str, other: str) -> bool:
+        """Checks if the different words `word` and `other` only differ by a missing,
+        extra or swapped letter, e.g. "name" and "nme" or "witcher" and "wticher".
+        A different letter is not a typo, as e.g. "watcher" and "witcher" are
+        different words, and neither are a plural "s", words with digits and words
+        shorter than `TYPO_LENGTH` letters."""
+        if len(word) < len(other):
+            word, other = other, word
+        if (
+            len(word) < KnowledgeCache.TYPO_LENGTH
+            or len(word) - len(other) > 1
+            or any(c.isdigit() for c in word + other)
+        ):
+            return False
+        index = next(
+            (i for i, (a, b) in enumerate(zip(word, other)) if a != b), len(other)
+        )
+        if len(word) > len(other):
+            if index == len(other) and word[-1] == "s":
+                # A plural, e.g. "aliens" and "alien"
+                return False
+            return word[index + 1 :] == other[index:]
+        return (
+            index + 1 < len(word)
+            and word[index] == other[index + 1]
+            and word[index + 1] == other[index]
+            and word[index + 2 :] == other[index + 2 :]
+        )
+
+    @staticmethod
+    def is_fuzzy_match(key: str, other: str) -> bool:
+        """Checks if the keys `key` and `other` have the same words but one, which
+        has a typo (see `is_typo`)."""
+        words, other_words = key.split(" "), other.split(" ")
+        if len(words) != len(other_words):
+            return False
+        differences = [
+            (word, other_word)
+            for word, other_word in zip(words, other_words)
+            if word != other_word
+        ]
+        return len(differences) == 1 and KnowledgeCache.is_typo(*differences[0])
+
+    @staticmethod
+    def best_match(key: str, candidates):
+        """Returns the `difflib` ratio and the candidate row whose key is the most
+        similar to `key` among those which are a fuzzy match (see
+        `is_fuzzy_match`), or (0, None) if none reaches `FUZZY_RATIO`."""
+        best_ratio, best = 0.0, None
+        matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+        for row in candidates:
+            if not KnowledgeCache.is_fuzzy_match(key, row[0]):
+                continue
+            matcher.set_seq1(row[0])
+            if matcher.real_quick_ratio() < KnowledgeCache.FUZZY_RATIO:
+                continue
+            if matcher.quick_ratio() < KnowledgeCache.FUZZY_RATIO:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= KnowledgeCache.FUZZY_RATIO and ratio > best_ratio:
+                best_ratio, best = ratio, row
+        return best_ratio, best
+
+    def record(self, records):
+        """Adds the `SortRecord`s of the moved video files, then evicts the old
+        entries."""
+        if not records or self.read_only:
+            return
+
+        def record(connection):
+            now = time.time()
+            for record in records:
+                known = record.known
+                connection.execute(
+                    "INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        record.nzb_name,
+                        json.dumps(record.dnzb),
+                        json.dumps(record.dirnames),
+                        record.fingerprint,
+                        json.dumps(record.guess, default=str),
+                        known.vtype,
+                        known.title,
+                        str(Path(known.dest_dir, known.folder)),
+                        now,
+                    ),
+                )
+                # The first sort decides the title and folder of the title and of
+                # its aliases, unless the destination directory has changed since
+                for title in dict.fromkeys((known.title, record.guessed_title)):
+                    key, year = KnowledgeCache.split_year(
+                        KnowledgeCache.normalize(title), known.year
+                    )
+                    if not key:
+                        continue
+                    connection.execute(
+                        "INSERT INTO titles VALUES (?, ?, ?, ?, ?, ?, ?, 1) "
+                        "ON CONFLICT (vtype, key, year) DO UPDATE SET "
+                        "used = excluded.used, "
+                        "title = CASE WHEN dest_dir = excluded.dest_dir "
+                        "THEN title ELSE excluded.title END, "
+                        "folder = CASE WHEN dest_dir = excluded.dest_dir "
+                        "THEN folder ELSE excluded.folder END, "
+                        "dest_dir = excluded.dest_dir",
+                        (
+                            known.vtype,
+                            key,
+                            year,
+                            known.title,
+                            known.dest_dir,
+                            known.folder,
+                            now,
+                        ),
+                    )
+            self._evict(connection, now)
+            logdet(f'knowledge: recorded {len(records)} sorts in "{self.path}"')
+
+        self._run(record)
+
+    def _evict(self, connection, now: float):
+        for table in ("releases", "titles"):
+            connection.execute(
+                f"DELETE FROM {table} WHERE used < ?", (now - self.max_age,)
+            )
+            connection.execute(
+                f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} "
+                "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
@@ -25,12 +25,15 @@ def country(config, common_words):
     rebulk = Rebulk(disabled=lambda context: is_disabled(context, 'country'))
     rebulk = rebulk.defaults(name='country')
 
+    babelfish.country_converters['guessit'] = GuessitCountryConverter(config['synonyms'])
+    country_table = CountryTable(config['synonyms'])
+
     def find_countries(string, context=None):
         """
         Find countries in given string.
         """
         allowed_countries = context.get('allowed_countries') if context else None
-        return CountryFinder(allowed_countries, common_words).find(string)
+        return CountryFinder(allowed_countries, common_words, country_table).find(string)
 
     rebulk.functional(find_countries,
                       #  Prefer language and any other property over country if not US or GB.
@@ -41,8 +44,6 @@ def country(config, common_words):
                       properties={'country': [None]},
                       disabled=lambda context: not context.get('allowed_countries'))
 
-    babelfish.country_converters['guessit'] = GuessitCountryConverter(config['synonyms'])
-
     return rebulk
 
 
@@ -87,12 +88,77 @@ class GuessitCountryConverter(babelfish.CountryReverseConverter):  # pylint: dis
         raise babelfish.CountryReverseError(name)
 
 
+class CountryTable:
+    """
+    Precomputed lookup from lowercased word to babelfish Country, built once per configuration.
+
+    The table is equivalent to ``babelfish.Country.fromguessit(word)``: guessit synonyms first, then alpha2
+    codes and country names. Results filtered by a set of allowed countries are cached per allowed set,
+    including misses.
+    """
+
+    _MAX_CACHE_SIZE = 10000
+
+    def __init__(self, synonyms):
+        countries = {}
+        for alpha2, synlist in synonyms.items():
+            for syn in synlist:
+                countries.setdefault(syn.lower(), alpha2)
+        for alpha2 in babelfish.COUNTRIES:
+            countries.setdefault(alpha2.lower(), alpha2)
+        for alpha2, name in babelfish.country_converters['name'].to_name.items():
+            countries.setdefault(name.lower(), alpha2)
+
+        self.countries = countries
+        self.allowed_caches = {}
+
+    def lookup(self, word):
+        """
+        Return the Country for the given lowercased word, or None.
+        """
+        alpha2 = self.countries.get(word)
+        return babelfish.Country(alpha2) if alpha2 else None
+
+    def allowed_cache(self, allowed_countries):
+        """
+        Return the cache of word -> allowed Country (or None) for the given set of allowed countries.
+        """
+        key = frozenset(allowed_countries)
+        cache = self.allowed_caches.get(key)
+        if cache is None or len(cache) >= self._MAX_CACHE_SIZE:
+            cache = self.allowed_caches[key] = {}
+        return cache
+
+
 class CountryFinder:
     """Helper class to search and return country matches."""
 
-    def __init__(self, allowed_countries, common_words):
+    def __init__(self, allowed_countries, common_words, country_table=None):
         self.allowed_countries = {l.lower() for l in allowed_countries or []}
         self.common_words = common_words
+        self.country_table = country_table
+        self.parsed = country_table.allowed_cache(self.allowed_countries) if country_table else {}
+
+    def parse_country(self, word):
+        """Return the allowed Country for the given lowercased word, or None."""
+        try:
+            return self.parsed[word]
+        except KeyError:
+            pass
+
+        if self.country_table:
+            country_object = self.country_table.lookup(word)
+        else:
+            try:
+                country_object = babelfish.Country.fromguessit(word)
+            except babelfish.Error:
+                country_object = None
+        if country_object is not None and not (
+                country_object.name.lower() in self.allowed_countries or
+                country_object.alpha2.lower() in self.allowed_countries):
+            country_object = None
+        self.parsed[word] = country_object
+        return country_object
 
     def find(self, string):
         """Return all matches for country."""
@@ -101,13 +167,9 @@ class CountryFinder:
             if word.lower() in self.common_words:
                 continue
 
-            try:
-                country_object = babelfish.Country.fromguessit(word)
-                if (country_object.name.lower() in self.allowed_countries or
-                        country_object.alpha2.lower() in self.allowed_countries):
-                    yield self._to_rebulk_match(word_match, country_object)
-            except babelfish.Error:
-                continue
+            country_object = self.parse_country(word)
+            if country_object is not None:
+                yield self._to_rebulk_match(word_match, country_object)
 
     @classmethod
     def _to_rebulk_match(cls, word, value):
@@ -49,13 +49,16 @@ def language(config, common_words):
                   validator=seps_surround, tags=['source-suffix'],
                   disabled=lambda context: is_disabled(context, 'language'))
 
+    babelfish.language_converters['guessit'] = GuessitConverter(config['synonyms'])
+    language_table = LanguageTable(config['synonyms'])
+
     def find_languages(string, context=None):
         """Find languages in the string
 
         :return: list of tuple (property, Language, lang_word, word)
         """
         return LanguageFinder(context, subtitle_prefixes, subtitle_suffixes,
-                              lang_prefixes, lang_suffixes, weak_affixes).find(string)
+                              lang_prefixes, lang_suffixes, weak_affixes, language_table).find(string)
 
     rebulk.functional(find_languages,
                       properties={'language': [None]},
@@ -67,8 +70,6 @@ def language(config, common_words):
                  RemoveInvalidLanguages(common_words),
                  RemoveUndeterminedLanguages)
 
-    babelfish.language_converters['guessit'] = GuessitConverter(config['synonyms'])
-
     return rebulk
 
 
@@ -127,6 +128,73 @@ class GuessitConverter(babelfish.LanguageReverseConverter):  # pylint: disable=m
         raise babelfish.LanguageReverseError(name)
 
 
+class LanguageTable:
+    """
+    Precomputed lookup from lowercased word to babelfish Language, built once per configuration.
+
+    The table is equivalent to ``babelfish.Language.fromguessit(word)`` for all words that can be resolved
+    by the guessit synonyms, alpha3, alpha3b, alpha2, name and opensubtitles converters (in the precedence
+    order of :class:`GuessitConverter`). Other words (e.g. IETF codes such as "pt-br") are resolved by the
+    converter once and cached, including misses.
+
+    Results filtered by a set of allowed languages are cached per allowed set as well, so a word is
+    converted and checked against the allowed languages at most once per process.
+    """
+
+    _MAX_CACHE_SIZE = 10000
+
+    def __init__(self, synonyms):
+        languages = {}
+        for code, synlist in synonyms.items():
+            (alpha3, country) = code.split('_') if '_' in code else (code, None)
+            for syn in synlist:
+                languages.setdefault(syn.lower(), (alpha3, country))
+        for alpha3 in babelfish.LANGUAGES:
+            languages.setdefault(alpha3.lower(), (alpha3, None))
+        for converter_name in ('alpha3b', 'alpha2', 'name'):
+            converter = babelfish.language_converters[converter_name]
+            for alpha3, symbol in converter.to_symbol.items():
+                languages.setdefault(symbol.lower(), (alpha3, None))
+        opensubtitles = babelfish.language_converters['opensubtitles']
+        for code, (alpha3, country) in opensubtitles.from_opensubtitles.items():
+            languages.setdefault(code.lower(), (alpha3, country))
+
+        self.languages = languages
+        self.misses = {}
+        self.allowed_caches = {}
+
+    def lookup(self, word):
+        """
+        Return the Language for the given lowercased word, or None.
+        """
+        try:
+            return babelfish.Language(*self.languages[word])
+        except KeyError:
+            pass
+        try:
+            return self.misses[word]
+        except KeyError:
+            pass
+        try:
+            lang = babelfish.Language.fromguessit(word)
+        except babelfish.Error:
+            lang = None
+        if len(self.misses) >= self._MAX_CACHE_SIZE:
+            self.misses.clear()
+        self.misses[word] = lang
+        return lang
+
+    def allowed_cache(self, allowed_languages):
+        """
+        Return the cache of word -> allowed Language (or None) for the given set of allowed languages.
+        """
+        key = frozenset(allowed_languages)
+        cache = self.allowed_caches.get(key)
+        if cache is None or len(cache) >= self._MAX_CACHE_SIZE:
+            cache = self.allowed_caches[key] = {}
+        return cache
+
+
 def length_comparator(value):
     """
     Return value length.
@@ -198,9 +266,11 @@ class LanguageFinder:
 
     def __init__(self, context,
                  subtitle_prefixes, subtitle_suffixes,
-                 lang_prefixes, lang_suffixes, weak_affixes):
+                 lang_prefixes, lang_suffixes, weak_affixes, language_table=None):
         allowed_languages = context.get('allowed_languages') if context else None
         self.allowed_languages = {l.lower() for l in allowed_languages or []}
+        self.language_table = language_table
+        self.parsed = language_table.allowed_cache(self.allowed_languages) if language_table else {}
         self.weak_affixes = weak_affixes
         self.prefixes_map = {}
         self.suffixes_map = {}
@@ -351,15 +421,25 @@ class LanguageFinder:
         Multi and Undetermined languages are also valid languages.
         """
         try:
-            lang = babelfish.Language.fromguessit(lang_word)
-            if ((hasattr(lang, 'name') and lang.name.lower() in self.allowed_languages) or
-                    (hasattr(lang, 'alpha2') and lang.alpha2.lower() in self.allowed_languages) or
-                    lang.alpha3.lower() in self.allowed_languages):
-                return lang
-
-        except babelfish.Error:
+            return self.parsed[lang_word]
+        except KeyError:
             pass
 
+        if self.language_table:
+            lang = self.language_table.lookup(lang_word)
+        else:
+            try:
+                lang = babelfish.Language.fromguessit(lang_word)
+            except babelfish.Error:
+                lang = None
+        if lang is not None and not (
+                (hasattr(lang, 'name') and lang.name.lower() in self.allowed_languages) or
+                (hasattr(lang, 'alpha2') and lang.alpha2.lower() in self.allowed_languages) or
+                lang.alpha3.lower() in self.allowed_languages):
+            lang = None
+        self.parsed[lang_word] = lang
+        return lang
+
 
 class SubtitlePrefixLanguageRule(Rule):
     """
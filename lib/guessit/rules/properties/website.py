@@ -17,6 +17,61 @@ from ..common.pattern import is_disabled
 from ..common.validators import seps_surround
 from ...reutils import build_or_pattern
 
+_TLD_CANDIDATE_RE = re.compile(r'\.([a-z]{2,})(?![a-z0-9])', re.IGNORECASE)
+_MAX_CACHE_SIZE = 1000
+_tlds = None
+
+
+def registered_tlds():
+    """
+    All registered domain extensions, lowercased. The list is loaded on first use only.
+
+    :return: Registered domain extensions
+    :rtype: frozenset
+    """
+    global _tlds  # pylint:disable=global-statement
+    if _tlds is None:
+        tld_file = files('guessit.data').joinpath('tlds-alpha-by-domain.txt').read_text(encoding='utf-8')
+        _tlds = frozenset(
+            tld.strip().lower()
+            for tld in tld_file.split('\n')[1:]
+            if tld.strip() and '--' not in tld
+        )
+    return _tlds
+
+
+def tld_pattern(template):
+    """
+    Builds a functional pattern for a website regex ending with a registered domain extension.
+
+    Instead of an alternation of all registered domain extensions, the input is first scanned for
+    `.xx` candidates, which are looked up in the set of registered domain extensions. The regex is
+    then built with the found extensions only, and cached by extension set. As a domain extension is
+    always a full dotted label, this finds the same matches as the full alternation.
+
+    :param template: regex with a `{tlds}` placeholder for the domain extensions alternation
+    :type template: str
+    :return: pattern function returning the (start, end) spans of the website group
+    :rtype: callable
+    """
+    cache = {}
+
+    def find_websites(input_string):
+        tlds = registered_tlds()
+        candidates = frozenset(candidate.lower() for candidate in _TLD_CANDIDATE_RE.findall(input_string))
+        candidates &= tlds
+        if not candidates:
+            return None
+        regex = cache.get(candidates)
+        if regex is None:
+            if len(cache) >= _MAX_CACHE_SIZE:
+                cache.clear()
+            regex = re.compile(template.replace('{tlds}', build_or_pattern(sorted(candidates))), re.IGNORECASE)
+            cache[candidates] = regex
+        return [match.span(1) for match in regex.finditer(input_string)]
+
+    return find_websites
+
 
 def website(config):
     """
@@ -31,32 +86,20 @@ def website(config):
     rebulk = rebulk.regex_defaults(flags=re.IGNORECASE).string_defaults(ignore_case=True)
     rebulk.defaults(name="website")
 
-    data_files = files('guessit.data')
-    tld_file = data_files.joinpath('tlds-alpha-by-domain.txt').read_text(encoding='utf-8')
-    tlds = [
-        tld.strip()
-        for tld in tld_file.split('\n')
-        if '--' not in tld
-    ][1:]  # All registered domain extension
-
     safe_tlds = config['safe_tlds']  # For sure a website extension
     safe_subdomains = config['safe_subdomains']  # For sure a website subdomain
     safe_prefix = config['safe_prefixes']  # Those words before a tlds are sure
     website_prefixes = config['prefixes']
 
-    rebulk.regex(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
-                 r'\.)+(?:[a-z-0-9-]+\.)+(?:'+build_or_pattern(tlds) +
-                 r'))(?:[^a-z0-9]|$)',
-                 children=True)
+    rebulk.functional(tld_pattern(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
+                                  r'\.)+(?:[a-z-0-9-]+\.)+(?:{tlds}))(?:[^a-z0-9]|$)'))
     rebulk.regex(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
                  r'\.)*[a-z0-9-]+\.(?:'+build_or_pattern(safe_tlds) +
                  r'))(?:[^a-z0-9]|$)',
                  safe_subdomains=safe_subdomains, safe_tlds=safe_tlds, children=True)
-    rebulk.regex(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
-                 r'\.)*[a-z0-9-]+\.(?:'+build_or_pattern(safe_prefix) +
-                 r'\.)+(?:'+build_or_pattern(tlds) +
-                 r'))(?:[^a-z0-9]|$)',
-                 safe_subdomains=safe_subdomains, safe_prefix=safe_prefix, tlds=tlds, children=True)
+    rebulk.functional(tld_pattern(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
+                                  r'\.)*[a-z0-9-]+\.(?:'+build_or_pattern(safe_prefix) +
+                                  r'\.)+(?:{tlds}))(?:[^a-z0-9]|$)'))
 
     rebulk.string(*website_prefixes,
                   validator=seps_surround, private=True, tags=['website.prefix'])
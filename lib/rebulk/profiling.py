@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Profiler of patterns and rules.
+
+Install a `RebulkProfiler` with `set_profiler` to gather call counts, match counts
+and cumulative time per pattern (in `Rebulk._matches_patterns`) and per rule (in
+`execute_rule`). Without a profiler, the hooks only check a module variable.
+"""
+import re
+
+# Active profiler, None if profiling is disabled
+PROFILER = None
+
+
+def set_profiler(profiler):
+    """
+    Installs a profiler, or disables profiling with None.
+
+    :param profiler:
+    :type profiler: RebulkProfiler
+    :return: the previous profiler
+    :rtype: RebulkProfiler
+    """
+    global PROFILER  # pylint:disable=global-statement
+    previous = PROFILER
+    PROFILER = profiler
+    return previous
+
+
+class RebulkProfiler:
+    """
+    Call counts, match counts and cumulative time per pattern and per rule.
+
+    `patterns` and `rules` map labels to `[calls, matches, seconds]` lists. For
+    rules, `matches` counts the calls whose condition triggered the consequence.
+    """
+
+    def __init__(self):
+        self.patterns = {}
+        self.rules = {}
+        self._labels = {}
+
+    @staticmethod
+    def pattern_label(pattern):
+        """
+        Label of a pattern in the report: its name and its representation.
+
+        :param pattern:
+        :type pattern: Pattern
+        :return:
+        :rtype: str
+        """
+        label = f"{pattern.name or '-'} {pattern!r}"
+        # Leave out addresses of functional patterns, so that reports can be compared
+        label = re.sub(r" at 0x[0-9a-f]+", "", label)
+        return label if len(label) <= 120 else label[:117] + "..."
+
+    @staticmethod
+    def rule_label(rule):
+        """
+        Label of a rule in the report: its class and module.
+
+        :param rule:
+        :type rule: Rule
+        :return:
+        :rtype: str
+        """
+        return f"{rule.__class__.__name__} ({rule.__class__.__module__})"
+
+    def _add(self, stats, obj, label_function, matches, seconds):
+        # The object is kept with its label, so that its id is not reused
+        cached = self._labels.get(id(obj))
+        if cached is None:
+            cached = self._labels[id(obj)] = (obj, label_function(obj))
+        label = cached[1]
+        entry = stats.get(label)
+        if entry is None:
+            stats[label] = [1, matches, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += matches
+            entry[2] += seconds
+
+    def add_pattern(self, pattern, matches, seconds):
+        """
+        Records a call of a pattern.
+
+        :param pattern:
+        :type pattern: Pattern
+        :param matches: number of matches found
+        :type matches: int
+        :param seconds:
+        :type seconds: float
+        """
+        self._add(self.patterns, pattern, self.pattern_label, matches, seconds)
+
+    def add_rule(self, rule, triggered, seconds):
+        """
+        Records a call of a rule.
+
+        :param rule:
+        :type rule: Rule
+        :param triggered: whether the consequence of the rule was executed
+        :type triggered: bool
+        :param seconds:
+        :type seconds: float
+        """
+        self._add(self.rules, rule, self.rule_label, 1 if triggered else 0, seconds)
@@ -4,7 +4,9 @@
 Entry point functions and classes for Rebulk
 """
 from logging import getLogger
+from time import perf_counter
 
+from . import profiling
 from .builder import Builder
 from .match import Matches
 from .processors import ConflictSolver, PrivateRemover
@@ -171,9 +173,15 @@ class Rebulk(Builder):
         """
         if not self.disabled(context):
             patterns = self.effective_patterns(context)
+            profiler = profiling.PROFILER
             for pattern in patterns:
                 if not pattern.disabled(context):
-                    pattern_matches = pattern.matches(matches.input_string, context)
+                    if profiler is None:
+                        pattern_matches = pattern.matches(matches.input_string, context)
+                    else:
+                        start = perf_counter()
+                        pattern_matches = pattern.matches(matches.input_string, context)
+                        profiler.add_pattern(pattern, len(pattern_matches), perf_counter() - start)
                     if pattern_matches:
                         log(pattern.log_level, "Pattern has %s match(es). (%s)", len(pattern_matches), pattern)
                     else:
@@ -7,12 +7,14 @@ from abc import ABCMeta, abstractmethod
 import inspect
 from itertools import groupby
 from logging import getLogger
+from time import perf_counter
 
 from .utils import is_iterable
 
 from .toposort import toposort
 
 from . import debug
+from . import profiling
 
 log = getLogger(__name__).log
 
@@ -327,12 +329,18 @@ def execute_rule(rule, matches, context):
     :rtype:
     """
     if rule.enabled(context):
+        profiler = profiling.PROFILER
+        if profiler is not None:
+            start = perf_counter()
         log(rule.log_level, "Checking rule condition: %s", rule)
         when_response = rule.when(matches, context)
         if when_response:
             log(rule.log_level, "Rule was triggered: %s", when_response)
             log(rule.log_level, "Running rule consequence: %s %s", rule, when_response)
             rule.then(matches, when_response, context)
+        if profiler is not None:
+            profiler.add_rule(rule, bool(when_response), perf_counter() - start)
+        if when_response:
             return when_response
     else:
         log(rule.log_level, "Rule is disabled: %s", rule)
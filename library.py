@@ -0,0 +1,195 @@
+import os
+import re
+import json
+import time
+import threading
+from pathlib import Path
+from knowledge import KnowledgeCache
+from nzbget_utils import loginf, logwar
+from timing import timings
+
+
+class LibraryIndex:
+    """
+    Index of the folders of the library, i.e. of the destination directories of
+    the video types ("MoviesDir", "SeriesDir", "DatedDir" and "OtherTvDir"), so
+    that the destinations of new files snap to the existing folders: a file guessed
+    as "show name/Season 1" goes to "Show Name (2019)/Season 01" if the library
+    already has it, instead of a parallel folder.
+
+    Every directory of a destination is listed once per job with `os.scandir`,
+    when a destination below it is first looked up, and its subdirectories are
+    indexed by their keys (see `key`), so every lookup is a dictionary access. The
+    listings are kept in a JSON file with the modification times of the
+    directories, and a later job only lists a directory again if its
+    modification time has changed. Listings taken within `RACY_NS` of the
+    modification time are not trusted, as the directory may have changed again in
+    the same tick of a coarse file system clock.
+    """
+
+    VERSION = 1
+
+    # Most years by which the year of an existing folder may differ
+    MAX_YEAR_DIFFERENCE = 1
+
+    # Nanoseconds after its modification time from which a listing is trusted
+    RACY_NS = 2 * 10**9
+
+    _LEADING_ZEROS_RE = re.compile(r"\b0+(\d)")
+
+    def __init__(self, roots, path: Path = None):
+        """
+        Args:
+            roots (list[Path]): The destination directories of the video types.
+            path (Path, optional): The file of the listings, None to list the
+                directories in every job.
+        """
+        self.roots = {Path(root) for root in roots if root and Path(root).is_absolute()}
+        self.path = Path(path) if path else None
+        # Listings of the directories: path -> [mtime_ns, scanned_ns, folders], with
+        # the name, key and year of every folder
+        self.listings = None
+        # Indexes of the directories used by the job: path -> {key: [(year, name)]}
+        self.indexes = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str):
+        """Returns the key of a folder name and its year, 0 if none, e.g.
+        ("show name", 2019) for "Show Name (2019)" and ("season 1", 0) for
+        "Season 01"."""
+        key = LibraryIndex._LEADING_ZEROS_RE.sub(r"\1", KnowledgeCache.normalize(name))
+        return KnowledgeCache.split_year(key)
+
+    def load(self):
+        """Reads the listings from the file, or starts without listings if it is
+        missing or cannot be read."""
+        self.listings = {}
+        if self.path is None:
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data.get("version") == LibraryIndex.VERSION:
+                self.listings = data["listings"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            loginf(f'Ignoring unreadable library index "{self.path}": {e}')
+
+    def save(self):
+        """Replaces the file with the listings if they have changed."""
+        with self.lock:
+            if self.path is None or not self.changed:
+                return
+            data = {"version": LibraryIndex.VERSION, "listings": self.listings}
+            tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path.write_text(json.dumps(data), encoding="utf-8")
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            self.changed = False
+
+    def _index(self, directory: Path) -> dict:
+        """Returns the index of the subdirectories of `directory`, listing it if its
+        listing is missing or outdated."""
+        index = self.indexes.get(directory)
+        if index is not None:
+            return index
+        if self.listings is None:
+            self.load()
+        listing = self.listings.get(str(directory))
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns is None:
+            folders = []
+            self.changed |= self.listings.pop(str(directory), None) is not None
+        elif (
+            listing is not None
+            and listing[0] == mtime_ns
+            and listing[1] - mtime_ns >= LibraryIndex.RACY_NS
+        ):
+            folders = listing[2]
+            timings.add("library_index.hit")
+        else:
+            scanned_ns = time.time_ns()
+            try:
+                with os.scandir(directory) as entries:
+                    names = sorted(entry.name for entry in entries if entry.is_dir())
+                folders = [[name, *LibraryIndex.key(name)] for name in names]
+                self.listings[str(directory)] = [mtime_ns, scanned_ns, folders]
+                self.changed = True
+            except OSError as e:
+                logwar(f'Cannot list library directory "{directory}": {e}')
+                folders = []
+            timings.add("library_index.scan")
+        index = {}
+        for name, key, year in folders:
+            index.setdefault(key, []).append((year, name))
+        self.indexes[directory] = index
+        return index
+
+    def lookup(self, directory: Path, name: str) -> str:
+        """Returns the existing subdirectory of `directory` for the folder `name`:
+        `name` itself, the one with the same key and year, or the only one with the
+        same key and a year which is unknown or close enough. None if there is no
+        such subdirectory or several."""
+        key, year = LibraryIndex.key(name)
+        with self.lock:
+            candidates = self._index(directory).get(key, ())
+        if any(existing == name for _, existing in candidates):
+            return name
+        compatible = [
+            (existing_year, existing)
+            for existing_year, existing in candidates
+            if not year
+            or not existing_year
+            or abs(existing_year - year) <= LibraryIndex.MAX_YEAR_DIFFERENCE
+        ]
+        same_year = [
+            existing for existing_year, existing in compatible if existing_year == year
+        ]
+        if len(same_year) == 1:
+            return same_year[0]
+        if len(compatible) == 1:
+            return compatible[0][1]
+        return None
+
+    def canonical(self, dest_dir: Path, relative: Path) -> Path:
+        """Returns the destination `relative` to `dest_dir` with its folders
+        replaced by the existing folders of the library they match (see
+        `lookup`). The folders which do not exist yet are added to the index.
+        Destinations outside of the library are returned unchanged."""
+        if dest_dir not in self.roots:
+            return relative
+        parts = list(relative.parts)
+        directory = dest_dir
+        for index, part in enumerate(parts[:-1]):
+            if part in (".", ".."):
+                break
+            existing = self.lookup(directory, part)
+            if existing is None:
+                # The later files of the job find the folder, as if it existed
+                self.add(directory / part)
+                existing = part
+            elif existing != part:
+                loginf(f'Using existing folder "{directory / existing}" for "{part}"')
+                parts[index] = existing
+            directory = directory / existing
+        return Path(*parts)
+
+    def add(self, directory: Path):
+        """Adds a directory which is going to be created to the index of its
+        parent."""
+        with self.lock:
+            index = self.indexes.get(directory.parent)
+            if index is not None:
+                key, year = LibraryIndex.key(directory.name)
+                names = index.setdefault(key, [])
+                if (year, directory.name) not in names:
+                    names.append((year, directory.name))
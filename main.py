@@ -23,9 +23,12 @@
 import os
 import sys
 import json
+import time
 from pathlib import Path
 
 from apply import Apply
+from options import Options
+from profiling import Profiler
 
 from nzbget_utils import (
     POSTPROCESS_ERROR,
@@ -37,6 +40,9 @@ from nzbget_utils import (
 
 sys.stdout.reconfigure(encoding="utf-8")
 
+# Start of the job, for the timings
+start = time.perf_counter()
+
 COMMIT_HASH = "c2a734c322f67ffa9b798204c2f8f030f29e4940"
 
 
@@ -72,7 +78,17 @@ if (
     logwar(f'Download of "{os.environ["NZBPP_NZBNAME"]}" has failed, exiting')
     sys.exit(POSTPROCESS_NONE)
 
-apply = Apply().run()
+options = Options()
+profiler = Profiler(
+    options.profile,
+    options.profile_dir,
+    options.nzb_properties.nzb_name,
+    options.profile_keep,
+)
+apply = profiler.run(lambda: Apply(options).run())
+elapsed = time.perf_counter() - start
+apply.report_timings(elapsed)
+apply.report_metrics(elapsed)
 
 # Returing status to NZBGet
 if apply.errors:
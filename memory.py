@@ -0,0 +1,70 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class MemoryBudget:
+    """
+    Memory used by the script (its resident set size), checked against an optional
+    limit: in streaming mode, no further batches are planned once the limit is
+    exceeded.
+
+    The current usage is read from "/proc/self/statm" on Linux, and the peak usage
+    from `getrusage` where available; the budget cannot be checked elsewhere, e.g.
+    on Windows.
+    """
+
+    def __init__(self, limit: int = 0):
+        """
+        Args:
+            limit (int): Bytes the script may use, 0 for no limit.
+        """
+        self.limit = limit
+
+    @staticmethod
+    def current():
+        """Returns the bytes the script uses, or None if unknown."""
+        try:
+            with open("/proc/self/statm", "rb") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError, AttributeError):
+            return MemoryBudget.peak()
+
+    @staticmethod
+    def peak():
+        """Returns the most bytes the script has used, or None if unknown."""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def exceeded(self) -> bool:
+        """Checks if the script uses more memory than the limit."""
+        if not self.limit:
+            return False
+        used = MemoryBudget.current()
+        return used is not None and used > self.limit
+
+    def report(self) -> str:
+        """Returns a log line with the current and peak memory usage."""
+        used = MemoryBudget.current()
+        peak = MemoryBudget.peak()
+        if used is not None and peak is not None:
+            peak = max(used, peak)
+        parts = [
+            f"{label} {MemoryBudget.format(value)}"
+            for label, value in (("current", used), ("peak", peak))
+            if value is not None
+        ]
+        if self.limit:
+            parts.append(f"limit {MemoryBudget.format(self.limit)}")
+        return f"memory: {', '.join(parts) if parts else 'unknown'}"
+
+    @staticmethod
+    def format(size: int) -> str:
+        return f"{size / 2**20:.1f} MiB"
@@ -0,0 +1,219 @@
+import os
+import time
+import contextlib
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class MetricsFile:
+    """
+    Metrics of all jobs in the text format of Prometheus, to be exported by the
+    textfile collector of the node exporter, e.g. as
+    "/var/lib/node_exporter/textfile/deobfuscationsort.prom".
+
+    The file is its own state: every job reads the counters and histograms in it,
+    adds its own numbers and replaces the file atomically, so the collector never
+    reads a partially written file. Concurrent post-processing runs are serialized
+    with a lock on a separate ".lock" file, as the metrics file itself is replaced.
+    """
+
+    PREFIX = "deobfuscationsort_"
+
+    # Upper bounds of the buckets of the histograms, in seconds
+    JOB_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+    CLEANUP_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+
+    # Name -> (type, help, buckets of histograms)
+    METRICS = {
+        "jobs_total": ("counter", "Jobs post-processed, by status.", None),
+        "job_duration_seconds": (
+            "histogram",
+            "Wall time of the post-processing of a job.",
+            JOB_BUCKETS,
+        ),
+        "cleanup_duration_seconds": (
+            "histogram",
+            "Time to clean up the download directory of a job.",
+            CLEANUP_BUCKETS,
+        ),
+        "files_total": (
+            "counter",
+            "Files placed, by method (rename, transfer, hardlink, reflink, symlink "
+            "or copy).",
+            None,
+        ),
+        "bytes_total": ("counter", "Bytes of the files placed, by method.", None),
+        "guessit_cache_total": (
+            "counter",
+            "Lookups of GuessIt results, by result (hit or miss).",
+            None,
+        ),
+        "errors_total": ("counter", "Errors of jobs, by exception type.", None),
+        "last_job_timestamp_seconds": (
+            "gauge",
+            "Time at which the last job finished.",
+            None,
+        ),
+    }
+
+    # Job timing counters with a label -> (metric, label name)
+    LABELED_COUNTERS = {
+        "placed_files": ("files_total", "method"),
+        "placed_bytes": ("bytes_total", "method"),
+        "guessit_cache": ("guessit_cache_total", "result"),
+        "errors": ("errors_total", "type"),
+    }
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+
+    def add_job(self, status: str, elapsed: float, job_timings: dict):
+        """Adds a job to the metrics.
+
+        Args:
+            status (str): How the job ended ("success", "none" or "error").
+            elapsed (float): Seconds the job took.
+            job_timings (dict): The timings of the job, see `Timings.to_dict`.
+        """
+        increments = {MetricsFile.series("jobs_total", status=status): 1}
+        for counter, value in job_timings["counters"].items():
+            name, _, label = counter.partition(".")
+            if name in MetricsFile.LABELED_COUNTERS and label:
+                metric, label_name = MetricsFile.LABELED_COUNTERS[name]
+                series = MetricsFile.series(metric, **{label_name: label})
+                increments[series] = increments.get(series, 0) + value
+        observations = [("job_duration_seconds", elapsed)]
+        cleanup = job_timings["stages"].get("cleanup_download_dir")
+        if cleanup:
+            observations.append(("cleanup_duration_seconds", cleanup["total"]))
+        gauges = {"last_job_timestamp_seconds": time.time()}
+        self.update(increments, observations, gauges)
+
+    def update(self, increments: dict, observations: list, gauges: dict):
+        """Updates the metrics file under its lock.
+
+        Args:
+            increments (dict): Counter series (see `series`) -> value added.
+            observations (list): (histogram, value) observed.
+            gauges (dict): Gauge series -> value set.
+        """
+        with self.locked():
+            samples = self.load()
+            for series, value in increments.items():
+                samples[series] = samples.get(series, 0) + value
+            for histogram, value in observations:
+                self._observe(samples, histogram, value)
+            samples.update(gauges)
+            self.write(samples)
+
+    @staticmethod
+    def series(metric: str, **labels) -> str:
+        """Returns the series of `metric` with `labels`, e.g.
+        'jobs_total{status="success"}'."""
+        if not labels:
+            return metric
+        escaped = (
+            f'{name}="{MetricsFile._escape(str(value))}"'
+            for name, value in labels.items()
+        )
+        return f"{metric}{{{','.join(escaped)}}}"
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    @staticmethod
+    def _observe(samples: dict, histogram: str, value: float):
+        buckets = MetricsFile.METRICS[histogram][2]
+        # Every bucket is added with the first observation, so they stay in order
+        for bound in buckets:
+            series = MetricsFile.series(f"{histogram}_bucket", le=bound)
+            samples[series] = samples.get(series, 0) + (value <= bound)
+        series = MetricsFile.series(f"{histogram}_bucket", le="+Inf")
+        samples[series] = samples.get(series, 0) + 1
+        samples[f"{histogram}_sum"] = samples.get(f"{histogram}_sum", 0) + value
+        samples[f"{histogram}_count"] = samples.get(f"{histogram}_count", 0) + 1
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Holds the lock of the metrics file, waiting for other jobs to release it."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is None:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def load(self) -> dict:
+        """Returns the samples of the metrics file: series -> value. Comments and
+        lines which cannot be parsed are skipped.
+        """
+        samples = {}
+        try:
+            text = self.path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return samples
+        for line in text.splitlines():
+            if not line.startswith(MetricsFile.PREFIX):
+                continue
+            series, _, value = line.rpartition(" ")
+            try:
+                samples[series[len(MetricsFile.PREFIX) :]] = float(value)
+            except ValueError:
+                continue
+        return samples
+
+    @staticmethod
+    def format(samples: dict) -> str:
+        """Returns `samples` in the text format, grouped by metric."""
+        families = {metric: [] for metric in MetricsFile.METRICS}
+        for series, value in samples.items():
+            name = series.partition("{")[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in families:
+                    name = name[: -len(suffix)]
+                    break
+            if name in families:
+                families[name].append((series, value))
+        lines = []
+        for metric, series_values in families.items():
+            if not series_values:
+                continue
+            kind, description, _ = MetricsFile.METRICS[metric]
+            lines.append(f"# HELP {MetricsFile.PREFIX}{metric} {description}")
+            lines.append(f"# TYPE {MetricsFile.PREFIX}{metric} {kind}")
+            for series, value in series_values:
+                if float(value).is_integer():
+                    value = int(value)
+                lines.append(f"{MetricsFile.PREFIX}{series} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, samples: dict):
+        """Replaces the metrics file atomically with `samples`."""
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.write(MetricsFile.format(samples))
+                file.flush()
+                os.fsync(file.fileno())
+            # The collector only reads files with a ".prom" suffix, so it never
+            # sees the temporary file
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
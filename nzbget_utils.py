@@ -1,3 +1,6 @@
+import contextlib
+import threading
+
 # Exit codes used by NZBGet
 POSTPROCESS_SUCCESS = 93
 POSTPROCESS_NONE = 95
@@ -14,8 +17,40 @@ def log_to_nzbget(msg, dest="DETAIL"):
         dest (str): The log destination (e.g., DETAIL, INFO, WARNING, ERROR).
     """
     prefix = f"[{dest}] "
+    captured = getattr(_capture, "lines", None)
     for line in msg.splitlines():
-        print(f"{prefix}{line}")
+        if captured is not None:
+            captured.append(f"{prefix}{line}")
+        else:
+            print(f"{prefix}{line}")
+
+
+# Log lines captured per thread by `capture_log`
+_capture = threading.local()
+
+
+@contextlib.contextmanager
+def capture_log():
+    """
+    Captures the log lines of the current thread instead of printing them, so that
+    the output of jobs running concurrently can be printed in a deterministic order
+    with `replay_log`.
+
+    Yields:
+        list: The captured lines, with their log prefixes.
+    """
+    previous = getattr(_capture, "lines", None)
+    _capture.lines = []
+    try:
+        yield _capture.lines
+    finally:
+        _capture.lines = previous
+
+
+def replay_log(lines):
+    """Prints log lines captured by `capture_log`."""
+    for line in lines:
+        print(line)
 
 
 def logdet(msg):
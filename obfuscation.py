@@ -0,0 +1,151 @@
+import math
+
+
+class ObfuscationScorer:
+    """
+    Scores how obfuscated a path part (a directory name or a file stem) is, to decide
+    which parts of a video's path are passed to GuessIt.
+
+    A part is scored in a single pass over its characters from these features:
+
+    - separators: release names separate their words with spaces, dots or
+      underscores, so a part without any is not a release name (e.g. a hash or
+      "S04E18"), as before;
+    - random tokens: words mixing letters and digits which are long, only consist
+      of hex digits, or switch between letters, digits and case so often that the
+      entropy of their character classes is high, e.g. "7741f2ea" or "J8sK2mQ9xL4p",
+      unlike "x264", "1080p" or "S01E02E03".
+
+    The score is `NO_SEPARATOR_SCORE` for a part without separators plus the share of
+    its letters and digits which are in random tokens; a part is obfuscated if its
+    score reaches `THRESHOLD`. The thresholds are calibrated on the test corpus and
+    on generated hash and scene names (see the "obfuscation" benchmark).
+
+    The results are cached per part, as every file of a job shares its directories.
+    """
+
+    SEPARATORS = frozenset(" ._")
+    HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+    VOWELS = frozenset("aeiouAEIOU")
+
+    NO_SEPARATOR_SCORE = 1.0
+    THRESHOLD = 0.5
+
+    # Tokens of letters and digits at least this long are random
+    RANDOM_LENGTH = 16
+    # Hex tokens at least this long are random
+    RANDOM_HEX_LENGTH = 8
+    # Tokens of lower case and upper case letters and digits at least this long are
+    # random if the entropy of these character classes in bits and the changes
+    # between them per character reach these minimums, e.g. "hwSbwwla1o0xe" but
+    # not "WEBRip1080p"
+    RANDOM_MIXED_LENGTH = 10
+    RANDOM_MIXED_ENTROPY = 0.9
+    RANDOM_MIXED_CHANGES = 1 / 3
+    # Mixed case tokens without digits at least `RANDOM_MIXED_LENGTH` long are
+    # random if they have fewer vowels per letter and at least as many case changes
+    # per character as these
+    RANDOM_VOWELS = 0.3
+    RANDOM_CASE_CHANGES = 1 / 4
+
+    # Most parts cached
+    CACHE_SIZE = 4096
+
+    def __init__(self):
+        self.cache = {}
+
+    def is_obfuscated(self, part: str) -> bool:
+        """Checks if `part` is obfuscated."""
+        obfuscated = self.cache.get(part)
+        if obfuscated is None:
+            if len(self.cache) >= ObfuscationScorer.CACHE_SIZE:
+                self.cache.clear()
+            # A part without separators is obfuscated whatever its tokens
+            obfuscated = ObfuscationScorer.SEPARATORS.isdisjoint(part) or (
+                ObfuscationScorer.score(part) >= ObfuscationScorer.THRESHOLD
+            )
+            self.cache[part] = obfuscated
+        return obfuscated
+
+    @staticmethod
+    def score(part: str) -> float:
+        """Returns the obfuscation score of `part`, 0 for a clean release name."""
+        separators = 0
+        alnum = 0
+        random = 0
+        # Character classes of the current token: [lower case, upper case, digit]
+        classes = [0, 0, 0]
+        hex_digits = vowels = changes = 0
+        last_class = None
+        for char in part + " ":
+            if char.isalnum():
+                if char.isdigit():
+                    char_class = 2
+                elif char.isupper():
+                    char_class = 1
+                else:
+                    char_class = 0
+                classes[char_class] += 1
+                hex_digits += char in ObfuscationScorer.HEX_DIGITS
+                vowels += char in ObfuscationScorer.VOWELS
+                changes += last_class is not None and char_class != last_class
+                last_class = char_class
+                continue
+            separators += char in ObfuscationScorer.SEPARATORS
+            length = sum(classes)
+            if length and ObfuscationScorer.is_random_token(
+                classes, hex_digits, vowels, changes
+            ):
+                random += length
+            alnum += length
+            classes = [0, 0, 0]
+            hex_digits = vowels = changes = 0
+            last_class = None
+        # The space appended to end the last token is not a separator
+        separators -= 1
+
+        score = random / alnum if alnum else 0.0
+        if not separators:
+            score += ObfuscationScorer.NO_SEPARATOR_SCORE
+        return score
+
+    @staticmethod
+    def is_random_token(classes, hex_digits, vowels, changes) -> bool:
+        """Checks if a token of letters and digits looks random.
+
+        Args:
+            classes (list[int]): The lower case letters, upper case letters and
+                digits of the token.
+            hex_digits (int): The hex digits of the token.
+            vowels (int): The vowels of the token.
+            changes (int): The changes between the classes from one character of the
+                token to the next.
+        """
+        lower, upper, digits = classes
+        length = lower + upper + digits
+        letters = lower + upper
+        if not digits:
+            # Only mixed case words with few vowels, e.g. "gwFrwILsnsJ" but not
+            # "KRaLiMaRKo" or "AlternativeToRequested"
+            return (
+                length >= ObfuscationScorer.RANDOM_MIXED_LENGTH
+                and lower > 0
+                and upper > 0
+                and vowels < ObfuscationScorer.RANDOM_VOWELS * letters
+                and changes >= ObfuscationScorer.RANDOM_CASE_CHANGES * length
+            )
+        if not letters:
+            return False
+        if length >= ObfuscationScorer.RANDOM_LENGTH:
+            return True
+        if length >= ObfuscationScorer.RANDOM_HEX_LENGTH and hex_digits == length:
+            return True
+        if length < ObfuscationScorer.RANDOM_MIXED_LENGTH or not (lower and upper):
+            return False
+        entropy = -sum(
+            count / length * math.log2(count / length) for count in classes if count
+        )
+        return (
+            entropy >= ObfuscationScorer.RANDOM_MIXED_ENTROPY
+            and changes >= ObfuscationScorer.RANDOM_MIXED_CHANGES * length
+        )
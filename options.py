@@ -1,7 +1,15 @@
 import os
 import sys
 import re
+import hashlib
+import tempfile
+from dataclasses import dataclass, field
+from typing import ClassVar
+from deobfuscation import Deobfuscator
 from nzbget_utils import POSTPROCESS_ERROR, logerr, loginf, logwar
+from placement import Placement
+from profiling import Profiler
+from transfer import TransferEngine
 from pathlib import Path
 
 
@@ -68,7 +76,97 @@ class ProcessingParameters:
         self.dnzb_headers = os.environ.get("NZBPO_DNZBHEADERS", "yes") == "yes"
         self.prefer_nzb_name = os.environ.get("NZBPO_PREFERNZBNAME", "") == "yes"
         self.deep_scan = self.dnzb_headers
-        self.deep_scan_ratio = 0.60
+        # Minimum trigram similarity between a satellite name and a video name
+        self.deep_scan_ratio = 0.25
+
+
+@dataclass(frozen=True)
+class CompiledOptions:
+    """
+    Immutable snapshot of the options that are looked up for every file, compiled
+    from the `ProcessingParameters`: sets of extensions and precompiled regular
+    expressions for the words and release groups and the `Deobfuscator`.
+
+    A snapshot only depends on the options it is compiled from, so it is compiled
+    once per process for each set of them (see `get`) and shared by all jobs of the
+    process, e.g. in benchmarks or a batch of jobs. Snapshots can be pickled to be
+    passed to worker processes; the regular expressions are compiled again when
+    unpickled.
+    """
+
+    # Options compiled (see `key`) -> snapshot
+    _snapshots: ClassVar[dict] = {}
+
+    # Hash of the options compiled, to tell snapshots apart across processes
+    fingerprint: str
+    video_extensions: frozenset
+    satellite_extensions: frozenset
+    # Strips the video file suffixes and the words of "DeObfuscateWords" from NZB
+    # directory names, compared by the fingerprint
+    deobfuscator: Deobfuscator = field(compare=False)
+    # Release group at the end of a name: a known release group or any word
+    release_group_re: re.Pattern
+    # Lower-case release group -> its spelling in "ReleaseGroups"
+    release_groups: dict
+    # (word, case-sensitive pattern, case-insensitive pattern) of the words of
+    # "LowerWords" and "UpperWords" in title case, which are replaced by the word
+    title_words: tuple
+
+    @staticmethod
+    def key(parameters: "ProcessingParameters") -> tuple:
+        """Returns the options of `parameters` which a snapshot is compiled from."""
+        return (
+            tuple(parameters.video_extensions),
+            tuple(parameters.satellite_extensions),
+            tuple(parameters.deobfuscate_words),
+            tuple(parameters.release_groups),
+            tuple(parameters.lower_words),
+            tuple(parameters.upper_words),
+        )
+
+    @staticmethod
+    def get(parameters: "ProcessingParameters") -> "CompiledOptions":
+        """Returns the snapshot of `parameters`, compiling it on first use."""
+        key = CompiledOptions.key(parameters)
+        snapshot = CompiledOptions._snapshots.get(key)
+        if snapshot is None:
+            snapshot = CompiledOptions.compile(parameters)
+            CompiledOptions._snapshots[key] = snapshot
+        return snapshot
+
+    @staticmethod
+    def compile(parameters: "ProcessingParameters") -> "CompiledOptions":
+        """Compiles the snapshot of `parameters`."""
+        fingerprint = hashlib.sha256(
+            repr(CompiledOptions.key(parameters)).encode("utf-8", "surrogatepass")
+        ).hexdigest()
+        release_groups_re = "|".join(
+            re.escape(token) for token in parameters.release_groups
+        )
+        release_groups = {}
+        for token in parameters.release_groups:
+            release_groups.setdefault(token.lower(), token)
+
+        title_words = []
+        for word in parameters.lower_words + parameters.upper_words:
+            pattern = r"\b" + re.escape(word.title()) + r"\b"
+            title_words.append(
+                (word, re.compile(pattern), re.compile(pattern, flags=re.IGNORECASE))
+            )
+
+        return CompiledOptions(
+            fingerprint=fingerprint,
+            video_extensions=frozenset(parameters.video_extensions),
+            satellite_extensions=frozenset(parameters.satellite_extensions),
+            deobfuscator=Deobfuscator(
+                parameters.deobfuscate_words, parameters.video_extensions
+            ),
+            release_group_re=re.compile(
+                r"-(([A-Za-z0-9]+)|{})$".format(release_groups_re), flags=re.IGNORECASE
+            ),
+            release_groups=release_groups,
+            title_words=tuple(title_words),
+        )
 
 
 class Options:
@@ -107,6 +205,7 @@ class Options:
         # Instantiate refactored classes.
         self.nzb_properties = NzbProperties()
         self.processing_parameters = ProcessingParameters()
+        self.compiled = CompiledOptions.get(self.processing_parameters)
 
         # Script options from NZBPO
         self.min_size = int(os.environ["NZBPO_MINSIZE"]) << 20
@@ -114,6 +213,33 @@ class Options:
         self.cleanup = os.environ["NZBPO_CLEANUP"] == "yes"
         self.preview = os.environ["NZBPO_PREVIEW"] == "yes"
         self.verbose = os.environ["NZBPO_VERBOSE"] == "yes"
+        self.placement = self._choice_option("NZBPO_PLACEMENT", "move", Placement.MODES)
+        self.transfer_sync = self._choice_option(
+            "NZBPO_TRANSFERSYNC", "no", TransferEngine.SYNC_POLICIES
+        )
+        self.transfer_workers = self._int_option("NZBPO_TRANSFERWORKERS", "4", 1)
+        self.transfer_device_workers = self._int_option(
+            "NZBPO_TRANSFERDEVICEWORKERS", "2", 1
+        )
+        self.execution = self._choice_option(
+            "NZBPO_EXECUTION", "threads", ("threads", "asyncio", "streaming")
+        )
+        self.memory_limit = self._int_option("NZBPO_MEMORYLIMIT", "0", 0) << 20
+        self.timings = self._choice_option("NZBPO_TIMINGS", "no", ("no", "log", "json"))
+        self.profile = self._choice_option("NZBPO_PROFILE", "off", Profiler.MODES)
+        self.profile_dir = Path(
+            os.environ.get("NZBPO_PROFILEDIR")
+            or Path(tempfile.gettempdir()) / "deobfuscationsort"
+        )
+        self.profile_keep = self._int_option("NZBPO_PROFILEKEEP", "10", 1)
+        metrics_file = os.environ.get("NZBPO_METRICSFILE", "")
+        self.metrics_file = Path(metrics_file) if metrics_file else None
+        knowledge_file = os.environ.get("NZBPO_KNOWLEDGEFILE", "")
+        self.knowledge_file = Path(knowledge_file) if knowledge_file else None
+        library_index_file = os.environ.get("NZBPO_LIBRARYINDEXFILE", "")
+        self.library_index_file = (
+            Path(library_index_file) if library_index_file else None
+        )
 
         if self.preview:
             logwar("*** PREVIEW MODE ON - NO CHANGES TO FILE SYSTEM ***")
@@ -125,3 +251,31 @@ class Options:
                     f"Option {optname[6:]} is missing in configuration file. Please check script settings"
                 )
                 sys.exit(POSTPROCESS_ERROR)
+
+    @staticmethod
+    def _choice_option(optname: str, default: str, choices) -> str:
+        """Returns the value of the optional option `optname`, which must be one of
+        `choices`."""
+        value = os.environ.get(optname, default)
+        if value not in choices:
+            logerr(
+                f'Option {optname[6:]} has invalid value "{value}", expected one of: {", ".join(choices)}. Please check script settings'
+            )
+            sys.exit(POSTPROCESS_ERROR)
+        return value
+
+    @staticmethod
+    def _int_option(optname: str, default: str, minimum: int) -> int:
+        """Returns the value of the optional option `optname`, which must be a whole
+        number of at least `minimum`."""
+        value = os.environ.get(optname, default)
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if number is None or number < minimum:
+            logerr(
+                f'Option {optname[6:]} has invalid value "{value}", expected a whole number of at least {minimum}. Please check script settings'
+            )
+            sys.exit(POSTPROCESS_ERROR)
+        return number
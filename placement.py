@@ -0,0 +1,121 @@
+import errno
+import os
+from pathlib import Path
+from nzbget_utils import logdet
+from transfer import TransferEngine
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class Placement:
+    """
+    Places files at their destination with one of the placement modes:
+
+    - "move": rename the file, or copy it and remove the source when the destination
+      is on another file system;
+    - "hardlink": add a hard link to the file, which keeps the download directory
+      intact without using any additional space;
+    - "reflink": clone the file (`FICLONE`), which shares the data blocks of the
+      source on copy-on-write file systems such as btrfs and XFS;
+    - "symlink": create a symbolic link to the file in the download directory.
+
+    Hard links and clones only work within one file system, and not every file system
+    supports them. Whether they work is probed with the first file placed from one
+    device onto another, and the result is cached per pair of devices (i.e. mounts),
+    so that files are not linked in vain again and again. When a link or clone is not
+    possible, the file is copied and the source is kept.
+    """
+
+    MODES = ("move", "hardlink", "reflink", "symlink")
+
+    # ioctl request to clone a file, from <linux/fs.h>
+    FICLONE = 0x40049409
+
+    # Errors that indicate that a mode is not supported for a pair of devices
+    _UNSUPPORTED_ERRNOS = frozenset(
+        (
+            errno.EXDEV,
+            errno.EPERM,
+            errno.EOPNOTSUPP,
+            errno.ENOTTY,
+            errno.EINVAL,
+            errno.ENOSYS,
+        )
+    )
+
+    def __init__(self, mode: str = "move", transfer: TransferEngine = None):
+        """
+        Args:
+            mode (str): One of `MODES`.
+            transfer (TransferEngine, optional): Copies files which cannot be placed
+                with `mode`.
+        """
+        assert mode in Placement.MODES
+        self.mode = mode
+        self.transfer = transfer if transfer else TransferEngine()
+        # (mode, source device, destination device) -> True if supported, or the
+        # error which showed that it is not
+        self.capabilities = {}
+
+    @property
+    def keeps_source(self) -> bool:
+        """True if the files in the download directory are kept."""
+        return self.mode != "move"
+
+    def place(self, src_file: Path, dst_file: Path) -> str:
+        """Places `src_file` at `dst_file`, whose parent directory must exist.
+
+        Returns:
+            str: How the file has been placed ("rename", "transfer", "hardlink",
+                "reflink", "symlink" or "copy").
+        """
+        if self.mode == "move":
+            try:
+                src_file.rename(dst_file)
+                return "rename"
+            except OSError as ex:
+                logdet(f"place: rename failed;use transfer.move ({ex})")
+                self.transfer.move(src_file, dst_file)
+                return "transfer"
+
+        if self.mode == "symlink":
+            os.symlink(src_file.resolve(), dst_file)
+            return "symlink"
+
+        devices = (os.stat(src_file).st_dev, os.stat(dst_file.parent).st_dev)
+        key = (self.mode, *devices)
+        reason = self.capabilities.get(key, True)
+        if reason is True:
+            try:
+                if self.mode == "hardlink":
+                    os.link(src_file, dst_file)
+                else:
+                    self._reflink(src_file, dst_file)
+                self.capabilities[key] = True
+                return self.mode
+            except OSError as ex:
+                if ex.errno not in Placement._UNSUPPORTED_ERRNOS:
+                    raise
+                reason = str(ex)
+                self.capabilities[key] = reason
+        logdet(
+            f"place: {self.mode} not supported from device {devices[0]} to {devices[1]} ({reason})"
+        )
+        self.transfer.copy(src_file, dst_file)
+        return "copy"
+
+    def _reflink(self, src_file: Path, dst_file: Path):
+        """Clones `src_file` to `dst_file` through a temporary file."""
+        if fcntl is None:
+            raise OSError(errno.ENOSYS, "reflinks are not supported on this platform")
+        tmp_file = TransferEngine.temp_name(dst_file)
+        try:
+            with open(src_file, "rb") as src, open(tmp_file, "xb") as dst:
+                fcntl.ioctl(dst.fileno(), Placement.FICLONE, src.fileno())
+            os.replace(tmp_file, dst_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
@@ -0,0 +1,101 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(frozen=True)
+class Move:
+    """
+    A single planned move of a file of the job.
+
+    Attributes:
+        src (Path): The file in the download directory.
+        dst (Path): The final destination, after unique-name resolution.
+        reason (str): Why the file goes there, e.g. "episode" or "movie" for videos
+            and the rule that assigned a satellite to its video ("same name", "nfo",
+            "episode", "similarity").
+        overwrite (bool): True if an existing file at `dst` is replaced.
+        unique (bool): True if `dst` got a unique suffix because the destination
+            from the format was already taken.
+        video (Path): For satellites, the `src` of the video they belong to.
+    """
+
+    src: Path
+    dst: Path
+    reason: str
+    overwrite: bool = False
+    unique: bool = False
+    video: Path = None
+
+    def to_dict(self) -> dict:
+        return {
+            "src": str(self.src),
+            "dst": str(self.dst),
+            "reason": self.reason,
+            "overwrite": self.overwrite,
+            "unique": self.unique,
+            "video": None if self.video is None else str(self.video),
+        }
+
+    @staticmethod
+    def from_dict(obj: dict) -> "Move":
+        return Move(
+            src=Path(obj["src"]),
+            dst=Path(obj["dst"]),
+            reason=obj["reason"],
+            overwrite=obj.get("overwrite", False),
+            unique=obj.get("unique", False),
+            video=None if obj.get("video") is None else Path(obj["video"]),
+        )
+
+
+@dataclass(frozen=True)
+class MovePlan:
+    """
+    The moves of a job, in the order in which they were planned: every video file is
+    followed by its satellites.
+
+    A plan only describes what is to be done, so it can be logged in preview mode,
+    stored as JSON and replayed or compared with the plan of another run.
+    """
+
+    VERSION = 1
+
+    moves: tuple = ()
+
+    def __len__(self):
+        return len(self.moves)
+
+    def groups(self):
+        """Returns the moves grouped by video.
+
+        Returns:
+            list: Tuples of moves, each starting with a video followed by its
+                satellites.
+        """
+        groups = []
+        for move in self.moves:
+            if move.video is None or not groups:
+                groups.append([move])
+            else:
+                groups[-1].append(move)
+        return [tuple(group) for group in groups]
+
+    def to_dict(self) -> dict:
+        return {
+            "version": MovePlan.VERSION,
+            "moves": [move.to_dict() for move in self.moves],
+        }
+
+    @staticmethod
+    def from_dict(obj: dict) -> "MovePlan":
+        if obj.get("version") != MovePlan.VERSION:
+            raise ValueError(f"Unsupported move plan version {obj.get('version')}")
+        return MovePlan(tuple(Move.from_dict(move) for move in obj["moves"]))
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def from_json(text: str) -> "MovePlan":
+        return MovePlan.from_dict(json.loads(text))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# Rule-level profiler of GuessIt for DeobfuscationSort post-processing script for
+# NZBGet.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with the program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Guesses every name of a corpus with the rebulk profiler installed and reports
+# the call counts, match counts and cumulative time of the patterns and rules:
+#
+#   profile_rules.py [-c corpus] [-n top] [-s time|calls|matches] [-j report.json]
+#
+# The corpus is testdata.json by default, or a text file with one name per line.
+#
+
+import sys
+import json
+import time
+import getopt
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "lib"))
+import guessit
+from rebulk import profiling
+
+# Options with which Determine calls GuessIt
+GUESSIT_OPTIONS = {"allowed_languages": [], "allowed_countries": []}
+
+SORT_KEYS = {"calls": 0, "matches": 1, "time": 2}
+
+corpus = Path(__file__).resolve().parent / "testdata.json"
+top = 25
+sort_key = "time"
+json_report = None
+
+options, _ = getopt.getopt(
+    sys.argv[1:], "c:n:s:j:", ["corpus=", "top=", "sort=", "json="]
+)
+for opt, arg in options:
+    if opt in ("-c", "--corpus"):
+        corpus = Path(arg)
+    elif opt in ("-n", "--top"):
+        top = int(arg)
+    elif opt in ("-s", "--sort"):
+        if arg not in SORT_KEYS:
+            sys.exit(f"Unknown sort key {arg}, expected one of {list(SORT_KEYS)}")
+        sort_key = arg
+    elif opt in ("-j", "--json"):
+        json_report = Path(arg)
+
+
+def load_corpus(path: Path):
+    """Returns the names of `path`: the input files of a testdata.json file, or the
+    lines of a text file."""
+    if path.suffix == ".json":
+        testdata = json.load(open(path, encoding="UTF-8"))
+        return [testobj["INPUTFILE"] for testobj in testdata if "INPUTFILE" in testobj]
+    return [line for line in path.read_text(encoding="UTF-8").splitlines() if line]
+
+
+def print_table(title, stats, total):
+    """Prints the `top` entries of `stats` with their share of `total` seconds."""
+    entries = sorted(stats.items(), key=lambda item: -item[1][SORT_KEYS[sort_key]])
+    print(f"\n{title} ({len(stats)}, by {sort_key}):")
+    print(f"{'calls':>8} {'matches':>8} {'ms':>9} {'%':>6}  name")
+    for name, (calls, matches, seconds) in entries[:top]:
+        share = seconds * 100.0 / total if total else 0.0
+        print(f"{calls:8} {matches:8} {seconds * 1000.0:9.2f} {share:6.1f}  {name}")
+
+
+names = load_corpus(corpus)
+
+# Configure GuessIt before profiling, so that only the guessing is measured
+guessit.guessit(names[0], GUESSIT_OPTIONS)
+
+profiler = profiling.RebulkProfiler()
+profiling.set_profiler(profiler)
+start = time.perf_counter()
+for name in names:
+    guessit.guessit(name, GUESSIT_OPTIONS)
+elapsed = time.perf_counter() - start
+profiling.set_profiler(None)
+
+print(f"{len(names)} names guessed in {elapsed * 1000.0:.2f} ms (profiled)")
+print_table("Rules", profiler.rules, elapsed)
+print_table("Patterns", profiler.patterns, elapsed)
+
+if json_report:
+    json_report.write_text(
+        json.dumps(
+            {
+                "names": len(names),
+                "seconds": elapsed,
+                "rules": profiler.rules,
+                "patterns": profiler.patterns,
+            },
+            indent=2,
+        )
+        + "\n",
+        encoding="UTF-8",
+    )
@@ -0,0 +1,130 @@
+import io
+import os
+import re
+import time
+import pstats
+import cProfile
+import tracemalloc
+from pathlib import Path
+from nzbget_utils import loginf, logwar
+
+
+class Profiler:
+    """
+    Profiles a job to find out why a particular release makes the script slow or
+    memory-hungry:
+
+    - "cpu": runs the job under `cProfile` and writes a `.prof` file, which can be
+      inspected with `pstats` or tools such as snakeviz;
+    - "memory": traces the allocations of the job with `tracemalloc` and writes a
+      `.snapshot` file, which can be loaded with `tracemalloc.Snapshot.load`.
+
+    The files are named after the NZB and the time of the job. The `TOP` hotspots
+    are logged, and only the newest `keep` profiles are kept in the directory;
+    other files in the directory are left alone.
+    """
+
+    MODES = ("off", "cpu", "memory")
+
+    SUFFIXES = {"cpu": ".prof", "memory": ".snapshot"}
+
+    # Names of the profiles written by `profile_path`: tag, time and process id
+    NAME_PATTERN = re.compile(r"[\w.-]+\.\d{8}-\d{6}\.\d+\.(?:prof|snapshot)")
+
+    # Number of hotspots logged
+    TOP = 20
+
+    # Frames kept per traced allocation
+    TRACEMALLOC_FRAMES = 10
+
+    def __init__(self, mode: str, directory: Path, nzb_name: str, keep: int = 10):
+        """
+        Args:
+            mode (str): One of `MODES`.
+            directory (Path): Directory of the profiles, created if necessary.
+            nzb_name (str): Name of the NZB of the job, to tag the profile.
+            keep (int): Number of profiles kept in `directory`.
+        """
+        assert mode in Profiler.MODES
+        self.mode = mode
+        self.directory = Path(directory)
+        self.nzb_name = nzb_name
+        self.keep = max(1, keep)
+
+    def profile_path(self) -> Path:
+        """Returns the path of the profile of the job."""
+        tag = re.sub(r"[^\w.-]+", "_", self.nzb_name).strip("._")[:100] or "job"
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        suffix = Profiler.SUFFIXES[self.mode]
+        return self.directory / f"{tag}.{stamp}.{os.getpid()}{suffix}"
+
+    def run(self, function):
+        """Runs `function` with the profiler of `mode` and returns its result."""
+        if self.mode == "cpu":
+            return self._run_cpu(function)
+        if self.mode == "memory":
+            return self._run_memory(function)
+        return function()
+
+    def _run_cpu(self, function):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function()
+        finally:
+            profile.disable()
+            path = self._save(profile.dump_stats)
+            output = io.StringIO()
+            stats = pstats.Stats(profile, stream=output)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(Profiler.TOP)
+            loginf(f"profile: top {Profiler.TOP} functions by cumulative time:")
+            lines = output.getvalue().splitlines()
+            loginf("\n".join(line for line in lines if line))
+            if path:
+                loginf(f'profile: written to "{path}"')
+
+    def _run_memory(self, function):
+        tracemalloc.start(Profiler.TRACEMALLOC_FRAMES)
+        try:
+            return function()
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = self._save(snapshot.dump)
+            loginf(
+                f"profile: {current / 2**20:.1f} MiB allocated at the end, {peak / 2**20:.1f} MiB peak"
+            )
+            loginf(f"profile: top {Profiler.TOP} allocations by line:")
+            for stat in snapshot.statistics("lineno")[: Profiler.TOP]:
+                loginf(f"profile:   {stat}")
+            if path:
+                loginf(f'profile: written to "{path}"')
+
+    def _save(self, dump) -> Path:
+        """Writes the profile with `dump(path)` and rotates the directory.
+
+        Returns:
+            Path: The profile, or None if it could not be written.
+        """
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.profile_path()
+            dump(str(path))
+            self.rotate()
+            return path
+        except OSError as e:
+            logwar(f'Cannot write profile to "{self.directory}": {e}')
+            return None
+
+    def rotate(self):
+        """Removes the oldest profiles beyond the newest `keep`. Only the files named
+        like `profile_path` are profiles."""
+        profiles = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and Profiler.NAME_PATTERN.fullmatch(entry.name):
+                    profiles.append((entry.stat().st_mtime_ns, entry.name))
+        profiles.sort(reverse=True)
+        for _, name in profiles[self.keep :]:
+            (self.directory / name).unlink(missing_ok=True)
@@ -0,0 +1,165 @@
+import os
+import asyncio
+import threading
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from nzbget_utils import capture_log, replay_log
+
+
+class IOScheduler:
+    """
+    Runs I/O jobs, such as moving a video file and its satellites to another mount,
+    on a bounded thread pool.
+
+    Every job is keyed by the device it writes to. At most `per_device` jobs run
+    concurrently on the same device, so a single slow NAS share is not flooded with
+    streams while the pool can still copy to other devices in parallel. Jobs without
+    a device (e.g. renames within one file system, which are cheap) run in the
+    calling thread, in the order in which they were given.
+
+    `run_async` schedules the same jobs as asyncio tasks, for the asyncio execution
+    mode.
+    """
+
+    def __init__(self, workers: int, per_device: int):
+        """
+        Args:
+            workers (int): Maximum number of jobs running at the same time.
+            per_device (int): Maximum number of jobs writing to the same device.
+        """
+        self.workers = max(1, workers)
+        self.per_device = max(1, per_device)
+
+    @staticmethod
+    def device(path: Path):
+        """Returns the device of `path` or of its closest existing parent."""
+        for parent in (path, *path.parents):
+            try:
+                return os.stat(parent).st_dev
+            except FileNotFoundError:
+                continue
+        return None
+
+    def run(self, jobs):
+        """
+        Runs all jobs and waits for them to finish.
+
+        Args:
+            jobs (list): (device, function) tuples, `device` None for jobs to run in
+                the calling thread.
+
+        Returns:
+            list: For every job, in the order of `jobs`, None if it succeeded or the
+                exception it raised.
+        """
+        results = [None] * len(jobs)
+        # The jobs of every device wait in its queue until one of the `per_device`
+        # jobs of the device running in the pool finishes, so that no worker of
+        # the pool is blocked by a busy device while other devices are idle
+        queues = {}
+        for idx, (device, function) in enumerate(jobs):
+            if device is not None:
+                queues.setdefault(device, deque()).append((idx, function))
+        remaining = sum(len(queue) for queue in queues.values())
+        lock = threading.RLock()
+        done = threading.Event()
+        if not remaining:
+            done.set()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+            def submit(device):
+                idx, function = queues[device].popleft()
+                future = executor.submit(function)
+                future.add_done_callback(lambda future: finished(device, idx, future))
+
+            def finished(device, idx, future):
+                nonlocal remaining
+                results[idx] = future.exception()
+                with lock:
+                    remaining -= 1
+                    if queues[device]:
+                        submit(device)
+                    if not remaining:
+                        done.set()
+
+            with lock:
+                for device, queue in queues.items():
+                    for _ in range(min(self.per_device, len(queue))):
+                        submit(device)
+            for idx, (device, function) in enumerate(jobs):
+                if device is None:
+                    try:
+                        function()
+                    except Exception as e:
+                        results[idx] = e
+            done.wait()
+        return results
+
+    async def run_async(self, jobs, executor: ThreadPoolExecutor = None):
+        """
+        Runs all jobs as tasks of the running event loop and waits for them to
+        finish. The jobs themselves run on `executor`; jobs without a device run
+        one after another, in the order in which they were given, while the jobs
+        with a device run concurrently.
+
+        The log output of every job is captured and printed in the order of
+        `jobs`, so that it does not depend on which job finishes first.
+
+        Args:
+            jobs (list): (device, function) tuples, `device` None for jobs to run
+                one after another.
+            executor (ThreadPoolExecutor, optional): Runs the jobs; by default a
+                pool of `workers` threads.
+
+        Returns:
+            list: For every job, in the order of `jobs`, None if it succeeded or the
+                exception it raised.
+        """
+        loop = asyncio.get_running_loop()
+        limits = {
+            device: asyncio.Semaphore(self.per_device)
+            for device, _ in jobs
+            if device is not None
+        }
+
+        def captured(function):
+            with capture_log() as lines:
+                try:
+                    function()
+                except Exception as e:
+                    return lines, e
+            return lines, None
+
+        async def limited(function, limit):
+            async with limit:
+                return await loop.run_in_executor(executor, captured, function)
+
+        async def after(previous, function):
+            if previous is not None:
+                await previous
+            return await loop.run_in_executor(executor, captured, function)
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            tasks = []
+            previous = None
+            for device, function in jobs:
+                if device is None:
+                    previous = asyncio.create_task(after(previous, function))
+                    tasks.append(previous)
+                else:
+                    tasks.append(asyncio.create_task(limited(function, limits[device])))
+
+            results = []
+            for task in tasks:
+                lines, e = await task
+                replay_log(lines)
+                results.append(e)
+            return results
+        finally:
+            if own_executor:
+                executor.shutdown()
@@ -0,0 +1,149 @@
+import math
+import re
+from collections import Counter
+
+
+class SimilarityIndex:
+    """
+    Character trigram index over the release names of a job's video files.
+
+    Every name is normalized (lowercased, separators collapsed to single spaces)
+    and turned into a TF-IDF weighted trigram vector. The vectors are stored in an
+    inverted index (trigram -> postings) so that scoring a query against all videos
+    only touches the postings of the query's own trigrams instead of comparing the
+    query with every candidate.
+
+    Trigrams shared by all names of a pack (such as the show name or the release
+    group) get a low weight, trigrams that only occur in a few names (such as the
+    episode number) get a high weight, which makes the index well suited to tell
+    the episodes of a season pack apart.
+    """
+
+    # Minimum cosine similarity for a match
+    DEFAULT_THRESHOLD = 0.25
+    # The best match must score at least this many times higher than the runner-up,
+    # otherwise the name is considered ambiguous (e.g. a season NFO in a season pack)
+    DEFAULT_MARGIN = 2.0
+
+    _SEPARATORS_RE = re.compile(r"[\s._\-\[\](){}]+")
+
+    def __init__(self, names: dict):
+        """
+        Args:
+            names (dict): Maps a key (e.g. the video file path) to its release name.
+        """
+        self.keys = list(names.keys())
+        self.postings = {}
+        self.norms = []
+
+        vectors = [
+            SimilarityIndex.trigrams(SimilarityIndex.normalize(name))
+            for name in names.values()
+        ]
+
+        document_frequency = Counter()
+        for vector in vectors:
+            document_frequency.update(vector.keys())
+
+        count = len(vectors)
+        self.idf = {
+            gram: math.log((1.0 + count) / df)
+            for gram, df in document_frequency.items()
+        }
+        # Weight for trigrams which do not occur in any indexed name: these are
+        # typically language tags or flags ("english", "forced") of a satellite and
+        # should not outweigh the trigrams that identify the video
+        self.idf_unknown = min(self.idf.values(), default=0.0)
+
+        for doc, vector in enumerate(vectors):
+            norm = 0.0
+            for gram, tf in vector.items():
+                weight = tf * self.idf[gram]
+                self.postings.setdefault(gram, []).append((doc, weight))
+                norm += weight * weight
+            self.norms.append(math.sqrt(norm))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """Lowercases `name` and collapses all separators into single spaces."""
+        collapsed = SimilarityIndex._SEPARATORS_RE.sub(" ", name.lower()).strip()
+        return f" {collapsed} "
+
+    @staticmethod
+    def trigrams(text: str) -> Counter:
+        """Returns the character trigram counts of `text`."""
+        return Counter(text[idx : idx + 3] for idx in range(len(text) - 2))
+
+    def scores(self, name: str) -> dict:
+        """
+        Scores `name` against all indexed names.
+
+        Returns:
+            dict: Maps the index of every name sharing at least one trigram with
+                `name` to the cosine similarity of both names (0.0 - 1.0).
+        """
+        accumulated = {}
+        query_norm = 0.0
+        query = SimilarityIndex.trigrams(SimilarityIndex.normalize(name))
+        for gram, tf in query.items():
+            idf = self.idf.get(gram, self.idf_unknown)
+            weight = tf * idf
+            query_norm += weight * weight
+            for doc, doc_weight in self.postings.get(gram, ()):
+                accumulated[doc] = accumulated.get(doc, 0.0) + weight * doc_weight
+
+        query_norm = math.sqrt(query_norm)
+        if not query_norm:
+            return {}
+        return {
+            doc: score / (query_norm * self.norms[doc])
+            for doc, score in accumulated.items()
+            if self.norms[doc]
+        }
+
+    def best_match(self, name: str, threshold: float = None):
+        """
+        Finds the indexed name most similar to `name`.
+
+        Args:
+            name (str): The name to look up, e.g. the stem of a subtitle file.
+            threshold (float, optional): Minimum similarity for a match.
+
+        Returns:
+            tuple: (key, ratio) of the best match or (None, ratio) if the best
+                match is below `threshold` or not clearly better than the runner-up.
+        """
+        if threshold is None:
+            threshold = SimilarityIndex.DEFAULT_THRESHOLD
+        best_doc = None
+        best_ratio = 0.0
+        second_ratio = 0.0
+        for doc, ratio in self.scores(name).items():
+            if ratio > best_ratio:
+                best_doc = doc
+                second_ratio = best_ratio
+                best_ratio = ratio
+            elif ratio > second_ratio:
+                second_ratio = ratio
+        if best_doc is None or best_ratio < threshold:
+            return None, best_ratio
+        if best_ratio < second_ratio * SimilarityIndex.DEFAULT_MARGIN:
+            return None, best_ratio
+        return self.keys[best_doc], best_ratio
+
+    def assign(self, names: dict, threshold: float = None) -> dict:
+        """
+        Assigns every name in `names` to its best-matching indexed name in a single pass.
+
+        Args:
+            names (dict): Maps a key (e.g. the satellite file path) to its name.
+            threshold (float, optional): Minimum similarity for an assignment.
+
+        Returns:
+            dict: Maps every key of `names` to the key of the best-matching indexed
+                name, or to None if no indexed name is similar enough.
+        """
+        return {key: self.best_match(name, threshold)[0] for key, name in names.items()}
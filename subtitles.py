@@ -0,0 +1,141 @@
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "lib"))
+import babelfish
+from guessit.options import load_config
+
+
+class SubtitleLanguageDetector:
+    """
+    Detects the language of subtitle files named like `Show.S01E01.en.srt`,
+    `Show.S01E01.eng.forced.srt` or `S01E05.German.sdh.srt` without running GuessIt.
+
+    The lookup table from lowercased token to language is built once from the
+    babelfish alpha2/alpha3b/name/opensubtitles tables and GuessIt's language
+    synonyms, so detecting the trailing language of a file name is a dictionary
+    lookup per dot-separated suffix.
+
+    `detect` returns None for names it cannot decide on (e.g. a trailing word that
+    is both a language code and a common word such as "it" or "no", or a language
+    embedded in a segment such as "Show S01E01 [English]"); the caller should then
+    fall back to GuessIt.
+    """
+
+    # Subtitle flags which may follow the language, e.g. `Movie.en.forced.srt`. "hi"
+    # (hearing impaired) is only a flag after a language, as it is also Hindi
+    FLAGS = frozenset(("forced", "sdh", "cc", "hi", "default", "full"))
+
+    _SEGMENT_SPLIT_RE = re.compile(r"[\s_\-\[\](){}]+")
+    _EPISODE_RES = (
+        re.compile(r"\bS(\d{1,3})[ ._-]?E(\d{1,4})", re.IGNORECASE),
+        re.compile(r"\b(\d{1,2})x(\d{2,3})\b", re.IGNORECASE),
+    )
+
+    def __init__(self):
+        advanced_config = load_config({"no_user_config": True})["advanced_config"]
+        self.common_words = frozenset(advanced_config["common_words"])
+        self.languages = SubtitleLanguageDetector._build_languages(
+            advanced_config["language"]["synonyms"]
+        )
+
+    @staticmethod
+    def _build_languages(synonyms):
+        """Builds the lookup table from lowercased token to babelfish Language.
+
+        The precedence follows GuessIt's `GuessitConverter`: synonyms first, then
+        alpha3b, alpha2, name and opensubtitles codes. Only languages which have an
+        alpha2 or alpha3b code are included, which keeps the thousands of obscure
+        ISO 639-3 names (some of which are common English words) out of the table.
+        """
+        languages = {}
+        for code, synlist in synonyms.items():
+            alpha3, _, country = code.partition("_")
+            language = babelfish.Language(alpha3, country or None)
+            for syn in synlist:
+                languages.setdefault(syn.lower(), language)
+
+        alpha2 = babelfish.language_converters["alpha2"].to_symbol
+        alpha3b = babelfish.language_converters["alpha3b"].to_symbol
+        names = babelfish.language_converters["name"].to_symbol
+        major = set(alpha2) | set(alpha3b)
+
+        for alpha3, symbol in alpha3b.items():
+            languages.setdefault(symbol.lower(), babelfish.Language(alpha3))
+        for alpha3 in major:
+            languages.setdefault(alpha3.lower(), babelfish.Language(alpha3))
+        for alpha3, symbol in alpha2.items():
+            languages.setdefault(symbol.lower(), babelfish.Language(alpha3))
+        for alpha3 in major:
+            if alpha3 in names:
+                name = names[alpha3].lower()
+                languages.setdefault(name, babelfish.Language(alpha3))
+
+        opensubtitles = babelfish.language_converters["opensubtitles"]
+        for code, (alpha3, country) in opensubtitles.from_opensubtitles.items():
+            languages.setdefault(code.lower(), babelfish.Language(alpha3, country))
+        return languages
+
+    @staticmethod
+    def language_code(language) -> str:
+        """Returns the alpha2 code of `language` (e.g. "en"), or its alpha3 code."""
+        try:
+            return language.alpha2
+        except babelfish.Error:
+            return language.alpha3
+
+    def detect(self, filename: str):
+        """
+        Detects the language suffix of a subtitle file name.
+
+        Args:
+            filename (str): The subtitle file name, e.g. "Show.S01E01.en.forced.srt".
+
+        Returns:
+            tuple: (stem, subpart, guess) where `stem` is the file stem without the
+                language and flag suffixes, `subpart` the suffix to keep (e.g.
+                ".en.forced") and `guess` a dict with "subtitle_language" and, if
+                present in the name, "season" and "episode".
+                Returns None if the name is ambiguous.
+        """
+        segments = Path(filename).stem.split(".")
+
+        flags = []
+        while len(segments) > 1 and segments[-1].lower() in self.FLAGS:
+            flags.insert(0, segments.pop().lower())
+        if flags[:1] == ["hi"] and segments[-1].lower() not in self.languages:
+            # Only hearing impaired after a language, e.g. `Movie.en.hi.srt`, and
+            # else the code of Hindi, e.g. `Movie.hi.srt`
+            segments.append(flags.pop(0))
+
+        guess = {}
+        token = segments[-1].lower()
+        if token in self.languages:
+            if token in self.common_words:
+                return None
+            guess["subtitle_language"] = self.languages[token]
+            segments.pop()
+        else:
+            parts = [x for x in self._SEGMENT_SPLIT_RE.split(token) if x]
+            if parts and parts[-1] in self.languages:
+                # A language embedded in the segment, e.g. "Show S01E01 [English]"
+                return None
+
+        if "subtitle_language" not in guess and not flags:
+            # Neither language nor flags: keep the file stem as is
+            segments = [Path(filename).stem]
+
+        stem = ".".join(segments)
+        for episode_re in self._EPISODE_RES:
+            match = episode_re.search(stem)
+            if match:
+                guess["season"] = int(match.group(1))
+                guess["episode"] = int(match.group(2))
+                break
+
+        subpart = "".join("." + flag for flag in flags)
+        if "subtitle_language" in guess:
+            language_code = self.language_code(guess["subtitle_language"])
+            subpart = "." + language_code + subpart
+        return stem, subpart, guess
@@ -28,7 +28,36 @@ import json
 import getopt
 from pathlib import Path
 import re
+import io
+import time
 import logging
+import pstats
+import asyncio
+import threading
+import tracemalloc
+import contextlib
+import pickle
+import random
+
+from similarity import SimilarityIndex
+from subtitles import SubtitleLanguageDetector
+from transfer import TransferEngine
+from scheduler import IOScheduler
+from plan import Move, MovePlan
+from journal import MoveJournal
+from placement import Placement
+from vfs import LatencyModel, SimulatedFS
+from timing import Timings, timed, timings
+from profiling import Profiler
+from metrics import MetricsFile
+from options import Options
+from deobfuscation import Deobfuscator
+from obfuscation import ObfuscationScorer
+from determine import Determine
+from knowledge import KnowledgeCache, KnownTitle, SortRecord
+from library import LibraryIndex
+from apply import Apply
+from nzbget_utils import loginf
 
 # Exit codes used by NZBGet
 POSTPROCESS_SUCCESS = 93
@@ -246,7 +275,8 @@ def execute_deobfuscation_sort(test_file):
         if ret == POSTPROCESS_SUCCESS:
             match = re.search(r"^\[NZB\] FINALDIR=(.+)", stdout, re.MULTILINE)
             if match:
-                final_dir = Path(match.group(1))
+                # FINALDIR lists the directories of all moved files, video first
+                final_dir = Path(match.group(1).split("|")[0])
                 logging.debug(f"NZB FINALDIR: {final_dir}")
                 dest_file = get_video_file_in_finaldir(final_dir)
 
@@ -316,6 +346,10 @@ def run_test(testobj):
 
         # Create input file
         create_test_file(input_file_path, input_file_size)
+
+        # Create satellite files next to (or below) the input file
+        for satellite_spec in testobj.get("SATELLITEFILES", {}):
+            create_test_file(input_file_path.parent / satellite_spec, FILESIZE_DEFAULT)
     else:
         # TODO: Handle this case
         logging.info(f"Test id {testobj['id']}: not implemented")
@@ -327,6 +361,14 @@ def run_test(testobj):
 
     success = dest == output_file_spec
 
+    # Check that the satellite files were moved to their expected destinations
+    for satellite_spec, satellite_output_spec in testobj.get(
+        "SATELLITEFILES", {}
+    ).items():
+        if not get_test_dir_path_file(satellite_output_spec).is_file():
+            logging.info(f"Satellite {satellite_spec} not at {satellite_output_spec}")
+            success = False
+
     if success:
         print(f"{testobj['id']}: SUCCESS")
     else:
@@ -334,20 +376,1264 @@ def run_test(testobj):
 
     if verbose:
         max_len = max(len(str(output_file_spec)), len(str(dest))) + len("destination: ")
-        logging.info(
-            f"""{max_len * (success and "-" or "#")}
+        logging.info(f"""{max_len * (success and "-" or "#")}
 id: {testobj["id"]}
 expected:    {output_file_spec}
 destination: {dest}
 {_difference_line(str(output_file_spec), str(dest), "destination: ")}{max_len * (success and "-" or "#")}
-"""
-        )
+""")
 
     if not success:
         sys.exit(1)
 
 
+def generate_pack(show, season, episodes, suffix):
+    """Generates the video names of a season pack and the names of its subtitles.
+
+    Returns:
+        tuple: (videos, subtitles) where `subtitles` maps every subtitle name to the
+            name of the video it belongs to.
+    """
+    videos = []
+    subtitles = {}
+    dotted_show = show.replace(" ", ".")
+    for episode in range(1, episodes + 1):
+        tag = f"S{season:02d}E{episode:02d}"
+        video = f"{dotted_show}.{tag}.{suffix}"
+        videos.append(video)
+        subtitles[f"{video}.en"] = video
+        subtitles[f"{show} {tag} eng"] = video
+        subtitles[f"{dotted_show.lower()}.{tag.lower()}.English.forced"] = video
+        subtitles[f"{tag}.sdh"] = video
+    return videos, subtitles
+
+
+def run_similarity_test(test_id, show, season, episodes, suffix):
+    """Checks that every subtitle of a generated pack is assigned to its video."""
+    videos, subtitles = generate_pack(show, season, episodes, suffix)
+    index = SimilarityIndex({video: video for video in videos})
+    assignment = index.assign({subtitle: subtitle for subtitle in subtitles})
+
+    failed = [
+        f"{subtitle} --> {assignment[subtitle]} (expected {video})"
+        for subtitle, video in subtitles.items()
+        if assignment[subtitle] != video
+    ]
+    # A name that is not related to any video must not be assigned
+    for unrelated in ("English", "7741f2ead476282176512b0abdeaf35f", show):
+        if index.best_match(unrelated)[0] is not None:
+            failed.append(f"{unrelated} --> {index.best_match(unrelated)[0]}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+similarity_tests = [
+    (
+        "similarity-pack-1",
+        "The Office UK",
+        1,
+        6,
+        "1080p.HMAX.WEB-DL.DD2.0.H.264-pawel2006",
+    ),
+    ("similarity-pack-2", "Castle", 2, 24, "720p.BluRay.x264-SiNNERS"),
+    ("similarity-pack-3", "Doctor Who 2005", 3, 50, "Episode.Title.1080p.WEB.h264-GRP"),
+]
+
+
+def run_subtitles_test(test_id):
+    """Checks the language suffixes of subtitle names, in particular "hi", which is
+    only the hearing impaired flag after a language and else Hindi."""
+    detector = SubtitleLanguageDetector()
+    failed = []
+    for name, subpart, language in (
+        ("Show.S01E01.en.srt", ".en", "en"),
+        ("Show.S01E01.eng.forced.srt", ".en.forced", "en"),
+        ("Show.S01E01.English.hi.srt", ".en.hi", "en"),
+        ("Show.S01E01.hi.srt", ".hi", "hi"),
+        ("Show.S01E01.hi.forced.srt", ".hi.forced", "hi"),
+        ("Show.S01E01.srt", "", None),
+    ):
+        detected = detector.detect(name)
+        if detected is None:
+            failed.append(f"{name} not detected")
+            continue
+        stem, detected_subpart, guess = detected
+        detected_language = guess.get("subtitle_language")
+        if detected_language is not None:
+            detected_language = SubtitleLanguageDetector.language_code(
+                detected_language
+            )
+        if (stem, detected_subpart, detected_language) != (
+            "Show.S01E01",
+            subpart,
+            language,
+        ):
+            failed.append(f"{name} --> {detected}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_transfer_test(test_id, methods, sync, size):
+    """Moves a file with the given copy methods and checks the copied content."""
+    transfer_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(transfer_dir, ignore_errors=True)
+    src_file = transfer_dir / "src" / "video.mkv"
+    dst_file = transfer_dir / "dst" / "Video (2020).mkv"
+    src_file.parent.mkdir(parents=True)
+    dst_file.parent.mkdir(parents=True)
+    content = os.urandom(size)
+    src_file.write_bytes(content)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        TransferEngine(sync=sync, methods=methods).move(src_file, dst_file)
+
+    failed = []
+    if src_file.exists():
+        failed.append(f'"{src_file}" still exists')
+    if not dst_file.is_file() or dst_file.read_bytes() != content:
+        failed.append(f'"{dst_file}" does not match the source')
+    if TransferEngine.temp_name(dst_file).exists():
+        failed.append(f'"{TransferEngine.temp_name(dst_file)}" was not removed')
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_transfer_fallback_test(test_id):
+    """Checks that a copy method which copies no data at the start of a file counts
+    as not supported, and that the next method copies the file."""
+    transfer_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(transfer_dir, ignore_errors=True)
+    src_file = transfer_dir / "src" / "video.mkv"
+    dst_file = transfer_dir / "dst" / "video.mkv"
+    src_file.parent.mkdir(parents=True)
+    dst_file.parent.mkdir(parents=True)
+    content = os.urandom(1 << 20)
+    src_file.write_bytes(content)
+
+    output = io.StringIO()
+    sendfile = os.sendfile
+    os.sendfile = lambda *args: 0
+    try:
+        with contextlib.redirect_stdout(output):
+            TransferEngine(methods=("sendfile", "readwrite")).copy(src_file, dst_file)
+    finally:
+        os.sendfile = sendfile
+
+    failed = []
+    if not dst_file.is_file() or dst_file.read_bytes() != content:
+        failed.append(f'"{dst_file}" does not match the source')
+    if "readwrite" not in output.getvalue():
+        failed.append("readwrite was not used")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+transfer_tests = [
+    ("transfer-1", ("copy_file_range",), "no", (3 << 20) + 17),
+    ("transfer-2", ("sendfile",), "data", (3 << 20) + 17),
+    ("transfer-3", ("readwrite",), "full", (3 << 20) + 17),
+    ("transfer-4", None, "no", 0),
+]
+
+
+def run_scheduler_test(test_id, workers, per_device, devices, mode="threads"):
+    """Runs jobs on `devices` and checks the concurrency limits and the results.
+    In asyncio mode, also checks that the log output is in the order of the jobs.
+    """
+    lock = threading.Lock()
+    running = {}
+    peaks = {}
+    order = []
+
+    def job(idx, device):
+        def function():
+            with lock:
+                running[device] = running.get(device, 0) + 1
+                peaks[device] = max(peaks.get(device, 0), running[device])
+            # Later jobs finish first
+            time.sleep(0.005 * (len(devices) - idx))
+            with lock:
+                running[device] -= 1
+                order.append(idx)
+            loginf(f"job {idx}")
+            if idx % 3 == 2:
+                raise OSError(f"job {idx} failed")
+
+        return device, function
+
+    jobs = [job(idx, device) for idx, device in enumerate(devices)]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if mode == "asyncio":
+            results = asyncio.run(IOScheduler(workers, per_device).run_async(jobs))
+        else:
+            results = IOScheduler(workers, per_device).run(jobs)
+
+    failed = []
+    for device, peak in peaks.items():
+        if device is not None and peak > per_device:
+            failed.append(f"{peak} concurrent jobs on device {device}")
+    inline = [idx for idx in order if devices[idx] is None]
+    if inline != sorted(inline):
+        failed.append(f"jobs without device ran out of order: {inline}")
+    expected = [idx % 3 == 2 for idx in range(len(devices))]
+    if [isinstance(result, OSError) for result in results] != expected:
+        failed.append(f"unexpected results: {results}")
+    logged = output.getvalue().splitlines()
+    in_order = [f"[INFO] job {idx}" for idx in range(len(devices))]
+    if mode == "asyncio" and logged != in_order:
+        failed.append(f"log output out of order: {logged}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_scheduler_blocking_test(test_id):
+    """Checks that jobs waiting for a busy device do not hold a worker of the pool,
+    so that a job for an idle device starts while the busy device is working."""
+    started = threading.Event()
+
+    def busy():
+        # Only finishes early if the job for the idle device could start
+        if not started.wait(2):
+            raise TimeoutError("job for the idle device did not start")
+
+    jobs = [(1, busy), (1, busy), (2, started.set)]
+    results = IOScheduler(2, 1).run(jobs)
+
+    if results != [None, None, None]:
+        print(f"{test_id}: FAILED")
+        logging.info(f"unexpected results: {results}")
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+scheduler_tests = [
+    ("scheduler-1", 4, 2, [1, 1, 1, 1, 2, 2, None, None, 1, 2, None]),
+    ("scheduler-2", 2, 1, [1, 2, 3, 1, 2, 3]),
+    ("scheduler-3", 4, 2, [1, 1, 1, 1, 2, 2, None, None, 1, 2, None], "asyncio"),
+]
+
+
+def run_plan_test(test_id):
+    """Checks that a move plan survives a JSON round trip and groups satellites."""
+    show = Path("/downloads/Show.S01")
+    series = Path("/series/Show/Season 1")
+    plan = MovePlan(
+        (
+            Move(show / "e01.mkv", series / "Show - S01E01.mkv", "episode"),
+            Move(
+                show / "e01.en.srt",
+                series / "Show - S01E01.en.srt",
+                "same name",
+                video=show / "e01.mkv",
+            ),
+            Move(show / "e02.mkv", series / "Show - S01E02.mkv", "episode", True),
+            Move(
+                show / "Subs" / "S01E02.English.srt",
+                series / "Show - S01E02.en (2).srt",
+                "episode",
+                unique=True,
+                video=show / "e02.mkv",
+            ),
+            Move(Path("/downloads/Sample.mkv"), Path("/movies/Sample.mkv"), "movie"),
+        )
+    )
+
+    failed = []
+    replayed = MovePlan.from_json(plan.to_json())
+    if replayed != plan:
+        failed.append(f"round trip changed the plan:\n{replayed.to_json()}")
+    if [len(group) for group in plan.groups()] != [2, 2, 1]:
+        failed.append(f"unexpected groups: {plan.groups()}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_finaldir_test(test_id):
+    """Sorts an episode whose destination already exists next to another episode and
+    checks FINALDIR: the directory of the renamed duplicate is listed twice. Also
+    checks that a name missing from the listing of its directory is not free if it
+    exists."""
+    test_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(test_dir, ignore_errors=True)
+    download_dir = test_dir / "Show.S01.1080p.WEB-DL-GRP"
+    series_dir = test_dir / "series"
+    download_dir.mkdir(parents=True)
+    for episode in (1, 2):
+        name = f"Show.S01E{episode:02d}.1080p.WEB-DL-GRP.mkv"
+        (download_dir / name).write_bytes(b"x" * 100)
+    (series_dir / "Show").mkdir(parents=True)
+    (series_dir / "Show" / "Show - S01E01.mkv").write_bytes(b"y" * 100)
+    set_defaults()
+    os.environ["NZBPP_DIRECTORY"] = str(download_dir)
+    os.environ["NZBPO_SERIESDIR"] = str(series_dir)
+    os.environ["NZBPO_SERIESFORMAT"] = "%sn/%sn - S%0sE%0e.%ext"
+
+    failed = []
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            apply = Apply()
+            apply.run()
+    finally:
+        set_defaults()
+    match = re.search(r"^\[NZB\] FINALDIR=(.+)", output.getvalue(), re.MULTILINE)
+    expected = "|".join([str(series_dir / "Show")] * 3)
+    if apply.errors or match is None or match.group(1) != expected:
+        failed.append(f"unexpected FINALDIR: {match and match.group(1)}")
+    if not (series_dir / "Show" / "Show - S01E01 (2).mkv").is_file():
+        failed.append("duplicate not renamed")
+
+    # A forgotten move is no longer reported, and its destination is free again
+    forgotten = Move(download_dir / "e03.mkv", series_dir / "Show" / "e03.mkv", "")
+    apply._record_move(forgotten)
+    apply._forget_move(forgotten.src)
+    if forgotten.dst in apply._moved_dst_files() or apply._is_taken(forgotten.dst):
+        failed.append("forgotten move still reported")
+
+    # A file missing from the cached listing, e.g. one whose name only differs in
+    # case on a case-insensitive file system, is taken all the same
+    apply = Apply()
+    apply._directory_names(series_dir / "Show")
+    late_file = series_dir / "Show" / "Show - S01E03.mkv"
+    late_file.write_bytes(b"z")
+    if not apply._is_taken(late_file):
+        failed.append("file missing from the listing not taken")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_journal_test(test_id):
+    """Checks that a journal interrupted in the middle of a write can be resumed."""
+    download_dir = Path(TEST_DIR) / test_id / "Show.S01"
+    shutil.rmtree(download_dir.parent, ignore_errors=True)
+    download_dir.mkdir(parents=True)
+    moves = tuple(
+        Move(download_dir / f"e0{idx}.mkv", Path(f"/series/S01E0{idx}.mkv"), "episode")
+        for idx in range(1, 4)
+    )
+    plan = MovePlan(moves)
+
+    journal = MoveJournal.for_download_dir(download_dir)
+    journal.begin(plan)
+    journal.record(moves[0])
+    journal.close()
+    # Simulate a crash while the second move was being recorded
+    with open(journal.path, "a", encoding="utf-8") as partial:
+        partial.write('{"done": "' + str(moves[1].src)[:10])
+
+    failed = []
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        loaded, completed = MoveJournal.for_download_dir(download_dir).load()
+    if loaded != plan or completed != {moves[0].src}:
+        failed.append(f"unexpected journal contents: {loaded} {completed}")
+
+    journal.resume()
+    journal.record(moves[2])
+    journal.close()
+    with contextlib.redirect_stdout(output):
+        _, completed = journal.load()
+    if completed != {moves[0].src, moves[2].src}:
+        failed.append(f"entry after the damaged one was lost: {completed}")
+
+    # In streaming mode, the plan of every release is added to the journal
+    journal.resume()
+    extra = Move(download_dir / "e04.mkv", Path("/series/S01E04.mkv"), "episode")
+    journal.extend(MovePlan((extra,)))
+    journal.close()
+    with contextlib.redirect_stdout(output):
+        loaded, _ = journal.load()
+    if loaded.moves != moves + (extra,):
+        failed.append(f"plans of the releases were not merged: {loaded}")
+
+    journal.remove()
+    if journal.path.exists() or journal.load()[0] is not None:
+        failed.append(f'"{journal.path}" was not removed')
+
+    # Moves which are not recorded only count as executed with the same contents
+    set_defaults()
+    with contextlib.redirect_stdout(output):
+        apply = Apply()
+    library_dir = download_dir.parent / "library"
+    library_dir.mkdir()
+    for name, data, dst_data in (("same", b"abc", b"abc"), ("other", b"abc", b"xyz")):
+        move = Move(download_dir / f"{name}.mkv", library_dir / f"{name}.mkv", "")
+        move.src.write_bytes(data)
+        move.dst.write_bytes(dst_data)
+        try:
+            executed = apply._is_completed(move, set())
+        except FileExistsError:
+            executed = None
+        if name == "same" and (not executed or move.src.exists()):
+            failed.append("identical placed file was not taken as executed")
+        if name == "other" and (executed is not None or not move.src.exists()):
+            failed.append("unrelated file of the same size was taken as executed")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_vfs_test(test_id):
+    """Checks that the simulated file system counts and delays calls below its root."""
+    nas_dir = Path(TEST_DIR) / test_id / "nas"
+    local_dir = Path(TEST_DIR) / test_id / "local"
+    shutil.rmtree(nas_dir.parent, ignore_errors=True)
+    nas_dir.mkdir(parents=True)
+    local_dir.mkdir()
+    (local_dir / "video.mkv").write_bytes(b"0" * 4096)
+
+    model = LatencyModel(0.01, bandwidth=1 << 20, per_operation={"stat": 0.0})
+    stat = os.stat
+    start = time.perf_counter()
+    with SimulatedFS(nas_dir, model) as fs:
+        (nas_dir / "Season 1").mkdir()
+        engine = TransferEngine(methods=("readwrite",))
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine.copy(local_dir / "video.mkv", nas_dir / "Season 1" / "video.mkv")
+        files = [path.name for path in nas_dir.rglob("*")]
+        (local_dir / "video.mkv").stat()
+    elapsed = time.perf_counter() - start
+
+    failed = []
+    if files != ["Season 1", "video.mkv"]:
+        failed.append(f"unexpected files: {files}")
+    if os.stat is not stat:
+        failed.append("os.stat was not restored")
+    for operation in ("mkdir", "open", "write", "replace", "scandir"):
+        if not fs.calls[operation]:
+            failed.append(f"{operation} was not counted: {fs.calls}")
+    if fs.bytes["write"] != 4096 or fs.bytes["read"] != 0:
+        failed.append(f"unexpected data: {fs.bytes}")
+    if elapsed < fs.delayed or fs.delayed < 0.01 * (fs.syscalls() - fs.calls["stat"]):
+        failed.append(f"calls were not delayed: {elapsed:.3f}s, {fs.delayed:.3f}s")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_timings_test(test_id):
+    """Checks the stage statistics and that disabled timings record nothing."""
+    recorder = Timings()
+    recorder.enable()
+    for seconds in (0.01, 0.03, 0.02):
+        recorder.record("guess_info", seconds)
+    with recorder.span("cleanup_download_dir"):
+        Path(TEST_DIR).exists()
+    recorder.add("bytes_copied", 4096)
+
+    @timed("disabled")
+    def disabled():
+        return 42
+
+    failed = []
+    stats = recorder.to_dict()["stages"]["guess_info"]
+    if (stats["count"], round(stats["total"], 6), stats["max"]) != (3, 0.06, 0.03):
+        failed.append(f"unexpected stage statistics: {stats}")
+    summary = recorder.summary().splitlines()
+    if summary[0] != "timings: stage=guess_info count=3 total=0.060s max=0.030s":
+        failed.append(f"unexpected summary: {summary}")
+    if not summary[-1].startswith("timings: bytes_copied=4096 syscalls="):
+        failed.append(f"unexpected counters: {summary}")
+    if "cleanup_download_dir" not in recorder.stages:
+        failed.append("span was not recorded")
+    if timings.enabled or disabled() != 42 or timings.stages:
+        failed.append("disabled timings recorded a stage")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_profile_test(test_id):
+    """Profiles a few jobs and checks the profiles, their names and the rotation."""
+    profile_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    # Files of the user in the directory, which are older than any profile
+    foreign_files = {"analysis.prof", "My.Show.S01.snapshot"}
+    profile_dir.mkdir(parents=True)
+    for name in foreign_files:
+        (profile_dir / name).touch()
+
+    failed = []
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for mode in ("cpu", "memory", "cpu", "off"):
+            profiler = Profiler(mode, profile_dir, "My.Show.S01/1080p?", keep=2)
+            if profiler.run(lambda: sorted(range(1000), key=str)[0]) != 0:
+                failed.append(f"{mode}: unexpected result")
+            time.sleep(0.01)
+
+    if not all((profile_dir / name).is_file() for name in foreign_files):
+        failed.append("files of the user were rotated")
+    profiles = [
+        path for path in profile_dir.iterdir() if path.name not in foreign_files
+    ]
+    # The names start with the second of the job, so they sort in any order
+    if sorted(profile.suffix for profile in profiles) != [".prof", ".snapshot"]:
+        failed.append(f"unexpected profiles: {profiles}")
+    for profile in profiles:
+        if not profile.name.startswith("My.Show.S01_1080p."):
+            failed.append(f"untagged profile: {profile.name}")
+        elif profile.suffix == ".prof":
+            pstats.Stats(str(profile))
+        else:
+            tracemalloc.Snapshot.load(str(profile))
+    if "profile: top 20 functions by cumulative time:" not in output.getvalue():
+        failed.append("hotspots were not logged")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_metrics_test(test_id):
+    """Adds jobs to a metrics file from concurrent threads and checks the totals."""
+    metrics_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics = MetricsFile(metrics_dir / "deobfuscationsort.prom")
+    job_timings = {
+        "stages": {"cleanup_download_dir": {"count": 1, "total": 0.2, "max": 0.2}},
+        "counters": {
+            "placed_files.rename": 2,
+            "placed_bytes.rename": 3000,
+            "placed_bytes.copy": 1000,
+            "errors.PermissionError": 1,
+            "bytes_copied": 1000,
+        },
+    }
+
+    def add_jobs():
+        for elapsed in (0.5, 7):
+            metrics.add_job("success", elapsed, job_timings)
+
+    threads = [threading.Thread(target=add_jobs) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = []
+    samples = metrics.load()
+    expected = {
+        'jobs_total{status="success"}': 16,
+        'files_total{method="rename"}': 32,
+        'bytes_total{method="rename"}': 48000,
+        'bytes_total{method="copy"}': 16000,
+        'errors_total{type="PermissionError"}': 16,
+        'job_duration_seconds_bucket{le="5"}': 8,
+        'job_duration_seconds_bucket{le="+Inf"}': 16,
+        "job_duration_seconds_sum": 60,
+        'cleanup_duration_seconds_bucket{le="0.1"}': 0,
+        "cleanup_duration_seconds_count": 16,
+    }
+    for series, value in expected.items():
+        if samples.get(series) != value:
+            failed.append(f"{series}: expected {value}, got {samples.get(series)}")
+    text = metrics.path.read_text()
+    if "# TYPE deobfuscationsort_job_duration_seconds histogram" not in text:
+        failed.append("missing metadata of the histogram")
+    if sorted(path.name for path in metrics_dir.iterdir()) != [
+        "deobfuscationsort.prom",
+        "deobfuscationsort.prom.lock",
+    ]:
+        failed.append(f"unexpected files: {list(metrics_dir.iterdir())}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(text)
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_rules_profile_test(test_id):
+    """Checks that the rebulk profiler counts the patterns and rules of a guess."""
+    import guessit
+    from rebulk import profiling
+
+    options = {"allowed_languages": [], "allowed_countries": []}
+    name = "Show.Name.S01E02.1080p.WEB-DL.DD5.1.H.264-GRP.mkv"
+    guessit.guessit(name, options)
+    profiler = profiling.RebulkProfiler()
+    previous = profiling.set_profiler(profiler)
+    guessit.guessit(name, options)
+    profiling.set_profiler(previous)
+    calls = sum(calls for calls, _, _ in profiler.patterns.values())
+    guessit.guessit(name, options)
+
+    failed = []
+    title = profiler.rules.get("TitleFromPosition (guessit.rules.properties.title)")
+    if title is None or title[:2] != [1, 1]:
+        failed.append(f"unexpected TitleFromPosition entry: {title}")
+    if calls != sum(calls for calls, _, _ in profiler.patterns.values()):
+        failed.append("patterns were counted after the profiler was removed")
+    if not any(matches for _, matches, _ in profiler.patterns.values()):
+        failed.append("no pattern matches were counted")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_placement_test(test_id, mode, methods):
+    """Places a file with `mode` and checks the destination and the source."""
+    placement_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(placement_dir, ignore_errors=True)
+    src_file = placement_dir / "src" / "video.mkv"
+    dst_file = placement_dir / "dst" / "Video (2020).mkv"
+    src_file.parent.mkdir(parents=True)
+    dst_file.parent.mkdir(parents=True)
+    content = os.urandom(1 << 16)
+    src_file.write_bytes(content)
+
+    placement = Placement(mode)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        method = placement.place(src_file, dst_file)
+        # A second file uses the cached probe result
+        second = placement.place(src_file, dst_file.with_name("Video (2021).mkv"))
+
+    failed = []
+    if method not in methods or second != method:
+        failed.append(f"placed with {method} and {second}, expected one of {methods}")
+    if not dst_file.is_file() or dst_file.read_bytes() != content:
+        failed.append(f'"{dst_file}" does not match the source')
+    if src_file.exists() != placement.keeps_source:
+        failed.append(f'"{src_file}" exists={src_file.exists()}')
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_cleanup_test(test_id):
+    """Checks that the cleanup keeps moved files and stops at large files."""
+    download_dir = Path(TEST_DIR) / test_id / "Show.S01"
+    set_defaults()
+    os.environ["NZBPP_DIRECTORY"] = str(download_dir)
+    os.environ["NZBPO_MINSIZE"] = "1"
+    os.environ["NZBPO_CLEANUP"] = "yes"
+    os.environ["NZBPO_PREVIEW"] = "no"
+
+    def create(files):
+        shutil.rmtree(download_dir.parent, ignore_errors=True)
+        for name, size in files.items():
+            (download_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (download_dir / name).write_bytes(b"x" * size)
+
+    def remaining():
+        return sorted(
+            str(path.relative_to(download_dir.parent))
+            for path in download_dir.parent.rglob("*")
+        )
+
+    failed = []
+    output = io.StringIO()
+    small = {"show.nfo": 100, "Sample/sample.txt": 10, "Subs/a/b/empty.txt": 0}
+
+    # A large file remains: nothing is removed
+    create({**small, "Sample/sample.mkv": 2 << 20})
+    before = remaining()
+    with contextlib.redirect_stdout(output):
+        Apply().cleanup_download_dir()
+    if remaining() != before:
+        failed.append(f"files removed despite a large file: {remaining()}")
+
+    # A moved file in the download directory keeps it and its directory
+    create({**small, "Show/Show - S01E01.mkv": 2 << 20})
+    apply = Apply()
+    apply.moved_destinations = {download_dir / "Show" / "Show - S01E01.mkv"}
+    with contextlib.redirect_stdout(output):
+        apply.cleanup_download_dir()
+    expected = ["Show.S01", "Show.S01/Show", "Show.S01/Show/Show - S01E01.mkv"]
+    if remaining() != expected:
+        failed.append(f"unexpected files after cleanup: {remaining()}")
+
+    # Only small files remain: the download directory is removed
+    create(small)
+    with contextlib.redirect_stdout(output):
+        Apply().cleanup_download_dir()
+    if remaining() != []:
+        failed.append(f"download directory was not removed: {remaining()}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_streaming_test(test_id):
+    """Streams a download directory with several releases, first with a memory limit
+    which stops the job after the first release, then without a limit."""
+    test_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(test_dir, ignore_errors=True)
+    download_dir = test_dir / "Batch"
+    series_dir = test_dir / "series"
+    expected = []
+    for show in ("Alpha", "Bravo", "Charlie"):
+        release = download_dir / f"{show}.S01.1080p.WEB-DL-GRP"
+        (release / "Subs").mkdir(parents=True)
+        for episode in (1, 2):
+            name = f"{show}.S01E{episode:02d}.1080p.WEB-DL-GRP"
+            (release / f"{name}.mkv").write_bytes(b"x" * 100)
+            (release / "Subs" / f"{name}.en.srt").write_text("x")
+            expected += [
+                f"{show}/{show} - S01E{episode:02d}{ext}" for ext in (".mkv", ".en.srt")
+            ]
+    set_defaults()
+    os.environ["NZBPP_DIRECTORY"] = str(download_dir)
+    os.environ["NZBPO_SERIESDIR"] = str(series_dir)
+    os.environ["NZBPO_SERIESFORMAT"] = "%sn/%sn - S%0sE%0e.%ext"
+    os.environ["NZBPO_EXECUTION"] = "streaming"
+
+    def moved():
+        return sorted(
+            path.relative_to(series_dir).as_posix()
+            for path in series_dir.rglob("*")
+            if path.is_file()
+        )
+
+    failed = []
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            apply = Apply()
+            apply.memory.limit = 1
+            apply.run()
+        if not apply.errors or len(moved()) != 4:
+            failed.append(f"memory limit did not stop after one release: {moved()}")
+
+        with contextlib.redirect_stdout(output):
+            apply = Apply()
+            apply.run()
+        if apply.errors or moved() != sorted(expected):
+            failed.append(f"unexpected files after resuming: {moved()}")
+        if apply.journal.path.exists():
+            failed.append("journal was not removed")
+    finally:
+        del os.environ["NZBPO_EXECUTION"]
+        set_defaults()
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_options_test(test_id):
+    """Checks that the compiled options are shared per set of NZBPO variables,
+    survive pickling and case names as the option lists do, that GuessIt results are
+    cached and that invalid script options fail the job."""
+    failed = []
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            set_defaults()
+            options = Options()
+            if Options().compiled is not options.compiled:
+                failed.append("compiled options were not reused")
+
+            compiled = pickle.loads(pickle.dumps(options.compiled))
+            if compiled != options.compiled:
+                failed.append("compiled options changed when pickled")
+            if "mkv" not in compiled.video_extensions:
+                failed.append(
+                    f"unexpected video extensions: {compiled.video_extensions}"
+                )
+
+            determine = Determine([], options)
+            # GuessIt results are shared by the jobs of the process, up to a bound
+            name = "Show.S01E01.1080p.WEB-DL-GRP.mkv"
+            guess = Determine._cached_guessit(name)
+            if Determine._cached_guessit(name) is not guess:
+                failed.append("GuessIt result was not cached")
+            size = Determine.GUESSIT_CACHE_SIZE
+            Determine.GUESSIT_CACHE_SIZE = 2
+            for episode in (2, 3):
+                Determine._cached_guessit(name.replace("E01", f"E0{episode}"))
+            Determine.GUESSIT_CACHE_SIZE = size
+            if len(Determine._GUESSIT_CACHE) != 2 or name in Determine._GUESSIT_CACHE:
+                failed.append(f"unexpected GuessIt cache: {Determine._GUESSIT_CACHE}")
+
+            for text, expected in (
+                ("the lord of the rings iii", "The Lord of the Rings III"),
+                ("rocky iv and the ivory tower", "Rocky IV and the Ivory Tower"),
+            ):
+                if determine.to_title_case(text) != expected:
+                    failed.append(f"{text} --> {determine.to_title_case(text)}")
+            dirname = determine.get_deobfuscated_dirname(
+                "movie.2024.1080p.bluray.x264-framestor", "Movie"
+            )
+            if dirname != "Movie.2024.1080p.BluRay.x264-FraMeSToR":
+                failed.append(f"unexpected case-fixed dirname: {dirname}")
+
+            os.environ["NZBPO_UPPERWORDS"] = "III,II,IV,XI"
+            changed = Options().compiled
+            if (
+                changed is options.compiled
+                or changed.fingerprint == compiled.fingerprint
+            ):
+                failed.append("compiled options were not recompiled")
+            if changed.title_words[-1][0] != "XI":
+                failed.append(f"unexpected title words: {changed.title_words}")
+
+            # Invalid values of the script options fail the job
+            for optname, value in (
+                ("NZBPO_PLACEMENT", "copy"),
+                ("NZBPO_TRANSFERSYNC", "yes"),
+                ("NZBPO_TRANSFERWORKERS", "four"),
+                ("NZBPO_TRANSFERWORKERS", "0"),
+                ("NZBPO_TRANSFERDEVICEWORKERS", "-1"),
+                ("NZBPO_EXECUTION", "processes"),
+                ("NZBPO_MEMORYLIMIT", "1.5"),
+                ("NZBPO_MEMORYLIMIT", "-1"),
+                ("NZBPO_TIMINGS", "yes"),
+                ("NZBPO_PROFILE", "on"),
+                ("NZBPO_PROFILEKEEP", "0"),
+            ):
+                os.environ[optname] = value
+                try:
+                    Options()
+                    failed.append(f"{optname}={value} accepted")
+                except SystemExit as e:
+                    if e.code != POSTPROCESS_ERROR:
+                        failed.append(f"{optname}={value} exited with {e.code}")
+                del os.environ[optname]
+    finally:
+        set_defaults()
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_knowledge_test(test_id):
+    """Sorts episodes of a show in separate jobs with a knowledge file: the later
+    episodes land in the folder of the first one despite their casing, a missing
+    year or a typo. Also checks the year matching and the eviction of the cache."""
+    test_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(test_dir, ignore_errors=True)
+    series_dir = test_dir / "series"
+    knowledge_file = test_dir / "knowledge.db"
+    set_defaults()
+    os.environ["NZBPO_SERIESDIR"] = str(series_dir)
+    os.environ["NZBPO_SERIESFORMAT"] = "%sn/Season %s/%sn - S%0sE%0e.%ext"
+    os.environ["NZBPO_KNOWLEDGEFILE"] = str(knowledge_file)
+
+    def moved():
+        return sorted(
+            path.relative_to(series_dir).as_posix()
+            for path in series_dir.rglob("*")
+            if path.is_file()
+        )
+
+    failed = []
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            for name in (
+                "Show.Name.2019.S01E01.1080p.WEB-DL-GRP",
+                "show.name.S01E07.1080p.WEB-DL-GRP",
+                "SHOW.NAME.2019.S01E08.1080p.WEB-DL-GRP",
+                "Show.Nme.S01E09.1080p.WEB-DL-GRP",
+            ):
+                download_dir = test_dir / "downloads" / name
+                download_dir.mkdir(parents=True)
+                (download_dir / f"{name}.mkv").write_bytes(b"x" * 100)
+                os.environ["NZBPP_DIRECTORY"] = str(download_dir)
+                os.environ["NZBPP_NZBNAME"] = name
+                apply = Apply()
+                apply.run()
+                if apply.errors:
+                    failed.append(f"{name}: job failed")
+        expected = [
+            f"Show Name 2019/Season 1/Show Name 2019 - S01E{episode:02d}.mkv"
+            for episode in (1, 7, 8, 9)
+        ]
+        if moved() != expected:
+            failed.append(f"unexpected files: {moved()}")
+
+        with contextlib.redirect_stdout(output):
+            # Preview mode neither creates nor changes the file
+            missing_file = test_dir / "missing" / "knowledge.db"
+            knowledge = KnowledgeCache(missing_file, read_only=True)
+            if knowledge.lookup_title("series", "Show Name", 2019) is not None:
+                failed.append("title found in a missing file")
+            if missing_file.parent.exists():
+                failed.append("missing file created in preview mode")
+            content = knowledge_file.read_bytes()
+            knowledge = KnowledgeCache(knowledge_file, read_only=True)
+            if knowledge.lookup_title("series", "show name", 2019) is None:
+                failed.append("title not found in preview mode")
+            if knowledge_file.read_bytes() != content or knowledge.disabled:
+                failed.append("knowledge file changed in preview mode")
+
+            knowledge = KnowledgeCache(knowledge_file, max_entries=2)
+            known = knowledge.lookup_title("series", "Show Name", 2019)
+            if known is None or known.folder != "Show Name 2019":
+                failed.append(f"unexpected known title: {known}")
+            release = "show.name.S01E07.1080p.WEB-DL-GRP"
+            if knowledge.lookup_release(release, "") is not None:
+                failed.append("release found with other options")
+            fingerprint = Options().compiled.fingerprint
+            if knowledge.lookup_release(release, fingerprint) is None:
+                failed.append("release not found")
+
+            def record(title, year):
+                known = KnownTitle("movie", title, year, str(test_dir), title)
+                knowledge.record(
+                    [SortRecord(title, {}, {}, "", {"title": title}, title, known)]
+                )
+
+            record("Dune", 1984)
+            if knowledge.lookup_title("movie", "Dune", 2021) is not None:
+                failed.append("remake matched the original movie")
+            if knowledge.lookup_title("movie", "dune", None) is None:
+                failed.append("movie without a year not matched")
+            for title in ("Alpha", "Bravo"):
+                record(title, 2000)
+            if knowledge.lookup_title("movie", "Dune", 1984) is not None:
+                failed.append("least recently used title not evicted")
+            if knowledge.lookup_title("movie", "Alpha", 2000) is None:
+                failed.append("recently used title evicted")
+            if knowledge.disabled:
+                failed.append("knowledge cache disabled")
+
+            # Different titles are not merged, even without a year
+            knowledge = KnowledgeCache(test_dir / "titles.db")
+            for known, title in (
+                ("The Witcher", "The Watcher"),
+                ("Toy Story 3", "Toy Story 4"),
+                ("Mission Impossible 7", "Mission Impossible 8"),
+                ("Alien", "Aliens"),
+            ):
+                record(known, 0)
+                if knowledge.lookup_title("movie", title, None) is not None:
+                    failed.append(f"{title} matched {known}")
+            if knowledge.lookup_title("movie", "The Wticher", None) is None:
+                failed.append("title with swapped letters not matched")
+    finally:
+        del os.environ["NZBPO_KNOWLEDGEFILE"]
+        set_defaults()
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_library_test(test_id):
+    """Sorts an episode into a library which already has a folder for its show and
+    season with another casing, year and number format, then checks the matching of
+    years and that the listings are only taken again once a directory changes."""
+    test_dir = Path(TEST_DIR) / test_id
+    shutil.rmtree(test_dir, ignore_errors=True)
+    series_dir = test_dir / "series"
+    movies_dir = test_dir / "movies"
+    index_file = test_dir / "library.json"
+    (series_dir / "Show Name (2019)" / "Season 01").mkdir(parents=True)
+    for movie in ("Dune (1984)", "Dune (2021)", "Heat (1995)"):
+        (movies_dir / movie).mkdir(parents=True)
+    name = "show.name.S01E03.1080p.WEB-DL-GRP"
+    download_dir = test_dir / "downloads" / name
+    download_dir.mkdir(parents=True)
+    (download_dir / f"{name}.mkv").write_bytes(b"x" * 100)
+    set_defaults()
+    os.environ["NZBPP_DIRECTORY"] = str(download_dir)
+    os.environ["NZBPO_SERIESDIR"] = str(series_dir)
+    os.environ["NZBPO_MOVIESDIR"] = str(movies_dir)
+    os.environ["NZBPO_SERIESFORMAT"] = "%sn/Season %s/%sn - S%0sE%0e.%ext"
+    os.environ["NZBPO_SERIESYEAR"] = "no"
+    os.environ["NZBPO_LIBRARYINDEXFILE"] = str(index_file)
+
+    failed = []
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            apply = Apply()
+            apply.run()
+            moved = sorted(
+                path.relative_to(series_dir).as_posix()
+                for path in series_dir.rglob("*.mkv")
+            )
+            expected = ["Show Name (2019)/Season 01/Show Name - S01E03.mkv"]
+            if apply.errors or moved != expected:
+                failed.append(f"unexpected files: {moved}")
+
+            library = LibraryIndex([movies_dir])
+            for title, existing in (
+                ("Dune (2021)", "Dune (2021)"),
+                ("dune (2020)", "Dune (2021)"),
+                ("Dune", None),
+                ("Dune (2010)", None),
+                ("HEAT", "Heat (1995)"),
+                ("Heat (1996)", "Heat (1995)"),
+                ("Heat (1997)", None),
+            ):
+                if library.lookup(movies_dir, title) != existing:
+                    failed.append(f"{title} --> {library.lookup(movies_dir, title)}")
+            library.canonical(movies_dir, Path("Ronin (1998)/Ronin.mkv"))
+            if library.canonical(movies_dir, Path("RONIN/RONIN.mkv")) != Path(
+                "Ronin (1998)/RONIN.mkv"
+            ):
+                failed.append("planned folder not matched")
+
+            # Listings are trusted once they are older than their directory
+            past = time.time() - 3600
+            os.utime(movies_dir, (past, past))
+            library = LibraryIndex([movies_dir], index_file)
+            library.lookup(movies_dir, "Heat")
+            library.save()
+            data = json.loads(index_file.read_text(encoding="utf-8"))
+            folder = "Ronin (1998)"
+            data["listings"][str(movies_dir)][2].append(
+                [folder, *LibraryIndex.key(folder)]
+            )
+            index_file.write_text(json.dumps(data), encoding="utf-8")
+            library = LibraryIndex([movies_dir], index_file)
+            if library.lookup(movies_dir, "Ronin") != "Ronin (1998)":
+                failed.append("cached listing not used")
+            os.utime(movies_dir)
+            library = LibraryIndex([movies_dir], index_file)
+            if library.lookup(movies_dir, "Ronin") is not None:
+                failed.append("changed directory not listed again")
+    finally:
+        del os.environ["NZBPO_LIBRARYINDEXFILE"]
+        set_defaults()
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info(output.getvalue())
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_deobfuscation_test(test_id):
+    """Fuzzes the Deobfuscator against the regular expressions it replaces, on the
+    names of the test corpus and on random names, and checks that it stays fast on
+    names which make the regular expressions backtrack."""
+    set_defaults()
+    words = os.environ["NZBPO_DEOBFUSCATEWORDS"].split(",")
+    extensions = _VIDEO_EXTENSIONS
+    deobfuscator = Deobfuscator(words, extensions)
+    words_re, suffix_re = Deobfuscator.reference_patterns(words, extensions)
+
+    names = set()
+    for testobj in json.load(open(ROOT_DIR + "/testdata.json", encoding="UTF-8")):
+        for key in ("INPUTFILE", "OUTPUTFILE", "NZBP_ORIGINAL_DIRNAME"):
+            if key in testobj:
+                names.update(Path(testobj[key]).parts)
+    rng = random.Random(0)
+    tokens = words + extensions + ["-GRP", ".#12", "1080p", "x264", "-", ".", " "]
+    alphabet = "aBkIsp0159-._ #()[]" + "İıſKéβ"
+    for _ in range(5000):
+        parts = []
+        for _ in range(rng.randint(1, 10)):
+            if rng.random() < 0.5:
+                part = rng.choice(tokens)
+                parts.append(part.swapcase() if rng.random() < 0.3 else part)
+            else:
+                parts.append("".join(rng.choices(alphabet, k=rng.randint(1, 4))))
+        names.add("".join(parts))
+
+    failed = []
+    for name in sorted(names):
+        stripped = deobfuscator.strip_words(name)
+        if stripped != words_re.sub(r"\1", name):
+            failed.append(f"strip_words({name!r}): {stripped!r}")
+        stripped = deobfuscator.strip_suffix(name)
+        if stripped != suffix_re.sub(r"\1", name):
+            failed.append(f"strip_suffix({name!r}): {stripped!r}")
+
+    # Both regular expressions take minutes on these names
+    start = time.perf_counter()
+    for name in ("a" + "-a" * 50000 + "!", "a" + ".mkvx" * 25000):
+        deobfuscator.strip_words(name)
+        deobfuscator.strip_suffix(name)
+    elapsed = time.perf_counter() - start
+    if elapsed > 5.0:
+        failed.append(f"took {elapsed:.1f}s on names which backtrack")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed[:20]))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+def run_obfuscation_test(test_id):
+    """Checks the ObfuscationScorer: the path parts of the test corpus are decided as
+    before, and hashes and random tokens with separators are obfuscated."""
+    relevant_re = re.compile(
+        r"[-a-z0-9]*[ ._]+([-a-z0-9]*[ ._][-a-z0-9]*)*", re.IGNORECASE
+    )
+    scorer = ObfuscationScorer()
+    failed = []
+    for testobj in json.load(open(ROOT_DIR + "/testdata.json", encoding="UTF-8")):
+        paths = [Path(file["name"]) for file in testobj.get("download_unpacked", [])]
+        if "INPUTFILE" in testobj:
+            paths.append(Path(testobj["INPUTFILE"]))
+        for path in paths:
+            for part in path.parts[:-1] + (path.stem,):
+                if scorer.is_obfuscated(part) != (not relevant_re.search(part)):
+                    failed.append(f"{part}: obfuscated={scorer.is_obfuscated(part)}")
+
+    for part, obfuscated in (
+        ("f4d7841f.part01", True),
+        ("aa7874885c20f9ee2513edc0647e152d.1", True),
+        ("xpost_xzHdwosQyaDLuU", True),
+        ("J8sK2mQ9xL4pR7vT.nanQRU85hV", True),
+        ("QlDuQ4Co8POUrRT.gwFrwILsnsJ", True),
+        ("Kramer.vs.Kramer.1979.UHD.BluRay.2160p.TrueHD-FraMeSToR", False),
+        ("Castle.S01E02E03E04.720p.WEBRip1080p.x264-KRaLiMaRKo", False),
+        ("the.daily.show.2013.6.2.hdtv.x264-fqm", False),
+    ):
+        if scorer.is_obfuscated(part) != obfuscated:
+            failed.append(f"{part}: score={ObfuscationScorer.score(part):.2f}")
+
+    if failed:
+        print(f"{test_id}: FAILED")
+        logging.info("\n".join(failed))
+        sys.exit(1)
+    print(f"{test_id}: SUCCESS")
+
+
+placement_tests = [
+    ("placement-1", "hardlink", ("hardlink",)),
+    ("placement-2", "reflink", ("reflink", "copy")),
+    ("placement-3", "symlink", ("symlink",)),
+]
+
 testdata = json.load(open(ROOT_DIR + "/testdata.json", encoding="UTF-8"))
 for testobj in testdata:
     if test_ids == [] or testobj["id"] in test_ids:
         run_test(testobj)
+
+for similarity_test in similarity_tests:
+    if test_ids == [] or similarity_test[0] in test_ids:
+        run_similarity_test(*similarity_test)
+
+for transfer_test in transfer_tests:
+    if test_ids == [] or transfer_test[0] in test_ids:
+        run_transfer_test(*transfer_test)
+
+if test_ids == [] or "transfer-fallback-1" in test_ids:
+    run_transfer_fallback_test("transfer-fallback-1")
+
+for scheduler_test in scheduler_tests:
+    if test_ids == [] or scheduler_test[0] in test_ids:
+        run_scheduler_test(*scheduler_test)
+
+if test_ids == [] or "scheduler-blocking-1" in test_ids:
+    run_scheduler_blocking_test("scheduler-blocking-1")
+
+if test_ids == [] or "subtitles-1" in test_ids:
+    run_subtitles_test("subtitles-1")
+
+if test_ids == [] or "plan-1" in test_ids:
+    run_plan_test("plan-1")
+
+if test_ids == [] or "finaldir-1" in test_ids:
+    run_finaldir_test("finaldir-1")
+
+if test_ids == [] or "journal-1" in test_ids:
+    run_journal_test("journal-1")
+
+if test_ids == [] or "timings-1" in test_ids:
+    run_timings_test("timings-1")
+
+if test_ids == [] or "profile-1" in test_ids:
+    run_profile_test("profile-1")
+
+if test_ids == [] or "metrics-1" in test_ids:
+    run_metrics_test("metrics-1")
+
+if test_ids == [] or "rules-profile-1" in test_ids:
+    run_rules_profile_test("rules-profile-1")
+
+if test_ids == [] or "vfs-1" in test_ids:
+    run_vfs_test("vfs-1")
+
+for placement_test in placement_tests:
+    if test_ids == [] or placement_test[0] in test_ids:
+        run_placement_test(*placement_test)
+
+if test_ids == [] or "cleanup-1" in test_ids:
+    run_cleanup_test("cleanup-1")
+
+if test_ids == [] or "streaming-1" in test_ids:
+    run_streaming_test("streaming-1")
+
+if test_ids == [] or "options-1" in test_ids:
+    run_options_test("options-1")
+
+if test_ids == [] or "deobfuscation-1" in test_ids:
+    run_deobfuscation_test("deobfuscation-1")
+
+if test_ids == [] or "obfuscation-1" in test_ids:
+    run_obfuscation_test("obfuscation-1")
+
+if test_ids == [] or "knowledge-1" in test_ids:
+    run_knowledge_test("knowledge-1")
+
+if test_ids == [] or "library-1" in test_ids:
+    run_library_test("library-1")
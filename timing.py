@@ -0,0 +1,130 @@
+import sys
+import json
+import time
+import threading
+import functools
+import contextlib
+from collections import Counter
+from pathlib import Path
+
+
+class Timings:
+    """
+    Wall time per stage of a job (e.g. "guess_info" or "move_file"), plus counters
+    such as the bytes copied and the file system calls made.
+
+    Timings are disabled by default: `span` then returns a shared no-op context and
+    the functions wrapped with `timed` only check a flag, so the instrumentation
+    costs next to nothing unless the "Timings" option is set.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        # Stage -> [count, total seconds, max seconds]
+        self.stages = {}
+        self.counters = Counter()
+        # File system calls per audit event, e.g. "os.rename" or "open"
+        self.syscalls = Counter()
+        self._audit_hook = False
+
+    def enable(self):
+        """Starts recording timings; the file system calls are counted with an
+        audit hook, which is only installed once timings are enabled."""
+        self.enabled = True
+        if not self._audit_hook:
+            sys.addaudithook(self._audit)
+            self._audit_hook = True
+
+    def _audit(self, event, args):
+        if self.enabled and (event == "open" or event.startswith("os.")):
+            with self.lock:
+                self.syscalls[event] += 1
+
+    def record(self, stage: str, seconds: float):
+        """Adds one run of `stage` which took `seconds`."""
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                self.stages[stage] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def add(self, counter: str, value: int = 1):
+        """Adds `value` to `counter`, e.g. the bytes copied."""
+        if self.enabled:
+            with self.lock:
+                self.counters[counter] += value
+
+    def span(self, stage: str):
+        """Returns a context manager timing the code it wraps as `stage`."""
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(stage)
+
+    @contextlib.contextmanager
+    def _span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "version": Timings.VERSION,
+                "stages": {
+                    stage: {"count": count, "total": total, "max": maximum}
+                    for stage, (count, total, maximum) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+                "syscalls": dict(self.syscalls),
+            }
+
+    def summary(self) -> str:
+        """Returns the timings as log lines of `key=value` pairs, one per stage."""
+        timings = self.to_dict()
+        lines = [
+            f"timings: stage={stage} count={stats['count']} total={stats['total']:.3f}s max={stats['max']:.3f}s"
+            for stage, stats in timings["stages"].items()
+        ]
+        counters = [
+            f"{counter}={value}" for counter, value in timings["counters"].items()
+        ]
+        counters.append(f"syscalls={sum(timings['syscalls'].values())}")
+        lines.append(f"timings: {' '.join(counters)}")
+        return "\n".join(lines)
+
+    def write(self, path: Path):
+        """Writes the timings as JSON to `path`."""
+        path.write_text(json.dumps(self.to_dict(), indent=2) + "\n", encoding="utf-8")
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+# Timings of the job run by this process
+timings = Timings()
+
+
+def timed(stage: str):
+    """Decorates a function to record its calls as `stage` in `timings`."""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def call(*args, **kwargs):
+            if not timings.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.record(stage, time.perf_counter() - start)
+
+        return call
+
+    return decorate
@@ -0,0 +1,220 @@
+import errno
+import glob
+import os
+import time
+from pathlib import Path
+from nzbget_utils import logdet, loginf
+from timing import timings
+
+
+class TransferEngine:
+    """
+    Moves files between file systems, e.g. from the download directory to a library
+    on a NAS mount, when a plain rename is not possible.
+
+    The data is copied with the kernel fast paths where available: `copy_file_range`
+    (which lets the file system clone or copy server-side, e.g. btrfs, XFS or NFS 4.2)
+    and `sendfile`, with a plain read/write loop as last resort. The destination is
+    preallocated with `posix_fallocate` so large files are laid out contiguously and
+    running out of space is detected before any data is copied.
+
+    The file is written to a temporary name next to the destination and only renamed
+    into place once its size has been verified, so an interrupted transfer never
+    leaves a truncated file under the final name.
+    """
+
+    # Bytes per copy_file_range/sendfile call
+    CHUNK_SIZE = 64 << 20
+    # Bytes per read/write call of the fallback loop
+    BUFFER_SIZE = 1 << 20
+    # Seconds between two progress messages
+    PROGRESS_INTERVAL = 10.0
+
+    # Copy methods in the order in which they are tried
+    METHODS = ("copy_file_range", "sendfile", "readwrite")
+
+    # Sync policies: "no" leaves flushing to the kernel, "data" calls fdatasync on
+    # the destination before it is renamed into place, "full" also fsyncs the
+    # destination directory after the rename
+    SYNC_POLICIES = ("no", "data", "full")
+
+    # Errors that indicate that a copy method is not supported for a pair of files
+    _UNSUPPORTED_ERRNOS = frozenset(
+        (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+    )
+
+    def __init__(self, sync: str = "no", methods=None):
+        """
+        Args:
+            sync (str): One of `SYNC_POLICIES`.
+            methods (tuple, optional): Copy methods to try, a subset of `METHODS`.
+        """
+        assert sync in TransferEngine.SYNC_POLICIES
+        self.sync = sync
+        self.methods = [
+            method
+            for method in (methods or TransferEngine.METHODS)
+            if method == "readwrite" or hasattr(os, method)
+        ]
+        # (method, source device, destination device) found not to be supported ->
+        # the error which showed it
+        self.unsupported = {}
+
+    @staticmethod
+    def temp_name(dst_file: Path) -> Path:
+        """Returns the temporary name under which `dst_file` is written."""
+        return dst_file.with_name(f".{dst_file.name}.{os.getpid()}.part")
+
+    @staticmethod
+    def remove_stale(dst_file: Path):
+        """Removes temporary files of `dst_file` left behind by an interrupted run."""
+        for tmp_file in dst_file.parent.glob(f".{glob.escape(dst_file.name)}.*.part"):
+            tmp_file.unlink(missing_ok=True)
+
+    def move(self, src_file: Path, dst_file: Path) -> Path:
+        """Copies `src_file` to `dst_file` and removes `src_file` afterwards.
+
+        Returns:
+            Path: The destination file.
+        """
+        self.copy(src_file, dst_file)
+        src_file.unlink()
+        return dst_file
+
+    def copy(self, src_file: Path, dst_file: Path) -> int:
+        """Copies `src_file` to `dst_file` through a temporary file.
+
+        Returns:
+            int: The number of bytes copied.
+
+        Raises:
+            OSError: If the copy fails or the copied size does not match the source;
+                the temporary file is removed in that case.
+        """
+        tmp_file = TransferEngine.temp_name(dst_file)
+        start = time.perf_counter()
+        try:
+            with open(src_file, "rb") as src, open(tmp_file, "xb") as dst:
+                size = os.fstat(src.fileno()).st_size
+                TransferEngine._preallocate(dst.fileno(), size)
+                method, copied = self._copy_data(src.fileno(), dst.fileno(), size)
+                # The size of the file is set by the preallocation, so only the
+                # bytes copied tell whether the copy is complete
+                if copied != size:
+                    raise OSError(
+                        errno.EIO,
+                        f"copied {copied} of {size} bytes",
+                        str(src_file),
+                    )
+                if self.sync != "no":
+                    # fdatasync is missing on Windows and macOS
+                    getattr(os, "fdatasync", os.fsync)(dst.fileno())
+            os.replace(tmp_file, dst_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+
+        if self.sync == "full":
+            TransferEngine._sync_directory(dst_file.parent)
+
+        elapsed = time.perf_counter() - start
+        timings.add("bytes_copied", size)
+        loginf(
+            f'transfer: "{src_file}" -> "{dst_file}": {TransferEngine._human(size)} in {elapsed:.2f}s ({TransferEngine._human(size / max(elapsed, 1e-9))}/s, {method})'
+        )
+        return size
+
+    def _copy_data(self, src_fd: int, dst_fd: int, size: int):
+        """Copies `size` bytes with the first copy method that works.
+
+        Returns:
+            tuple: (method, copied) where `method` is the name of the method used.
+        """
+        copied = 0
+        devices = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+        for method in self.methods:
+            # Logged for every file, so that the log of a file does not depend on
+            # whether another file running concurrently found out first
+            reason = self.unsupported.get((method, *devices))
+            if reason is not None:
+                logdet(f"transfer: {method} not supported ({reason})")
+                continue
+            try:
+                copied = self._copy_with(method, src_fd, dst_fd, copied, size)
+                return method, copied
+            except OSError as ex:
+                if ex.errno not in TransferEngine._UNSUPPORTED_ERRNOS:
+                    raise
+                logdet(f"transfer: {method} not supported ({ex})")
+                self.unsupported[(method, *devices)] = str(ex)
+                # Continue where the previous method left off
+                copied = os.lseek(dst_fd, 0, os.SEEK_CUR)
+        raise OSError(errno.ENOTSUP, "no copy method available")
+
+    def _copy_with(
+        self, method: str, src_fd: int, dst_fd: int, copied: int, size: int
+    ) -> int:
+        """Copies from offset `copied` up to `size` bytes with the given method.
+
+        Returns:
+            int: The offset up to which the data has been copied.
+        """
+        os.lseek(src_fd, copied, os.SEEK_SET)
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+        next_progress = time.perf_counter() + TransferEngine.PROGRESS_INTERVAL
+        while copied < size:
+            count = min(TransferEngine.CHUNK_SIZE, size - copied)
+            if method == "copy_file_range":
+                done = os.copy_file_range(src_fd, dst_fd, count)
+            elif method == "sendfile":
+                done = os.sendfile(dst_fd, src_fd, None, count)
+            else:
+                buffer = os.read(src_fd, min(TransferEngine.BUFFER_SIZE, count))
+                done = len(buffer)
+                view = memoryview(buffer)
+                while view:
+                    view = view[os.write(dst_fd, view) :]
+            if done == 0:
+                if copied == 0 and method != "readwrite":
+                    # Some file systems (e.g. procfs and FUSE, or another file
+                    # system on older kernels) copy nothing instead of failing
+                    raise OSError(errno.EOPNOTSUPP, f"{method} copied no data")
+                # The source file was truncated while copying
+                break
+            copied += done
+            if time.perf_counter() >= next_progress:
+                logdet(f"transfer: {copied * 100 // size}% ({method})")
+                next_progress += TransferEngine.PROGRESS_INTERVAL
+        return copied
+
+    @staticmethod
+    def _preallocate(fd: int, size: int):
+        """Preallocates `size` bytes if the file system supports it."""
+        if size == 0 or not hasattr(os, "posix_fallocate"):
+            return
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as ex:
+            if ex.errno not in TransferEngine._UNSUPPORTED_ERRNOS:
+                raise
+            logdet(f"transfer: posix_fallocate not supported ({ex})")
+
+    @staticmethod
+    def _sync_directory(directory: Path):
+        """Makes a rename in `directory` durable. Windows can neither open nor sync
+        directories, and makes renames durable with the file."""
+        if os.name == "nt":
+            return
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _human(size: float) -> str:
+        for unit in ["B", "kB", "MB", "GB", "TB"]:
+            if size < 1024.0:
+                return f"{size:.2f}{unit}"
+            size /= 1024.0
+        return f"{size:.2f}PB"
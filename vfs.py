@@ -0,0 +1,233 @@
+import io
+import os
+import time
+import builtins
+import threading
+import weakref
+from collections import Counter
+from pathlib import Path
+
+
+class LatencyModel:
+    """
+    How long file system operations take on a simulated share, e.g. a NAS mount: a
+    fixed latency per call (the round trip to the server), optionally per operation,
+    plus the time to move the data at the given bandwidth.
+    """
+
+    def __init__(
+        self, latency: float = 0.0, bandwidth: float = None, per_operation=None
+    ):
+        """
+        Args:
+            latency (float): Seconds per call.
+            bandwidth (float, optional): Bytes per second read or written, None for
+                unlimited.
+            per_operation (dict, optional): Seconds per call of single operations
+                (e.g. {"stat": 0.001}), overriding `latency`.
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.per_operation = per_operation or {}
+
+    def delay(self, operation: str, size: int = 0) -> float:
+        """Returns the seconds that `operation` on `size` bytes takes."""
+        seconds = self.per_operation.get(operation, self.latency)
+        if self.bandwidth and size:
+            seconds += size / self.bandwidth
+        return seconds
+
+
+class SimulatedFS:
+    """
+    Simulates a slow file system below `root` on top of a local directory, without
+    network or FUSE: the file system calls of the `os` module and `open` on paths
+    below `root` (or on file descriptors opened there) are delayed according to a
+    `LatencyModel` and counted.
+
+    The calls are interposed while the `SimulatedFS` is entered, so `Apply`,
+    `Determine` and the standard library functions they use (`os.walk`, `pathlib`,
+    `shutil`) go through it unchanged:
+
+        with SimulatedFS(library_dir, LatencyModel(0.005)) as fs:
+            Apply().run()
+        print(fs.calls)
+
+    Data read or written through `os` calls (e.g. by the `TransferEngine`) is
+    charged with the bandwidth of the model; reads and writes of file objects
+    returned by `open` only count as the `open` call.
+    """
+
+    # Operations which take paths: (name, positions of the path arguments)
+    PATH_OPERATIONS = {
+        "stat": (0,),
+        "lstat": (0,),
+        "scandir": (0,),
+        "listdir": (0,),
+        "mkdir": (0,),
+        "rmdir": (0,),
+        "unlink": (0,),
+        "utime": (0,),
+        "chmod": (0,),
+        "rename": (0, 1),
+        "replace": (0, 1),
+        "link": (0, 1),
+        "symlink": (1,),
+    }
+
+    # Operations which move data between file descriptors: (name, positions of the
+    # file descriptor arguments)
+    DATA_OPERATIONS = {
+        "read": (0,),
+        "pread": (0,),
+        "write": (0,),
+        "pwrite": (0,),
+        "copy_file_range": (0, 1),
+        "sendfile": (0, 1),
+    }
+
+    def __init__(self, root: Path, model: LatencyModel = None):
+        self.root = os.path.abspath(root)
+        self.model = model if model else LatencyModel()
+        # Calls per operation
+        self.calls = Counter()
+        # Bytes moved per operation
+        self.bytes = Counter()
+        # Seconds of simulated latency and transfer time
+        self.delayed = 0.0
+        self.lock = threading.Lock()
+        # Simulated file descriptors -> True for raw descriptors or a weak
+        # reference to the file object owning the descriptor
+        self.fds = {}
+        self.originals = {}
+
+    def syscalls(self) -> int:
+        """Returns the number of simulated calls."""
+        return sum(self.calls.values())
+
+    def reset(self):
+        """Resets the statistics."""
+        with self.lock:
+            self.calls.clear()
+            self.bytes.clear()
+            self.delayed = 0.0
+
+    def __enter__(self):
+        for name, positions in SimulatedFS.PATH_OPERATIONS.items():
+            if hasattr(os, name):
+                self._patch(os, name, self._path_operation(name, positions))
+        for name, positions in SimulatedFS.DATA_OPERATIONS.items():
+            if hasattr(os, name):
+                self._patch(os, name, self._data_operation(name, positions))
+        self._patch(os, "open", self._os_open())
+        self._patch(os, "close", self._os_close())
+        opener = self._open()
+        self._patch(builtins, "open", opener)
+        self._patch(io, "open", opener)
+        return self
+
+    def __exit__(self, *exc_info):
+        for (module, name), function in self.originals.items():
+            setattr(module, name, function)
+        self.originals = {}
+
+    def _patch(self, module, name, function):
+        self.originals[(module, name)] = getattr(module, name)
+        setattr(module, name, function)
+
+    def _is_simulated_path(self, path) -> bool:
+        if isinstance(path, int):
+            return self._is_simulated_fd(path)
+        try:
+            path = os.path.abspath(os.fsdecode(path))
+        except TypeError:
+            return False
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def _is_simulated_fd(self, fd) -> bool:
+        owner = self.fds.get(fd)
+        if owner is None or owner is True:
+            return owner is True
+        file = owner()
+        return file is not None and not file.closed
+
+    def _simulate(self, operation: str, size: int = 0):
+        seconds = self.model.delay(operation, size)
+        with self.lock:
+            self.calls[operation] += 1
+            self.bytes[operation] += size
+            self.delayed += seconds
+        if seconds > 0:
+            # Sleeping releases the GIL, as waiting for the network does
+            time.sleep(seconds)
+
+    def _path_operation(self, name, positions):
+        function = getattr(os, name)
+
+        def call(*args, **kwargs):
+            dir_fd = kwargs.get("dir_fd")
+            if (dir_fd is not None and self._is_simulated_fd(dir_fd)) or any(
+                position < len(args) and self._is_simulated_path(args[position])
+                for position in positions
+            ):
+                self._simulate(name)
+            return function(*args, **kwargs)
+
+        return call
+
+    def _data_operation(self, name, positions):
+        function = getattr(os, name)
+
+        def call(*args, **kwargs):
+            result = function(*args, **kwargs)
+            if any(
+                isinstance(args[position], int)
+                and self._is_simulated_fd(args[position])
+                for position in positions
+                if position < len(args)
+            ):
+                size = len(result) if isinstance(result, bytes) else result
+                self._simulate(name, size)
+            return result
+
+        return call
+
+    def _os_open(self):
+        function = os.open
+
+        def call(path, *args, **kwargs):
+            dir_fd = kwargs.get("dir_fd")
+            simulated = (
+                dir_fd is not None and self._is_simulated_fd(dir_fd)
+            ) or self._is_simulated_path(path)
+            if simulated:
+                self._simulate("open")
+            fd = function(path, *args, **kwargs)
+            if simulated:
+                self.fds[fd] = True
+            return fd
+
+        return call
+
+    def _os_close(self):
+        function = os.close
+
+        def call(fd):
+            self.fds.pop(fd, None)
+            return function(fd)
+
+        return call
+
+    def _open(self):
+        function = builtins.open
+
+        def call(file, *args, **kwargs):
+            simulated = not isinstance(file, int) and self._is_simulated_path(file)
+            if simulated:
+                self._simulate("open")
+            opened = function(file, *args, **kwargs)
+            if simulated:
+                self.fds[opened.fileno()] = weakref.ref(opened)
+            return opened
+
+        return call